@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module packages installed requirements as a single uncompressed archive,
+which `wsgi_handler` adds to `sys.path` to import pure Python packages with
+`zipimport`. Packages with native extensions or data files can't be used from
+inside an archive, so they are listed in an index stored in the archive and
+extracted to /tmp when first imported.
+
+Author: Logan Raarup <logan@logan.dk>
+"""
+import argparse
+import fnmatch
+import json
+import os
+import sys
+import zipfile
+
+from prune import ARCHIVE_NAME as PRUNED_ARCHIVE_NAME
+from prune import MANIFEST_NAME, NATIVE_PATTERNS, format_size
+
+# Name of the archive, also expected by `wsgi_handler`
+ARCHIVE_NAME = ".requirements.zip"
+
+# Entry of the archive listing the packages to extract when imported
+INDEX_NAME = ".serverless-wsgi-extract.json"
+
+# Files that don't prevent a package from being imported from the archive
+CODE_PATTERNS = ["*.py", "*.pyc", "*.pyi", "py.typed"]
+
+# Packages with data files, that only access them through `pkgutil` or
+# `importlib.resources`, which both support archives
+DEFAULT_ZIP_SAFE = ["werkzeug", "certifi"]
+
+# Fixed timestamp, so unchanged requirements produce an identical archive. As
+# a result, `zipimport` never uses timestamp-based bytecode, which is left out
+DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def get_package(path):
+    """Top-level import name that a file belongs to"""
+    name = path.split("/", 1)[0]
+    if "/" in path:
+        return name
+    return name.split(".", 1)[0]
+
+
+def get_bytecode_path(path, cache_tag):
+    """
+    Map bytecode compiled by `compileall` to the location `zipimport` loads it
+    from, next to its source. Bytecode of other interpreters and optimization
+    levels is not loaded by `zipimport` and is skipped by returning None.
+    """
+    parts = path.split("/")
+    if len(parts) < 2 or parts[-2] != "__pycache__":
+        return path
+    name, _, tag = parts[-1][: -len(".pyc")].partition(".")
+    if tag != cache_tag:
+        return None
+    return "/".join(parts[:-2] + [name + ".pyc"])
+
+
+def is_hash_based(path):
+    """Whether bytecode is validated by a hash of its source, see PEP 552"""
+    with open(path, "rb") as f:
+        header = f.read(8)
+    return len(header) == 8 and int.from_bytes(header[4:8], "little") & 1 == 1
+
+
+def get_extracted_packages(files, zip_safe=(), extract=()):
+    """
+    Select the top-level packages that have to be extracted, as they contain
+    native extensions or data files, along with the directories of shared
+    libraries that `auditwheel` vendors next to packages, such as `numpy.libs`.
+    """
+    packages = set(extract)
+    libs = set()
+    for path in files:
+        package = get_package(path)
+        filename = path.rsplit("/", 1)[-1]
+        if package.endswith(".libs"):
+            libs.add(package)
+        elif any(fnmatch.fnmatch(filename, pattern) for pattern in NATIVE_PATTERNS):
+            packages.add(package)
+        elif package not in zip_safe and not any(
+            fnmatch.fnmatch(filename, pattern) for pattern in CODE_PATTERNS
+        ):
+            packages.add(package)
+    return sorted(packages), sorted(libs)
+
+
+def list_archived_files(requirements_dir):
+    files = []
+    for root, dirs, filenames in os.walk(requirements_dir, followlinks=True):
+        dirs.sort()
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            relative = os.path.relpath(path, requirements_dir).replace(os.sep, "/")
+            if relative not in (ARCHIVE_NAME, PRUNED_ARCHIVE_NAME, MANIFEST_NAME):
+                files.append(relative)
+    return sorted(files)
+
+
+def build_archive(requirements_dir, zip_safe=None, extract=(), cache_tag=None):
+    """
+    Write the archive into the requirements directory. Entries are stored
+    uncompressed and sorted by path, so each package is contiguous in the
+    archive and `zipimport` reads modules without decompressing them.
+    """
+    if zip_safe is None:
+        zip_safe = DEFAULT_ZIP_SAFE
+    if cache_tag is None:
+        cache_tag = sys.implementation.cache_tag
+
+    files = list_archived_files(requirements_dir)
+    packages, libs = get_extracted_packages(files, zip_safe, extract)
+    extracted = set(packages)
+
+    entries = {}
+    for path in files:
+        # Extracted packages are imported from the file system, where bytecode
+        # is found in `__pycache__`
+        if get_package(path) in extracted or get_package(path) in libs:
+            entries[path] = path
+            continue
+        name = path
+        if path.endswith(".pyc"):
+            name = get_bytecode_path(path, cache_tag)
+            if name is not None and not is_hash_based(
+                os.path.join(requirements_dir, path)
+            ):
+                name = None
+        if name is not None:
+            entries[name] = path
+
+    archive = os.path.join(requirements_dir, ARCHIVE_NAME)
+    tmp_archive = archive + ".tmp"
+    size = 0
+    with zipfile.ZipFile(tmp_archive, "w", zipfile.ZIP_STORED) as zf:
+        info = zipfile.ZipInfo(INDEX_NAME, DATE_TIME)
+        zf.writestr(info, json.dumps({"extract": packages, "libs": libs}))
+        for name in sorted(entries):
+            path = os.path.join(requirements_dir, entries[name])
+            info = zipfile.ZipInfo(name, DATE_TIME)
+            info.external_attr = (os.stat(path).st_mode & 0o777) << 16
+            with open(path, "rb") as f:
+                data = f.read()
+            zf.writestr(info, data)
+            size += len(data)
+    os.replace(tmp_archive, archive)
+
+    print(
+        "Archived {} files of requirements ({}) into {}".format(
+            len(entries), format_size(size), ARCHIVE_NAME
+        )
+    )
+    if packages:
+        print("Extracted on import: {}".format(", ".join(packages)))
+
+
+def parse_args():  # pragma: no cover
+    parser = argparse.ArgumentParser(description="serverless-wsgi requirements archiver")
+    parser.add_argument("requirements_dir", help="Directory of installed requirements")
+    parser.add_argument(
+        "--zip-safe",
+        action="append",
+        default=[],
+        help="Package with data files that can be imported from the archive",
+    )
+    parser.add_argument(
+        "--extract",
+        action="append",
+        default=[],
+        help="Package to extract when imported, even if it is pure Python",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    args = parse_args()
+    build_archive(
+        args.requirements_dir, DEFAULT_ZIP_SAFE + args.zip_safe, args.extract
+    )
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import archive
+import compileall
+import json
+import py_compile
+import zipfile
+import zipimport
+
+
+def test_get_package():
+    assert archive.get_package("flask/app.py") == "flask"
+    assert archive.get_package("six.py") == "six"
+    assert archive.get_package("_cffi_backend.cpython-311-x86_64-linux-gnu.so") == (
+        "_cffi_backend"
+    )
+    assert archive.get_package("numpy.libs/libgfortran.so.5") == "numpy.libs"
+
+
+def test_get_bytecode_path():
+    assert archive.get_bytecode_path(
+        "pkg/__pycache__/mod.cpython-311.pyc", "cpython-311"
+    ) == "pkg/mod.pyc"
+    assert (
+        archive.get_bytecode_path("__pycache__/six.cpython-311.pyc", "cpython-311")
+        == "six.pyc"
+    )
+    assert (
+        archive.get_bytecode_path("pkg/__pycache__/mod.cpython-310.pyc", "cpython-311")
+        is None
+    )
+    assert (
+        archive.get_bytecode_path(
+            "pkg/__pycache__/mod.cpython-311.opt-1.pyc", "cpython-311"
+        )
+        is None
+    )
+
+
+def test_is_hash_based(tmp_path):
+    source = tmp_path / "mod.py"
+    source.write_text("VALUE = 1\n")
+    for mode, expected in (
+        (py_compile.PycInvalidationMode.TIMESTAMP, False),
+        (py_compile.PycInvalidationMode.CHECKED_HASH, True),
+        (py_compile.PycInvalidationMode.UNCHECKED_HASH, True),
+    ):
+        pyc = py_compile.compile(str(source), invalidation_mode=mode)
+        assert archive.is_hash_based(pyc) is expected
+
+
+def test_get_extracted_packages():
+    files = [
+        "flask/__init__.py",
+        "flask/py.typed",
+        "markupsafe/__init__.py",
+        "markupsafe/_speedups.cpython-311-x86_64-linux-gnu.so",
+        "botocore/data/endpoints.json",
+        "werkzeug/debug/shared/style.css",
+        "numpy.libs/libgfortran.so.5",
+        "six.py",
+    ]
+
+    assert archive.get_extracted_packages(files, ["werkzeug"], ["six"]) == (
+        ["botocore", "markupsafe", "six"],
+        ["numpy.libs"],
+    )
+
+
+def test_build_archive(tmp_path, capsys):
+    for path in (
+        "pkg/__init__.py",
+        "pkg/sub/mod.py",
+        "native/__init__.py",
+        "native/_ext.so",
+        ".requirements-manifest.json",
+        ".pruned-requirements.zip",
+    ):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("VALUE = 1\n")
+    compileall.compile_dir(
+        str(tmp_path),
+        quiet=1,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+    )
+    (tmp_path / "pkg/stale.py").write_text("VALUE = 1\n")
+    py_compile.compile(
+        str(tmp_path / "pkg/stale.py"),
+        invalidation_mode=py_compile.PycInvalidationMode.TIMESTAMP,
+    )
+
+    archive.build_archive(str(tmp_path))
+    # Rebuilding leaves out the previous archive
+    archive.build_archive(str(tmp_path))
+
+    with zipfile.ZipFile(str(tmp_path / ".requirements.zip")) as zf:
+        names = zf.namelist()
+        assert names[0] == ".serverless-wsgi-extract.json"
+        assert names[1:] == sorted(names[1:])
+        assert json.loads(zf.read(names[0])) == {"extract": ["native"], "libs": []}
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zf.infolist())
+        assert all(info.date_time == archive.DATE_TIME for info in zf.infolist())
+
+    assert "pkg/__init__.pyc" in names
+    assert "pkg/sub/mod.pyc" in names
+    assert not any(name.startswith("pkg/__pycache__") for name in names)
+    # Timestamp-based bytecode never matches the fixed time of the source
+    assert "pkg/stale.py" in names
+    assert "pkg/stale.pyc" not in names
+    assert "native/_ext.so" in names
+    assert any(name.startswith("native/__pycache__/") for name in names)
+    assert ".requirements-manifest.json" not in names
+    assert ".pruned-requirements.zip" not in names
+
+    # Bytecode is imported without checking the source
+    importer = zipimport.zipimporter(str(tmp_path / ".requirements.zip/pkg/sub"))
+    assert importer.get_code("mod").co_filename.endswith("mod.py")
+
+    out = capsys.readouterr().out
+    assert "into .requirements.zip" in out
+    assert "Extracted on import: native" in out
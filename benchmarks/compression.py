@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module benchmarks response compression, reporting the size of the Lambda
+response payload and the latency of `serverless_wsgi.handle_request` for a
+range of JSON body sizes, with and without compression.
+
+Usage: python benchmarks/compression.py [--iterations N]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serverless_wsgi  # noqa: E402
+
+BODY_SIZES = [512, 4 * 1024, 64 * 1024, 1024 * 1024, 5 * 1024 * 1024]
+
+
+def make_body(size):
+    """Generate a JSON document of roughly `size` bytes"""
+    records = []
+    length = 2
+    while length < size:
+        record = {
+            "id": len(records),
+            "name": "Item {}".format(len(records)),
+            "tags": ["alpha", "beta", "gamma"],
+            "price": len(records) * 1.25,
+        }
+        records.append(record)
+        length += len(json.dumps(record)) + 2
+    return json.dumps(records).encode("utf-8")
+
+
+def make_app(body):
+    def app(environ, start_response):
+        start_response(
+            "200 OK",
+            [("Content-Type", "application/json"), ("Content-Length", str(len(body)))],
+        )
+        return [body]
+
+    return app
+
+
+def make_event():
+    return {
+        "version": "2.0",
+        "rawPath": "/items",
+        "rawQueryString": "",
+        "headers": {
+            "accept-encoding": "gzip, deflate, br",
+            "host": "api.example.com",
+        },
+        "requestContext": {"http": {"method": "GET", "sourceIp": "127.0.0.1"}},
+        "isBase64Encoded": False,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response compression")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    variants = [("none", serverless_wsgi.Settings.load({}))]
+    for encoding in serverless_wsgi.COMPRESSORS:
+        variants.append(
+            (
+                encoding,
+                serverless_wsgi.Settings.load(
+                    {"compression": {"encodings": [encoding]}}
+                ),
+            )
+        )
+
+    print("{:>10} {:>8} {:>12} {:>8} {:>12}".format(
+        "body", "encoding", "payload", "ratio", "latency (ms)"
+    ))
+    for size in BODY_SIZES:
+        app = make_app(make_body(size))
+        event = make_event()
+        for name, settings in variants:
+            result = serverless_wsgi.handle_request(app, event, {}, settings)
+            payload = len(json.dumps(result))
+            seconds = timeit.timeit(
+                lambda: serverless_wsgi.handle_request(app, event, {}, settings),
+                number=args.iterations,
+            )
+            print("{:>10} {:>8} {:>12} {:>8.2f} {:>12.3f}".format(
+                size, name, payload, payload / size, seconds / args.iterations * 1000
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module benchmarks building the WSGI environ from API Gateway events with
+typical numbers of request headers, comparing the single-pass builder in
+`serverless_wsgi` to the previous approach of mapping the headers through a
+werkzeug `Headers` object.
+
+Usage: python benchmarks/environ.py [--iterations N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+from werkzeug.datastructures import Headers
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serverless_wsgi  # noqa: E402
+
+HEADER_COUNTS = [20, 40]
+
+
+def make_event(header_count):
+    headers = {
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate, br",
+        "Content-Type": "application/json",
+        "Host": "3z6kd9fbb1.execute-api.us-east-1.amazonaws.com",
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64)",
+        "X-Forwarded-For": "76.20.166.147, 205.251.218.72",
+        "X-Forwarded-Port": "443",
+        "X-Forwarded-Proto": "https",
+    }
+    for i in range(header_count - len(headers)):
+        headers["X-Custom-Header-{}".format(i)] = "value-{}".format(i)
+
+    return {
+        "httpMethod": "POST",
+        "path": "/items",
+        "headers": headers,
+        "queryStringParameters": {"page": "2"},
+        "requestContext": {"identity": {"sourceIp": "76.20.166.147"}, "stage": "dev"},
+        "body": '{"name": "item"}',
+        "isBase64Encoded": False,
+    }
+
+
+def legacy_environ_items(environ, event):
+    """Header mapping as previously done through werkzeug `Headers`"""
+    headers = Headers(event["headers"])
+    environ["CONTENT_TYPE"] = headers.get("Content-Type", "")
+    environ["SERVER_NAME"] = headers.get("Host", "lambda")
+    environ["SERVER_PORT"] = headers.get("X-Forwarded-Port", "443")
+    environ["wsgi.url_scheme"] = headers.get("X-Forwarded-Proto", "https")
+
+    for key, value in environ.items():
+        if isinstance(value, str):
+            environ[key] = value.encode("utf-8").decode("latin1", "replace")
+
+    for key, value in headers.items():
+        key = "HTTP_" + key.upper().replace("-", "_")
+        if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            environ[key] = value
+    return environ
+
+
+def single_pass_environ_items(environ, event):
+    headers = serverless_wsgi.get_header_environ(event["headers"])
+    environ["CONTENT_TYPE"] = headers.get("HTTP_CONTENT_TYPE", "")
+    environ["SERVER_NAME"] = headers.get("HTTP_HOST", "lambda")
+    environ["SERVER_PORT"] = headers.get("HTTP_X_FORWARDED_PORT", "443")
+    environ["wsgi.url_scheme"] = headers.get("HTTP_X_FORWARDED_PROTO", "https")
+    return serverless_wsgi.setup_environ_items(environ, headers)
+
+
+def base_environ():
+    return {
+        "PATH_INFO": "/items",
+        "QUERY_STRING": "page=2",
+        "REMOTE_ADDR": "76.20.166.147",
+        "REQUEST_METHOD": "POST",
+        "SCRIPT_NAME": "/dev",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark environ construction")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    settings = serverless_wsgi.Settings.load({}, {})
+
+    print("{:>8} {:>24} {:>10}".format("headers", "variant", "usec/call"))
+    for header_count in HEADER_COUNTS:
+        event = make_event(header_count)
+        variants = [
+            ("legacy header mapping", lambda: legacy_environ_items(base_environ(), event)),
+            ("single-pass mapping", lambda: single_pass_environ_items(base_environ(), event)),
+            ("get_environ_v1", lambda: serverless_wsgi.get_environ_v1(event, {}, settings)),
+        ]
+        for name, func in variants:
+            seconds = timeit.timeit(func, number=args.iterations)
+            print("{:>8} {:>24} {:>10.2f}".format(
+                header_count, name, seconds / args.iterations * 1e6
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module benchmarks the memory used to return binary responses, reporting the
+peak allocation traced by `tracemalloc` while `serverless_wsgi.handle_request`
+renders image responses of 1 MB to 5 MB, relative to the size of the image.
+
+Usage: python benchmarks/memory.py
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serverless_wsgi  # noqa: E402
+
+BODY_SIZES = [1024 * 1024 * n for n in range(1, 6)]
+
+
+def make_app(size):
+    def app(environ, start_response):
+        # The image is created on each request, so that it is owned by the
+        # response, as it would be when read from a file or rendered
+        body = os.urandom(size)
+        start_response(
+            "200 OK",
+            [("Content-Type", "image/png"), ("Content-Length", str(size))],
+        )
+        return [body]
+
+    return app
+
+
+def make_event():
+    return {
+        "httpMethod": "GET",
+        "path": "/image.png",
+        "headers": {"Host": "localhost", "Accept": "image/png"},
+        "requestContext": {},
+        "body": None,
+        "isBase64Encoded": False,
+    }
+
+
+def main():
+    settings = serverless_wsgi.Settings.load({}, {})
+
+    # Warm up caches, so that only the memory used by the response is traced
+    serverless_wsgi.handle_request(make_app(1024), make_event(), {}, settings)
+
+    print("{:>10} {:>12} {:>8}".format("body", "peak", "ratio"))
+    for size in BODY_SIZES:
+        app = make_app(size)
+        tracemalloc.start()
+        response = serverless_wsgi.handle_request(app, make_event(), {}, settings)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert response["isBase64Encoded"]
+        del response
+
+        print(
+            "{:>9}M {:>11.1f}M {:>8.2f}".format(
+                size // (1024 * 1024), peak / (1024 * 1024), peak / size
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
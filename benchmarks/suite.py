@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module benchmarks the event translation layer offline, measuring the latency
+and peak memory allocation per invocation of `serverless_wsgi.handle_request` and
+`wsgi_handler.handler` for synthetic API Gateway v1, v2, ALB and lambda
+integration events, using a WSGI application that echoes the request body.
+
+Results are compared to the stored baseline, and the run fails when the peak
+allocation of a scenario regresses beyond the memory threshold, as it is the same
+on every run. Latency is reported relative to a reference workload timed
+alternately with each scenario, but varies too much between runs and machines to
+fail on by default; pass `--latency-threshold` to also fail on latency. Record a
+new baseline with `--save` after intended changes.
+
+Usage: python benchmarks/suite.py [--save] [--baseline PATH] [--filter TEXT]
+"""
+import argparse
+import base64
+import importlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import serverless_wsgi  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Request bodies, by name: (content type, body size, binary)
+BODIES = {
+    "small": ("application/json", 64, False),
+    "large": ("application/json", 256 * 1024, False),
+    "binary": ("image/png", 64 * 1024, True),
+}
+
+# Header sets, by name: (number of headers, number of cookies)
+HEADERS = {
+    "few": (8, 1),
+    "many": (40, 20),
+}
+
+APP_MODULE = '''
+def app(environ, start_response):
+    length = int(environ.get("CONTENT_LENGTH") or 0)
+    body = environ["wsgi.input"].read(length)
+    start_response(
+        "200 OK",
+        [
+            ("Content-Type", environ.get("CONTENT_TYPE") or "text/plain"),
+            ("Content-Length", str(len(body))),
+            ("Set-Cookie", "session=abc; Path=/; HttpOnly"),
+            ("Set-Cookie", "theme=dark; Path=/"),
+        ],
+    )
+    return [body]
+'''
+
+namespace = {}
+exec(APP_MODULE, namespace)
+echo_app = namespace["app"]
+
+
+def make_body(body):
+    content_type, size, binary = BODIES[body]
+    if binary:
+        data = bytes(range(256)) * (size // 256)
+        return content_type, base64.b64encode(data).decode("ascii"), True
+    record = '{"id": 1, "name": "Item", "tags": ["alpha", "beta"]}'
+    records = [record] * max(1, size // (len(record) + 2))
+    return content_type, "[" + ", ".join(records) + "]", False
+
+
+def make_headers(headers, content_type):
+    header_count, cookie_count = HEADERS[headers]
+    values = {
+        "Accept": "*/*",
+        "Accept-Encoding": "gzip, deflate, br",
+        "Content-Type": content_type,
+        "Host": "3z6kd9fbb1.execute-api.us-east-1.amazonaws.com",
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64)",
+        "X-Forwarded-For": "76.20.166.147, 205.251.218.72",
+        "X-Forwarded-Port": "443",
+        "X-Forwarded-Proto": "https",
+    }
+    for i in range(header_count - len(values)):
+        values["X-Custom-Header-{}".format(i)] = "value-{}".format(i)
+    cookies = ["cookie{}=value{}".format(i, i) for i in range(cookie_count)]
+    return values, cookies
+
+
+def make_event_v1(body, headers):
+    content_type, data, binary = make_body(body)
+    values, cookies = make_headers(headers, content_type)
+    values["Cookie"] = "; ".join(cookies)
+    return {
+        "httpMethod": "POST",
+        "path": "/items",
+        "headers": values,
+        "multiValueHeaders": {key: [value] for key, value in values.items()},
+        "queryStringParameters": {"page": "2"},
+        "multiValueQueryStringParameters": {"page": ["2"]},
+        "requestContext": {
+            "identity": {"sourceIp": "76.20.166.147"},
+            "stage": "dev",
+        },
+        "body": data,
+        "isBase64Encoded": binary,
+    }
+
+
+def make_event_v2(body, headers):
+    content_type, data, binary = make_body(body)
+    values, cookies = make_headers(headers, content_type)
+    return {
+        "version": "2.0",
+        "rawPath": "/items",
+        "rawQueryString": "page=2",
+        "cookies": cookies,
+        "headers": {key.lower(): value for key, value in values.items()},
+        "requestContext": {
+            "http": {"method": "POST", "sourceIp": "76.20.166.147"},
+            "stage": "$default",
+        },
+        "body": data,
+        "isBase64Encoded": binary,
+    }
+
+
+def make_event_alb(body, headers):
+    content_type, data, binary = make_body(body)
+    values, cookies = make_headers(headers, content_type)
+    values["Cookie"] = "; ".join(cookies)
+    return {
+        "httpMethod": "POST",
+        "path": "/items",
+        "headers": {key.lower(): value for key, value in values.items()},
+        "queryStringParameters": {"page": "2"},
+        "requestContext": {
+            "elb": {
+                "targetGroupArn": "arn:aws:elasticloadbalancing:us-east-1:"
+                "123456789012:targetgroup/benchmark/0123456789abcdef"
+            }
+        },
+        "body": data,
+        "isBase64Encoded": binary,
+    }
+
+
+def make_event_lambda_integration(body, headers):
+    content_type, data, binary = make_body(body)
+    values, cookies = make_headers(headers, "application/json")
+    values["Cookie"] = "; ".join(cookies)
+    return {
+        "body": json.loads(data) if not binary else {"data": data},
+        "method": "POST",
+        "principalId": "",
+        "stage": "dev",
+        "cognitoPoolClaims": {"sub": ""},
+        "enhancedAuthContext": {},
+        "headers": values,
+        "query": {"page": "2"},
+        "path": {},
+        "identity": {"sourceIp": "76.20.166.147"},
+        "stageVariables": {},
+        "requestPath": "/items",
+    }
+
+
+EVENTS = {
+    "v1": make_event_v1,
+    "v2": make_event_v2,
+    "alb": make_event_alb,
+    "lambda": make_event_lambda_integration,
+}
+
+
+def get_scenarios():
+    for event_name, make_event in EVENTS.items():
+        for body in BODIES:
+            for headers in HEADERS:
+                name = "{}/{}/{}-headers".format(event_name, body, headers)
+                yield name, make_event, body, headers
+
+
+def load_wsgi_handler(directory):
+    """Import `wsgi_handler` from a package directory serving the echo app"""
+    shutil.copy(os.path.join(ROOT, "wsgi_handler.py"), directory)
+    with open(os.path.join(directory, "benchmark_app.py"), "w") as f:
+        f.write(APP_MODULE)
+    with open(os.path.join(directory, ".serverless-wsgi"), "w") as f:
+        f.write(json.dumps({"app": "benchmark_app.app"}))
+
+    sys.path.insert(0, directory)
+    sys.modules.pop("wsgi_handler", None)
+    return importlib.import_module("wsgi_handler")
+
+
+def reference_workload():
+    """Fixed workload, timed alongside each scenario to factor out machine speed"""
+    headers = {"X-Header-{}".format(i): "value" for i in range(50)}
+    return json.loads(json.dumps({key.upper(): value for key, value in headers.items()}))
+
+
+def measure(func, make_event, repeat, number):
+    """
+    Return the median per-call latency in microseconds, the median latency
+    relative to the reference workload and the peak allocation in bytes. The
+    scenario and the reference are timed alternately, so both are equally affected
+    by changes in machine load during the run.
+    """
+    event = make_event()
+
+    # Each call gets a shallow copy, as handlers may remove keys from the event
+    def call():
+        func(dict(event))
+
+    call()
+    latencies = []
+    ratios = []
+    for _ in range(repeat):
+        latency = timeit.timeit(call, number=number) / number
+        reference = timeit.timeit(reference_workload, number=number) / number
+        latencies.append(latency)
+        ratios.append(latency / reference)
+    latency = statistics.median(latencies)
+
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return round(latency * 1e6, 2), round(statistics.median(ratios), 3), peak
+
+
+def run(filter_text, repeat, number):
+    settings = serverless_wsgi.Settings.load({}, {})
+    directory = tempfile.mkdtemp()
+    try:
+        wsgi_handler = load_wsgi_handler(directory)
+        targets = {
+            "handle_request": lambda event: serverless_wsgi.handle_request(
+                echo_app, event, {}, settings
+            ),
+            "handler": lambda event: wsgi_handler.handler(event, {}),
+        }
+
+        results = {}
+        for name, make_event, body, headers in get_scenarios():
+            for target, func in targets.items():
+                key = "{}:{}".format(target, name)
+                if filter_text and filter_text not in key:
+                    continue
+                latency, relative, peak = measure(
+                    func, lambda: make_event(body, headers), repeat, number
+                )
+                results[key] = {
+                    "latency_us": latency,
+                    "relative_latency": relative,
+                    "peak_bytes": peak,
+                }
+        return results
+    finally:
+        sys.path.remove(directory)
+        shutil.rmtree(directory)
+
+
+def compare(results, baseline, latency_threshold, memory_threshold):
+    """
+    Print the results against the baseline, returning the regressed scenarios.
+    Latency changes are only reported unless a latency threshold is given.
+    """
+    regressions = []
+    print(
+        "{:<48} {:>11} {:>8} {:>11} {:>8}".format(
+            "scenario", "latency us", "change", "peak bytes", "change"
+        )
+    )
+    for key, result in results.items():
+        changes = []
+        for metric, threshold in (
+            ("relative_latency", latency_threshold),
+            ("peak_bytes", memory_threshold),
+        ):
+            previous = baseline.get(key, {}).get(metric)
+            if not previous:
+                changes.append("")
+                continue
+            change = result[metric] / previous - 1
+            changes.append("{:+.0%}".format(change))
+            if threshold is not None and change > threshold:
+                regressions.append((key, metric, previous, result[metric]))
+        print(
+            "{:<48} {:>11.1f} {:>8} {:>11} {:>8}".format(
+                key, result["latency_us"], changes[0], result["peak_bytes"], changes[1]
+            )
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the event translation layer"
+    )
+    parser.add_argument("--baseline", default=BASELINE, help="baseline JSON file")
+    parser.add_argument(
+        "--save", action="store_true", help="store the results as the baseline"
+    )
+    parser.add_argument("--filter", help="only run scenarios containing this text")
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument("--number", type=int, default=20)
+    parser.add_argument(
+        "--latency-threshold",
+        type=float,
+        help="fail when the relative latency increases by more than this, "
+        "latency is only reported by default",
+    )
+    parser.add_argument(
+        "--memory-threshold",
+        type=float,
+        default=0.1,
+        help="allowed relative peak allocation increase (default: 0.1)",
+    )
+    args = parser.parse_args()
+
+    results = run(args.filter, args.repeat, args.number)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = compare(
+        results, baseline, args.latency_threshold, args.memory_threshold
+    )
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Saved baseline to {}".format(args.baseline))
+    elif regressions:
+        print()
+        for key, metric, previous, current in regressions:
+            print(
+                "Regression in {} {}: {} -> {}".format(key, metric, previous, current)
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,19 @@ const child_process = require("child_process");
 const commandExists = require("command-exists");
 const overrideStdoutWrite = require("process-utils/override-stdout-write");
 
+// Directories of the service that application bytecode is not compiled in
+const BYTECODE_EXCLUDED_DIRS = [
+  ".requirements",
+  ".serverless",
+  ".venv",
+  "venv",
+  "node_modules",
+  ".git",
+];
+
 class ServerlessWSGI {
   validate() {
-    return new BbPromise((resolve) => {
+    return new BbPromise((resolve, reject) => {
       let handlersFixed = false;
 
       _.each(this.serverless.service.functions, (func) => {
@@ -40,6 +50,13 @@ class ServerlessWSGI {
         "serverless-python-requirements"
       );
       this.pipArgs = null;
+      this.installer = null;
+      this.requirementsCache = true;
+      this.prune = null;
+      this.slim = null;
+      this.zipRequirements = null;
+      this.targetPlatform = null;
+      this.compileBytecode = false;
       this.appPath = this.serverless.config.servicePath;
 
       if (
@@ -57,6 +74,47 @@ class ServerlessWSGI {
         }
 
         this.pipArgs = this.serverless.service.custom.wsgi.pipArgs;
+        this.installer = this.serverless.service.custom.wsgi.installer;
+
+        if (
+          _.isBoolean(this.serverless.service.custom.wsgi.requirementsCache)
+        ) {
+          this.requirementsCache =
+            this.serverless.service.custom.wsgi.requirementsCache;
+        }
+
+        this.prune = this.serverless.service.custom.wsgi.prune;
+        this.slim = this.serverless.service.custom.wsgi.slim;
+        this.zipRequirements =
+          this.serverless.service.custom.wsgi.zipRequirements;
+        this.targetPlatform = this.serverless.service.custom.wsgi.targetPlatform;
+
+        if (_.isBoolean(this.serverless.service.custom.wsgi.compileBytecode)) {
+          this.compileBytecode =
+            this.serverless.service.custom.wsgi.compileBytecode;
+        }
+      }
+
+      // zipimport only uses timestamp-based bytecode if it matches the time of
+      // the source entry in the archive, which is fixed to keep it reproducible
+      if (this.zipRequirements && !this.compileBytecode) {
+        return reject(
+          'The "zipRequirements" option requires "compileBytecode", ' +
+          "as requirements would otherwise be compiled on every cold start."
+        );
+      }
+
+      // The Python version to install requirements for is taken from a python3.x
+      // runtime, which custom runtimes don't tell
+      if (
+        this.targetPlatform &&
+        !this.getTargetPythonVersion() &&
+        !this.getRuntimePythonVersion()
+      ) {
+        return reject(
+          `Unable to install requirements for the runtime "${this.getRuntime() || ""}". ` +
+          'Set "targetPlatform.pythonVersion" to the Python version of the runtime.'
+        );
       }
 
       if (this.enableRequirements) {
@@ -159,14 +217,141 @@ class ServerlessWSGI {
     });
   }
 
+  checkBytecodeTarget() {
+    return new BbPromise((resolve, reject) => {
+      if (!this.compileBytecode) {
+        return resolve();
+      }
+
+      const res = child_process.spawnSync(
+        this.pythonBin,
+        [
+          "-c",
+          "import sys, importlib.util; " +
+          'print("%d.%d" % sys.version_info[:2], importlib.util.MAGIC_NUMBER.hex())',
+        ],
+        { encoding: "utf8" }
+      );
+      if (res.error) {
+        return reject(res.error);
+      }
+
+      if (res.status != 0) {
+        return reject(res.stderr);
+      }
+
+      const [version, magic] = _.trim(res.stdout).split(" ");
+      const runtime = this.getRuntime();
+      const targetVersion =
+        this.getRuntimePythonVersion() || this.getTargetPythonVersion();
+      if (targetVersion && targetVersion != version) {
+        return reject(
+          `Unable to compile bytecode for runtime ${runtime} using Python ${version}. ` +
+          'Use the "pythonBin" option to set a Python executable matching the runtime.'
+        );
+      }
+
+      // The Python version of custom runtimes is only known from the options
+      if (runtime && !targetVersion) {
+        if (!this.serverless.service.custom.wsgi.pythonBin) {
+          return reject(
+            `Unable to determine the Python version of runtime ${runtime}. ` +
+            'Use the "pythonBin" option to set the Python executable of the runtime.'
+          );
+        }
+
+        this.serverless.cli.log(
+          `Compiling bytecode for runtime ${runtime} using Python ${version} of "pythonBin"`
+        );
+      }
+
+      this.bytecodeMagic = magic;
+
+      resolve();
+    });
+  }
+
   getWsgiHandlerConfiguration() {
     const config = { app: this.wsgiApp };
 
+    if (this.bytecodeMagic) {
+      config.bytecode_magic = this.bytecodeMagic;
+    }
+
     if (_.isArray(this.serverless.service.custom.wsgi.textMimeTypes)) {
       config.text_mime_types =
         this.serverless.service.custom.wsgi.textMimeTypes;
     }
 
+    if (_.isBoolean(this.serverless.service.custom.wsgi.responseStreaming)) {
+      config.response_streaming =
+        this.serverless.service.custom.wsgi.responseStreaming;
+    }
+
+    const compression = this.serverless.service.custom.wsgi.compression;
+    if (_.isBoolean(compression)) {
+      config.compression = compression;
+    } else if (_.isPlainObject(compression)) {
+      config.compression = _.omitBy(
+        {
+          encodings: compression.encodings,
+          min_size: compression.minSize,
+          rest_api: compression.restApi,
+        },
+        _.isUndefined
+      );
+    }
+
+    const requestBody = this.serverless.service.custom.wsgi.requestBody;
+    if (_.isBoolean(requestBody)) {
+      config.request_body = requestBody;
+    } else if (_.isPlainObject(requestBody)) {
+      config.request_body = _.omitBy(
+        {
+          spool_threshold: requestBody.spoolThreshold,
+          strip_event: requestBody.stripEvent,
+        },
+        _.isUndefined
+      );
+    }
+
+    const metrics = this.serverless.service.custom.wsgi.metrics;
+    if (_.isBoolean(metrics)) {
+      config.metrics = metrics;
+    } else if (_.isPlainObject(metrics)) {
+      config.metrics = _.omitBy({ namespace: metrics.namespace }, _.isUndefined);
+    }
+
+    const importProfile = this.serverless.service.custom.wsgi.importProfile;
+    if (_.isBoolean(importProfile)) {
+      config.import_profile = importProfile;
+    } else if (_.isPlainObject(importProfile)) {
+      config.import_profile = _.omitBy({ top: importProfile.top }, _.isUndefined);
+    }
+
+    const gc = this.serverless.service.custom.wsgi.gc;
+    if (_.isBoolean(gc)) {
+      config.gc = gc;
+    } else if (_.isPlainObject(gc)) {
+      config.gc = _.omitBy(
+        {
+          freeze: gc.freeze,
+          thresholds: gc.thresholds,
+          collect_between_invocations: gc.collectBetweenInvocations,
+        },
+        _.isUndefined
+      );
+    }
+
+    if (_.isBoolean(this.serverless.service.custom.wsgi.warmInit)) {
+      config.warm_init = this.serverless.service.custom.wsgi.warmInit;
+    }
+
+    if (_.isArray(this.serverless.service.custom.wsgi.primingRequests)) {
+      config.priming_requests =
+        this.serverless.service.custom.wsgi.primingRequests;
+    }
+
     return config;
   }
 
@@ -198,6 +383,64 @@ class ServerlessWSGI {
     ]);
   }
 
+  getWsgiFunction() {
+    return (
+      _.find(this.serverless.service.functions, (fun) =>
+        _.includes(fun.handler, "wsgi_handler.handler")
+      ) || {}
+    );
+  }
+
+  getRuntime() {
+    return (
+      this.getWsgiFunction().runtime || this.serverless.service.provider.runtime
+    );
+  }
+
+  getRuntimePythonVersion() {
+    const match = /^python(3\.\d+)$/.exec(this.getRuntime() || "");
+    return match ? match[1] : null;
+  }
+
+  getTargetPythonVersion() {
+    if (_.isPlainObject(this.targetPlatform) && this.targetPlatform.pythonVersion) {
+      return String(this.targetPlatform.pythonVersion);
+    }
+    return null;
+  }
+
+  getTargetPlatformArgs() {
+    if (!this.targetPlatform) {
+      return [];
+    }
+
+    // The platform defaults to the runtime and architecture of the WSGI function
+    const options = _.isPlainObject(this.targetPlatform)
+      ? this.targetPlatform
+      : {};
+    const handler = this.getWsgiFunction();
+    const pythonVersion =
+      this.getTargetPythonVersion() || this.getRuntimePythonVersion();
+    const architecture =
+      options.architecture ||
+      handler.architecture ||
+      this.serverless.service.provider.architecture;
+
+    const args = ["--target-python", String(pythonVersion)];
+
+    if (architecture) {
+      args.push("--target-arch");
+      args.push(architecture);
+    }
+
+    if (options.glibc) {
+      args.push("--target-glibc");
+      args.push(String(options.glibc));
+    }
+
+    return args;
+  }
+
   packRequirements() {
     return new BbPromise((resolve, reject) => {
       if (!this.enableRequirements) {
@@ -211,6 +454,17 @@ class ServerlessWSGI {
         args.push(this.pipArgs);
       }
 
+      if (this.installer) {
+        args.push("--installer");
+        args.push(this.installer);
+      }
+
+      if (!this.requirementsCache) {
+        args.push("--no-cache");
+      }
+
+      args = args.concat(this.getTargetPlatformArgs());
+
       if (this.wsgiApp) {
         args.push(path.resolve(__dirname, "requirements.txt"));
       }
@@ -246,6 +500,294 @@ class ServerlessWSGI {
         return reject(res.stderr);
       }
 
+      _.each(_.compact(_.split(_.trim(res.stdout), "\n")), (line) =>
+        this.serverless.cli.log(line)
+      );
+
+      resolve();
+    });
+  }
+
+  slimRequirements() {
+    return new BbPromise((resolve, reject) => {
+      if (!this.enableRequirements || !this.slim) {
+        return resolve();
+      }
+
+      const options = _.isPlainObject(this.slim) ? this.slim : {};
+      let baseArgs = [path.resolve(__dirname, "slim.py")];
+
+      _.each(options.patterns, (pattern) => {
+        baseArgs.push("--pattern");
+        baseArgs.push(pattern);
+      });
+
+      _.each(options.keep, (pattern) => {
+        baseArgs.push("--keep");
+        baseArgs.push(pattern);
+      });
+
+      if (options.defaultPatterns === false) {
+        baseArgs.push("--no-defaults");
+      }
+
+      if (options.strip) {
+        baseArgs.push("--strip");
+        baseArgs.push(_.isString(options.strip) ? options.strip : "strip");
+      }
+
+      if (!fse.existsSync(this.requirementsInstallPath)) {
+        return resolve();
+      }
+
+      this.serverless.cli.log("Slimming Python packages...");
+
+      const res = child_process.spawnSync(
+        this.pythonBin,
+        baseArgs.concat([this.requirementsInstallPath]),
+        { encoding: "utf8" }
+      );
+      if (res.error) {
+        return reject(res.error);
+      }
+
+      if (res.status != 0) {
+        return reject(res.stderr);
+      }
+
+      _.each(_.trim(res.stdout).split("\n"), (line) =>
+        this.serverless.cli.log(line)
+      );
+
+      resolve();
+    });
+  }
+
+  pruneRequirements() {
+    return new BbPromise((resolve, reject) => {
+      if (!this.enableRequirements || !this.wsgiApp || !this.prune) {
+        return resolve();
+      }
+
+      const options = _.isPlainObject(this.prune) ? this.prune : {};
+      let baseArgs = [path.resolve(__dirname, "prune.py")];
+
+      if (options.requests) {
+        baseArgs.push("--requests");
+        baseArgs.push(JSON.stringify(options.requests));
+      }
+
+      _.each(options.allow, (entry) => {
+        baseArgs.push("--allow");
+        baseArgs.push(entry);
+      });
+
+      if (options.mode) {
+        baseArgs.push("--mode");
+        baseArgs.push(options.mode);
+      }
+
+      if (!fse.existsSync(this.requirementsInstallPath)) {
+        return resolve();
+      }
+
+      this.serverless.cli.log("Pruning unused Python packages...");
+
+      const res = child_process.spawnSync(
+        this.pythonBin,
+        baseArgs.concat([this.packageRootPath, this.requirementsInstallPath]),
+        {
+          encoding: "utf8",
+          env: _.assign({}, process.env, this.getEnvVars()),
+        }
+      );
+      if (res.error) {
+        return reject(res.error);
+      }
+
+      if (res.status != 0) {
+        return reject(res.stderr);
+      }
+
+      _.each(_.trim(res.stdout).split("\n"), (line) =>
+        this.serverless.cli.log(line)
+      );
+
+      resolve();
+    });
+  }
+
+  compileRequirements() {
+    return new BbPromise((resolve, reject) => {
+      if (!this.compileBytecode) {
+        return resolve();
+      }
+
+      // Installed requirements and the handler only change when packaging, so
+      // their bytecode is not checked against the source. Application code is
+      // also used when running locally, where it changes, so its bytecode is
+      // checked against a hash of the source.
+      const uncheckedPaths = [];
+      const checkedPaths = [];
+
+      if (this.enableRequirements && fse.existsSync(this.requirementsInstallPath)) {
+        uncheckedPaths.push(this.requirementsInstallPath);
+      }
+
+      if (this.wsgiApp) {
+        checkedPaths.push(this.appPath);
+        uncheckedPaths.push(path.join(this.packageRootPath, "wsgi_handler.py"));
+        uncheckedPaths.push(path.join(this.packageRootPath, "serverless_wsgi.py"));
+      }
+
+      this.serverless.cli.log("Compiling Python bytecode...");
+
+      // Bytecode written next to the application source is removed again
+      // after packaging, leaving the bytecode that existed before in place
+      const bytecodePaths = _.uniq([this.appPath, this.packageRootPath]);
+      const existingBytecode = this.listBytecode(bytecodePaths);
+
+      const compile = (invalidationMode, paths, extraArgs) => {
+        if (paths.length == 0) {
+          return null;
+        }
+
+        const res = child_process.spawnSync(
+          this.pythonBin,
+          [
+            "-m",
+            "compileall",
+            "-q",
+            "-f",
+            "-j",
+            "0",
+            "--invalidation-mode",
+            invalidationMode,
+          ]
+            .concat(extraArgs)
+            .concat(paths),
+          { encoding: "utf8" }
+        );
+        if (res.error) {
+          return res.error;
+        }
+
+        if (res.status != 0) {
+          return res.stdout + res.stderr;
+        }
+
+        return null;
+      };
+
+      const error =
+        compile("checked-hash", checkedPaths, [
+          "-x",
+          `[\\\\/](${_.map(BYTECODE_EXCLUDED_DIRS, _.escapeRegExp).join(
+            "|"
+          )})([\\\\/]|$)`,
+        ]) || compile("unchecked-hash", uncheckedPaths, []);
+      if (error) {
+        return reject(error);
+      }
+
+      this.compiledBytecode = _.difference(
+        this.listBytecode(bytecodePaths),
+        existingBytecode
+      );
+
+      resolve();
+    });
+  }
+
+  listBytecode(paths) {
+    const files = [];
+
+    const walk = (dir) => {
+      _.each(fse.readdirSync(dir, { withFileTypes: true }), (entry) => {
+        const entryPath = path.join(dir, entry.name);
+        if (entry.isDirectory()) {
+          if (!_.includes(BYTECODE_EXCLUDED_DIRS, entry.name)) {
+            walk(entryPath);
+          }
+        } else if (
+          path.basename(dir) == "__pycache__" &&
+          _.endsWith(entry.name, ".pyc")
+        ) {
+          files.push(entryPath);
+        }
+      });
+    };
+
+    _.each(paths, (dir) => {
+      if (fse.existsSync(dir)) {
+        walk(dir);
+      }
+    });
+
+    return _.uniq(files);
+  }
+
+  getRequirementsEntries() {
+    // Archived requirements are packaged as the archive alone, next to the
+    // archive of pruned requirements that it doesn't include
+    if (this.zipRequirements) {
+      return _.intersection(fse.readdirSync(this.requirementsInstallPath), [
+        ".requirements.zip",
+        ".pruned-requirements.zip",
+      ]);
+    }
+
+    // The sync manifest written by requirements.py is not part of the package
+    return _.without(
+      fse.readdirSync(this.requirementsInstallPath),
+      ".requirements-manifest.json"
+    );
+  }
+
+  archiveRequirements() {
+    return new BbPromise((resolve, reject) => {
+      if (!this.enableRequirements || !this.zipRequirements) {
+        return resolve();
+      }
+
+      const options = _.isPlainObject(this.zipRequirements)
+        ? this.zipRequirements
+        : {};
+      let baseArgs = [path.resolve(__dirname, "archive.py")];
+
+      _.each(options.zipSafe, (name) => {
+        baseArgs.push("--zip-safe");
+        baseArgs.push(name);
+      });
+
+      _.each(options.extract, (name) => {
+        baseArgs.push("--extract");
+        baseArgs.push(name);
+      });
+
+      if (!fse.existsSync(this.requirementsInstallPath)) {
+        return resolve();
+      }
+
+      this.serverless.cli.log("Archiving Python packages...");
+
+      const res = child_process.spawnSync(
+        this.pythonBin,
+        baseArgs.concat([this.requirementsInstallPath]),
+        { encoding: "utf8" }
+      );
+      if (res.error) {
+        return reject(res.error);
+      }
+
+      if (res.status != 0) {
+        return reject(res.stderr);
+      }
+
+      _.each(_.trim(res.stdout).split("\n"), (line) =>
+        this.serverless.cli.log(line)
+      );
+
       resolve();
     });
   }
@@ -259,7 +801,7 @@ class ServerlessWSGI {
       if (fse.existsSync(this.requirementsInstallPath)) {
         this.serverless.cli.log("Linking required Python packages...");
 
-        fse.readdirSync(this.requirementsInstallPath).map((file) => {
+        this.getRequirementsEntries().map((file) => {
           let relativePath = path.join(
             path.relative(this.serverless.config.servicePath, this.appPath),
             file
@@ -299,7 +841,10 @@ class ServerlessWSGI {
         return resolve();
       }
 
-      const hasWerkzeug = _.includes(fse.readdirSync(this.appPath), "werkzeug");
+      // Archived requirements are only linked as the archive
+      const hasWerkzeug = this.zipRequirements
+        ? fse.existsSync(path.join(this.requirementsInstallPath, "werkzeug"))
+        : _.includes(fse.readdirSync(this.appPath), "werkzeug");
 
       if (!hasWerkzeug) {
         this.serverless.cli.log(
@@ -320,7 +865,7 @@ class ServerlessWSGI {
       if (fse.existsSync(this.requirementsInstallPath)) {
         this.serverless.cli.log("Unlinking required Python packages...");
 
-        fse.readdirSync(this.requirementsInstallPath).map((file) => {
+        this.getRequirementsEntries().map((file) => {
           if (fse.existsSync(file)) {
             fse.unlinkSync(file);
           }
@@ -346,27 +891,41 @@ class ServerlessWSGI {
       ".serverless-wsgi",
     ];
 
+    const bytecode = this.compiledBytecode || [];
+
     return BbPromise.all(
       _.map(artifacts, (artifact) =>
         fse.removeAsync(path.join(this.packageRootPath, artifact))
-      )
+      ).concat(_.map(bytecode, (file) => fse.removeAsync(file)))
+    ).then(() => {
+      // Remove the __pycache__ directories that only held packaged bytecode
+      _.each(_.uniq(_.map(bytecode, path.dirname)), (dir) => {
+        if (fse.existsSync(dir) && fse.readdirSync(dir).length == 0) {
+          fse.rmdirSync(dir);
+        }
+      });
+      this.compiledBytecode = [];
+    });
+  }
+
+  getEnvVars() {
+    const envVars = _.omitBy(
+      this.serverless.service.provider.environment || {},
+      _.isObject
     );
+
+    _.each(this.serverless.service.functions, (func) => {
+      if (_.includes(func.handler, "wsgi_handler.handler")) {
+        _.merge(envVars, _.omitBy(func.environment || {}, _.isObject));
+      }
+    });
+
+    return envVars;
   }
 
   loadEnvVars() {
     return new BbPromise((resolve) => {
-      const providerEnvVars = _.omitBy(
-        this.serverless.service.provider.environment || {},
-        _.isObject
-      );
-      _.merge(process.env, providerEnvVars);
-
-      _.each(this.serverless.service.functions, (func) => {
-        if (_.includes(func.handler, "wsgi_handler.handler")) {
-          const functionEnvVars = _.omitBy(func.environment || {}, _.isObject);
-          _.merge(process.env, functionEnvVars);
-        }
-      });
+      _.merge(process.env, this.getEnvVars());
 
       resolve();
     });
@@ -774,8 +1333,13 @@ class ServerlessWSGI {
         .then(this.validate)
         .then(this.configurePackaging)
         .then(this.locatePython)
+        .then(this.checkBytecodeTarget)
         .then(this.packWsgiHandler)
         .then(this.packRequirements)
+        .then(this.slimRequirements)
+        .then(this.pruneRequirements)
+        .then(this.compileRequirements)
+        .then(this.archiveRequirements)
         .then(this.linkRequirements)
         .then(this.checkWerkzeugPresent);
 
@@ -784,7 +1348,11 @@ class ServerlessWSGI {
         .then(this.validate)
         .then(this.configurePackaging)
         .then(this.locatePython)
+        .then(this.checkBytecodeTarget)
         .then(this.packRequirements)
+        .then(this.slimRequirements)
+        .then(this.compileRequirements)
+        .then(this.archiveRequirements)
         .then(this.linkRequirements);
 
     const deployAfterHook = () =>
@@ -180,6 +180,259 @@ describe("serverless-wsgi", () => {
       );
     });
 
+    it("packages wsgi handler with response streaming enabled", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python2.7" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                responseStreaming: true,
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      var writeStub = sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(child_process, "spawnSync").returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(JSON.parse(writeStub.lastCall.args[1])).to.deep.equal({
+            app: "api.app",
+            response_streaming: true,
+          });
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("packages wsgi handler with compression options", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python2.7" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                compression: { encodings: ["gzip"], minSize: 2048, restApi: true },
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      var writeStub = sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(child_process, "spawnSync").returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(JSON.parse(writeStub.lastCall.args[1])).to.deep.equal({
+            app: "api.app",
+            compression: { encodings: ["gzip"], min_size: 2048, rest_api: true },
+          });
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("packages wsgi handler with import profile options", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python2.7" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                importProfile: { top: 20 },
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      var writeStub = sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(child_process, "spawnSync").returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(JSON.parse(writeStub.lastCall.args[1])).to.deep.equal({
+            app: "api.app",
+            import_profile: { top: 20 },
+          });
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("packages wsgi handler with warm init and priming requests", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python2.7" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                warmInit: true,
+                primingRequests: [
+                  { path: "/" },
+                  { path: "/items", headers: { Accept: "text/html" } },
+                ],
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      var writeStub = sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(child_process, "spawnSync").returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(JSON.parse(writeStub.lastCall.args[1])).to.deep.equal({
+            app: "api.app",
+            warm_init: true,
+            priming_requests: [
+              { path: "/" },
+              { path: "/items", headers: { Accept: "text/html" } },
+            ],
+          });
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("packages wsgi handler with gc options", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python2.7" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                gc: { thresholds: [5000, 20, 20], collectBetweenInvocations: true },
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      var writeStub = sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(child_process, "spawnSync").returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(JSON.parse(writeStub.lastCall.args[1])).to.deep.equal({
+            app: "api.app",
+            gc: { thresholds: [5000, 20, 20], collect_between_invocations: true },
+          });
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("packages wsgi handler with metrics options", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python2.7" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                metrics: { namespace: "api" },
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      var writeStub = sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(child_process, "spawnSync").returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(JSON.parse(writeStub.lastCall.args[1])).to.deep.equal({
+            app: "api.app",
+            metrics: { namespace: "api" },
+          });
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("packages wsgi handler with request body options", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python2.7" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                requestBody: { spoolThreshold: 4096, stripEvent: true },
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      var writeStub = sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(child_process, "spawnSync").returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(JSON.parse(writeStub.lastCall.args[1])).to.deep.equal({
+            app: "api.app",
+            request_body: { spool_threshold: 4096, strip_event: true },
+          });
+          sandbox.restore();
+        }
+      );
+    });
+
     it("falls back to default python if runtime version is not found", () => {
       var plugin = new Plugin(
         {
@@ -684,6 +937,695 @@ describe("serverless-wsgi", () => {
       );
     });
 
+    it("packages user requirements with uv installer", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.6" },
+            custom: { wsgi: { installer: "uv", pipArgs: "--no-deps" } },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(fse, "symlinkSync").throws();
+      sandbox.stub(fse, "readlinkSync").returns("/tmp/.requirements/flask");
+      sandbox.stub(fse, "readdirSync").returns(["flask"]);
+      sandbox.stub(fse, "existsSync").returns(true);
+      var procStub = sandbox
+        .stub(child_process, "spawnSync")
+        .returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(
+            procStub.calledWith("python3.6", [
+              path.resolve(__dirname, "requirements.py"),
+              "--pip-args",
+              "--no-deps",
+              "--installer",
+              "uv",
+              "/tmp/requirements.txt",
+              "/tmp/.requirements",
+            ])
+          ).to.be.true;
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("packages user requirements for the lambda platform", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.12", architecture: "arm64" },
+            custom: { wsgi: { app: "api.app", targetPlatform: true } },
+            functions: {
+              app: { handler: "wsgi_handler.handler" },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(fse, "symlinkSync");
+      sandbox.stub(fse, "readdirSync").returns(["flask"]);
+      sandbox.stub(fse, "existsSync").returns(true);
+      var procStub = sandbox
+        .stub(child_process, "spawnSync")
+        .returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(
+            procStub.calledWith("python3.12", [
+              path.resolve(__dirname, "requirements.py"),
+              "--target-python",
+              "3.12",
+              "--target-arch",
+              "arm64",
+              path.resolve(__dirname, "requirements.txt"),
+              "/tmp/requirements.txt",
+              "/tmp/.requirements",
+            ])
+          ).to.be.true;
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("rejects installing requirements for the platform of a custom runtime", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "provided.al2023" },
+            custom: { wsgi: { app: "api.app", targetPlatform: true } },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      return expect(
+        plugin.hooks["before:package:createDeploymentArtifacts"]()
+      ).to.eventually.be.rejectedWith(/"targetPlatform.pythonVersion"/);
+    });
+
+    it("rejects installing requirements for the platform without a runtime", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: {},
+            custom: {
+              wsgi: { app: "api.app", targetPlatform: { architecture: "arm64" } },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      return expect(
+        plugin.hooks["before:package:createDeploymentArtifacts"]()
+      ).to.eventually.be.rejectedWith(/"targetPlatform.pythonVersion"/);
+    });
+
+    it("packages user requirements for the platform of a custom runtime", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "provided.al2023" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                pythonBin: "python3.12",
+                targetPlatform: { pythonVersion: 3.12 },
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(fse, "copyAsync");
+      sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(fse, "symlinkSync");
+      sandbox.stub(fse, "readdirSync").returns(["flask"]);
+      sandbox.stub(fse, "existsSync").returns(true);
+      var procStub = sandbox
+        .stub(child_process, "spawnSync")
+        .returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(procStub.firstCall.args[1].slice(0, 3)).to.deep.equal([
+            path.resolve(__dirname, "requirements.py"),
+            "--target-python",
+            "3.12",
+          ]);
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("packages user requirements for a configured platform", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.12" },
+            custom: {
+              wsgi: {
+                targetPlatform: {
+                  pythonVersion: "3.11",
+                  architecture: "x86_64",
+                  glibc: "2.28",
+                },
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(fse, "symlinkSync").throws();
+      sandbox.stub(fse, "readlinkSync").returns("/tmp/.requirements/flask");
+      sandbox.stub(fse, "readdirSync").returns(["flask"]);
+      sandbox.stub(fse, "existsSync").returns(true);
+      var procStub = sandbox
+        .stub(child_process, "spawnSync")
+        .returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(
+            procStub.calledWith("python3.12", [
+              path.resolve(__dirname, "requirements.py"),
+              "--target-python",
+              "3.11",
+              "--target-arch",
+              "x86_64",
+              "--target-glibc",
+              "2.28",
+              "/tmp/requirements.txt",
+              "/tmp/.requirements",
+            ])
+          ).to.be.true;
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("disables requirements cache and logs cache hits", () => {
+      var logs = [];
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.6" },
+            custom: { wsgi: { requirementsCache: false } },
+          },
+          classes: { Error: Error },
+          cli: { log: (message) => logs.push(message) },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(fse, "symlinkSync").throws();
+      sandbox.stub(fse, "readlinkSync").returns("/tmp/.requirements/flask");
+      sandbox.stub(fse, "readdirSync").returns(["flask"]);
+      sandbox.stub(fse, "existsSync").returns(true);
+      var procStub = sandbox.stub(child_process, "spawnSync").returns({
+        status: 0,
+        stdout: "Using cached requirements: 0123456789ab\n",
+      });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(
+            procStub.calledWith("python3.6", [
+              path.resolve(__dirname, "requirements.py"),
+              "--no-cache",
+              "/tmp/requirements.txt",
+              "/tmp/.requirements",
+            ])
+          ).to.be.true;
+          expect(logs).to.include("Using cached requirements: 0123456789ab");
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("does not link the requirements manifest", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.6" },
+            custom: { wsgi: { app: "api.app" } },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      sandbox.stub(fse, "writeFileAsync");
+      var symlinkStub = sandbox.stub(fse, "symlinkSync");
+      sandbox
+        .stub(fse, "readdirSync")
+        .returns(["flask", ".requirements-manifest.json"]);
+      sandbox.stub(fse, "existsSync").returns(true);
+      sandbox.stub(child_process, "spawnSync").returns({ status: 0 });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(symlinkStub.calledOnce).to.be.true;
+          expect(
+            symlinkStub.calledWith("/tmp/.requirements/flask", "flask")
+          ).to.be.true;
+          expect(plugin.serverless.service.package.patterns).to.not.include(
+            ".requirements-manifest.json"
+          );
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("prunes user requirements for wsgi app", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.6", environment: { STAGE: "dev" } },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                prune: {
+                  requests: [{ method: "GET", path: "/health" }],
+                  allow: ["jinja2.ext", "botocore/data/s3/*"],
+                  mode: "delete",
+                },
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(fse, "symlinkSync");
+      sandbox.stub(fse, "readdirSync").returns(["flask"]);
+      sandbox.stub(fse, "existsSync").returns(true);
+      var procStub = sandbox
+        .stub(child_process, "spawnSync")
+        .returns({ status: 0, stdout: "Pruned 1 of 2 files" });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(procStub.secondCall.args[0]).to.equal("python3.6");
+          expect(procStub.secondCall.args[1]).to.deep.equal([
+            path.resolve(__dirname, "prune.py"),
+            "--requests",
+            '[{"method":"GET","path":"/health"}]',
+            "--allow",
+            "jinja2.ext",
+            "--allow",
+            "botocore/data/s3/*",
+            "--mode",
+            "delete",
+            "/tmp",
+            "/tmp/.requirements",
+          ]);
+          expect(procStub.secondCall.args[2].env.STAGE).to.equal("dev");
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("slims requirements", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.6" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                slim: {
+                  patterns: ["botocore/data/*/examples-1.json"],
+                  keep: ["numpy/testing/"],
+                  strip: "aarch64-linux-gnu-strip",
+                },
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(fse, "symlinkSync");
+      sandbox.stub(fse, "readdirSync").returns(["flask"]);
+      sandbox.stub(fse, "existsSync").returns(true);
+      var procStub = sandbox
+        .stub(child_process, "spawnSync")
+        .returns({ status: 0, stdout: "Slimmed requirements from 2 MB to 1 MB" });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(procStub.secondCall.args[1]).to.deep.equal([
+            path.resolve(__dirname, "slim.py"),
+            "--pattern",
+            "botocore/data/*/examples-1.json",
+            "--keep",
+            "numpy/testing/",
+            "--strip",
+            "aarch64-linux-gnu-strip",
+            "/tmp/.requirements",
+          ]);
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("archives requirements", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.6" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                compileBytecode: true,
+                zipRequirements: { zipSafe: ["jinja2"], extract: ["botocore"] },
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      sandbox.stub(fse, "writeFileAsync");
+      var symlinkStub = sandbox.stub(fse, "symlinkSync");
+      sandbox
+        .stub(fse, "readdirSync")
+        .callsFake((dir, options) =>
+          options ? [] : ["flask", ".requirements.zip", ".pruned-requirements.zip"]
+        );
+      sandbox.stub(fse, "existsSync").returns(true);
+      var procStub = sandbox
+        .stub(child_process, "spawnSync")
+        .callsFake((command, args) => ({
+          status: 0,
+          stdout:
+            args[0] == "-c" ? "3.6 330d0d0a\n" : "Archived 2 files of requirements",
+        }));
+      return plugin.hooks["before:package:createDeploymentArtifacts"]().then(
+        () => {
+          expect(procStub.getCall(4).args[1]).to.deep.equal([
+            path.resolve(__dirname, "archive.py"),
+            "--zip-safe",
+            "jinja2",
+            "--extract",
+            "botocore",
+            "/tmp/.requirements",
+          ]);
+          expect(symlinkStub.callCount).to.equal(2);
+          expect(symlinkStub.firstCall.args).to.deep.equal([
+            "/tmp/.requirements/.requirements.zip",
+            ".requirements.zip",
+          ]);
+          expect(plugin.serverless.service.package.patterns).to.include(
+            ".requirements.zip"
+          );
+          sandbox.restore();
+        }
+      );
+    });
+
+    it("rejects archiving requirements without compiling bytecode", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.6" },
+            custom: { wsgi: { app: "api.app", zipRequirements: true } },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      return expect(
+        plugin.hooks["before:package:createDeploymentArtifacts"]()
+      ).to.eventually.be.rejectedWith(/"compileBytecode"/);
+    });
+
+    it("compiles bytecode for the runtime", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.11" },
+            custom: { wsgi: { app: "api.app", compileBytecode: true } },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox.stub(fse, "copyAsync");
+      var writeStub = sandbox.stub(fse, "writeFileAsync");
+      sandbox.stub(fse, "symlinkSync");
+      sandbox.stub(fse, "unlinkSync");
+      var removeStub = sandbox.stub(fse, "removeAsync").resolves();
+      var rmdirStub = sandbox.stub(fse, "rmdirSync");
+      sandbox.stub(fse, "existsSync").returns(true);
+      var compiled = false;
+      var dirent = (name, isDirectory) => ({
+        name: name,
+        isDirectory: () => isDirectory,
+      });
+      sandbox.stub(fse, "readdirSync").callsFake((dir, options) => {
+        if (!options) {
+          return dir == "/tmp/__pycache__" ? [] : ["flask"];
+        }
+        if (dir == "/tmp") {
+          return compiled
+            ? [dirent("__pycache__", true), dirent("node_modules", true)]
+            : [dirent("node_modules", true)];
+        }
+        if (dir == "/tmp/__pycache__") {
+          return [dirent("api.cpython-311.pyc", false)];
+        }
+        return [];
+      });
+      var procStub = sandbox
+        .stub(child_process, "spawnSync")
+        .callsFake((command, args) => {
+          compiled = compiled || args.includes("checked-hash");
+          return { status: 0, stdout: "3.11 a70d0d0a\n" };
+        });
+      return plugin.hooks["before:package:createDeploymentArtifacts"]()
+        .then(() => {
+          expect(JSON.parse(writeStub.lastCall.args[1])).to.deep.equal({
+            app: "api.app",
+            bytecode_magic: "a70d0d0a",
+          });
+          expect(procStub.getCall(2).args[1]).to.include.members([
+            "checked-hash",
+            "/tmp",
+          ]);
+          expect(procStub.getCall(3).args[1]).to.include.members([
+            "unchecked-hash",
+            "/tmp/.requirements",
+            "/tmp/wsgi_handler.py",
+            "/tmp/serverless_wsgi.py",
+          ]);
+          return plugin.hooks["after:package:createDeploymentArtifacts"]();
+        })
+        .then(() => {
+          // Bytecode compiled next to the application source is cleaned up
+          expect(removeStub.calledWith("/tmp/__pycache__/api.cpython-311.pyc"))
+            .to.be.true;
+          expect(rmdirStub.calledWith("/tmp/__pycache__")).to.be.true;
+          sandbox.restore();
+        });
+    });
+
+    it("compiles bytecode for a custom runtime using pythonBin", () => {
+      var logs = [];
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "provided.al2023" },
+            custom: {
+              wsgi: {
+                app: "api.app",
+                compileBytecode: true,
+                pythonBin: "python3.12",
+              },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: (message) => logs.push(message) },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox
+        .stub(child_process, "spawnSync")
+        .returns({ status: 0, stdout: "3.12 cb0d0d0a\n" });
+      return plugin
+        .validate()
+        .then(() => plugin.locatePython())
+        .then(() => plugin.checkBytecodeTarget())
+        .then(() => {
+          expect(plugin.bytecodeMagic).to.equal("cb0d0d0a");
+          expect(logs).to.include(
+            'Compiling bytecode for runtime provided.al2023 using Python 3.12 of "pythonBin"'
+          );
+          sandbox.restore();
+        });
+    });
+
+    it("rejects compiling bytecode for a custom runtime without pythonBin", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "provided.al2023" },
+            custom: { wsgi: { app: "api.app", compileBytecode: true } },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox
+        .stub(child_process, "spawnSync")
+        .returns({ status: 0, stdout: "3.12 cb0d0d0a\n" });
+      return expect(
+        plugin
+          .validate()
+          .then(() => plugin.locatePython())
+          .then(() => plugin.checkBytecodeTarget())
+      ).to.eventually.be.rejectedWith(/"pythonBin"/).and.notify(() => {
+        sandbox.restore();
+      });
+    });
+
+    it("compiles bytecode for the runtime of the wsgi function", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.10" },
+            custom: { wsgi: { app: "api.app", compileBytecode: true } },
+            functions: {
+              app: { handler: "wsgi_handler.handler", runtime: "python3.11" },
+            },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox
+        .stub(child_process, "spawnSync")
+        .returns({ status: 0, stdout: "3.11 a70d0d0a\n" });
+      return plugin
+        .validate()
+        .then(() => plugin.locatePython())
+        .then(() => plugin.checkBytecodeTarget())
+        .then(() => {
+          expect(plugin.bytecodeMagic).to.equal("a70d0d0a");
+          sandbox.restore();
+        });
+    });
+
+    it("rejects compiling bytecode with a mismatching python", () => {
+      var plugin = new Plugin(
+        {
+          config: { servicePath: "/tmp" },
+          service: {
+            provider: { runtime: "python3.11" },
+            custom: { wsgi: { app: "api.app", compileBytecode: true } },
+          },
+          classes: { Error: Error },
+          cli: { log: () => { } },
+        },
+        {}
+      );
+
+      var sandbox = sinon.createSandbox();
+      sandbox.stub(commandExists, "sync").returns(true);
+      sandbox
+        .stub(child_process, "spawnSync")
+        .returns({ status: 0, stdout: "3.10 6f0d0d0a\n" });
+      return expect(
+        plugin.hooks["before:package:createDeploymentArtifacts"]()
+      ).to.eventually.be.rejected.and.notify(() => {
+        sandbox.restore();
+      });
+    });
+
     it("skips packaging for non-wsgi app without user requirements", () => {
       var plugin = new Plugin(
         {
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module prunes installed requirements down to the files that the WSGI
+application actually uses. The application is loaded through `wsgi_handler` in a
+separate interpreter, a set of synthetic requests is run through
+`serverless_wsgi.handle_request`, and every module and data file touched under
+the requirements directory is recorded. Everything else is removed, or moved to
+an archive from which `wsgi_handler` can still import it on demand.
+
+Author: Logan Raarup <logan@logan.dk>
+"""
+import argparse
+import fnmatch
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+# Name of the archive holding pruned files, imported from as a last resort
+ARCHIVE_NAME = ".pruned-requirements.zip"
+
+# Manifest of the installed files, written by `requirements.py`
+MANIFEST_NAME = ".requirements-manifest.json"
+
+# Shared libraries are loaded by the dynamic linker, which bypasses the audit
+# hooks, so they are kept for every package that is used
+NATIVE_PATTERNS = ["*.so", "*.so.*", "*.pyd", "*.dll", "*.dylib"]
+
+DEFAULT_REQUESTS = [{"method": "GET", "path": "/"}]
+
+
+def trace(package_root, requirements_dir, requests, output):  # pragma: no cover
+    """
+    Load the application and run the synthetic requests, writing the paths of all
+    files opened or imported to `output`. Runs in a separate interpreter, as the
+    audit hook can't be removed.
+    """
+    touched = set()
+
+    def audit(event, args):
+        if event == "open" and isinstance(args[0], (str, bytes)):
+            touched.add(os.path.realpath(os.fsdecode(args[0])))
+
+    # Only the standard library, the package and its requirements are importable
+    sys.path[:1] = [package_root, requirements_dir]
+    os.chdir(package_root)
+    sys.addaudithook(audit)
+
+    import wsgi_handler
+    import serverless_wsgi
+    from werkzeug.exceptions import InternalServerError
+
+    if isinstance(wsgi_handler.wsgi_app, InternalServerError):
+        sys.exit("Unable to import app: {}".format(wsgi_handler.config["app"]))
+
+    statuses = []
+    for request in requests:
+        event = serverless_wsgi.get_synthetic_event(request)
+        try:
+            response = serverless_wsgi.handle_request(
+                wsgi_handler.wsgi_app, event, {}, wsgi_handler.settings
+            )
+            statuses.append(response.get("statusCode"))
+        except Exception as err:
+            statuses.append(str(err))
+
+    for module in list(sys.modules.values()):
+        filename = getattr(module, "__file__", None)
+        if filename:
+            touched.add(os.path.realpath(filename))
+
+    with open(output, "w") as f:
+        json.dump({"files": sorted(touched), "statuses": statuses}, f)
+
+
+def run_trace(package_root, requirements_dir, requests):
+    """Trace the application in a new interpreter without site-packages"""
+    fd, output = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        p = subprocess.Popen(
+            [
+                sys.executable,
+                "-S",
+                os.path.abspath(__file__),
+                "--trace",
+                output,
+                "--requests",
+                json.dumps(requests),
+                package_root,
+                requirements_dir,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        _, stderr = p.communicate()
+        if p.returncode != 0:
+            sys.exit(
+                "Failed to trace application:\n{}".format(stderr.decode("utf-8"))
+            )
+
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+
+def matches_allowlist(path, allowlist):
+    """
+    Allowlist entries are either module names, such as `jinja2.ext`, matching the
+    module and its submodules, or glob patterns of paths, such as `botocore/data/*`.
+    """
+    for entry in allowlist:
+        if "/" in entry or "*" in entry or "?" in entry:
+            if fnmatch.fnmatch(path, entry) or path.startswith(entry.rstrip("/") + "/"):
+                return True
+        else:
+            prefix = entry.replace(".", "/")
+            if (
+                path.startswith(prefix + "/")
+                or path == prefix + ".py"
+                or fnmatch.fnmatch(path, prefix + ".*")
+            ):
+                return True
+    return False
+
+
+def get_kept_files(files, touched, allowlist):
+    """
+    Select the files to keep out of `files`, relative to the requirements
+    directory, given the relative paths of the files touched by the application.
+    """
+    used_packages = set(path.split("/", 1)[0] for path in touched)
+    kept = set()
+
+    for path in files:
+        if (
+            path in touched
+            or matches_allowlist(path, allowlist)
+            or (
+                path.split("/", 1)[0] in used_packages
+                and any(fnmatch.fnmatch(path, pattern) for pattern in NATIVE_PATTERNS)
+            )
+        ):
+            kept.add(path)
+
+    # Kept modules can only be imported through their parent packages
+    for path in list(kept):
+        parent = os.path.dirname(path)
+        while parent:
+            init = parent + "/__init__.py"
+            if init in files:
+                kept.add(init)
+            parent = os.path.dirname(parent)
+
+    return kept
+
+
+def list_files(requirements_dir):
+    files = {}
+    for root, dirs, filenames in os.walk(requirements_dir):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            relative = os.path.relpath(path, requirements_dir).replace(os.sep, "/")
+            if relative not in (ARCHIVE_NAME, MANIFEST_NAME):
+                files[relative] = os.path.getsize(path)
+    return files
+
+
+def remove_empty_dirs(requirements_dir):
+    for root, dirs, filenames in os.walk(requirements_dir, topdown=False):
+        if root != requirements_dir and not os.listdir(root):
+            os.rmdir(root)
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024.0
+    return "{:.1f} GB".format(size)
+
+
+def format_report(files, pruned, mode, top=10):
+    pruned_size = sum(files[path] for path in pruned)
+    total_size = sum(files.values())
+    lines = [
+        "Pruned {} of {} files, {} of {} ({})".format(
+            len(pruned),
+            len(files),
+            format_size(pruned_size),
+            format_size(total_size),
+            "moved to {}".format(ARCHIVE_NAME) if mode == "archive" else "deleted",
+        )
+    ]
+
+    packages = {}
+    for path in pruned:
+        package = path.split("/", 1)[0]
+        packages[package] = packages.get(package, 0) + files[path]
+    for package, size in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        lines.append("{:>12}  {}".format(format_size(size), package))
+
+    return "\n".join(lines)
+
+
+def prune(package_root, requirements_dir, requests=None, allowlist=(), mode="archive"):
+    package_root = os.path.realpath(package_root)
+    requirements_dir = os.path.realpath(requirements_dir)
+    requests = requests or DEFAULT_REQUESTS
+
+    result = run_trace(package_root, requirements_dir, requests)
+    for request, status in zip(requests, result["statuses"]):
+        if not isinstance(status, int) or status >= 500:
+            print(
+                "Warning: Request {} {} failed with {}, pruning may remove files "
+                "it needs".format(request.get("method", "GET"), request.get("path", "/"), status)
+            )
+
+    touched = set(
+        os.path.relpath(path, requirements_dir).replace(os.sep, "/")
+        for path in result["files"]
+        if path.startswith(requirements_dir + os.sep)
+    )
+
+    files = list_files(requirements_dir)
+    kept = get_kept_files(files, touched, allowlist)
+    pruned = sorted(set(files) - kept)
+
+    if mode == "archive":
+        archive = os.path.join(requirements_dir, ARCHIVE_NAME)
+        with zipfile.ZipFile(archive, "a", zipfile.ZIP_DEFLATED) as zf:
+            for path in pruned:
+                zf.write(os.path.join(requirements_dir, path), path)
+
+    for path in pruned:
+        os.remove(os.path.join(requirements_dir, path))
+    remove_empty_dirs(requirements_dir)
+
+    print(format_report(files, pruned, mode))
+
+
+def parse_args():  # pragma: no cover
+    parser = argparse.ArgumentParser(description="serverless-wsgi requirements pruner")
+    parser.add_argument("package_root", help="Directory containing wsgi_handler.py")
+    parser.add_argument("requirements_dir", help="Directory of installed requirements")
+    parser.add_argument(
+        "--requests",
+        type=json.loads,
+        default=None,
+        help="JSON list of requests to run, as objects of method, path and headers",
+    )
+    parser.add_argument(
+        "--allow",
+        action="append",
+        default=[],
+        help="Module name or path pattern to keep, may be repeated",
+    )
+    parser.add_argument("--mode", choices=["archive", "delete"], default="archive")
+    parser.add_argument("--trace", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    args = parse_args()
+    if args.trace:
+        trace(
+            args.package_root,
+            args.requirements_dir,
+            args.requests or DEFAULT_REQUESTS,
+            args.trace,
+        )
+    else:
+        prune(
+            args.package_root,
+            args.requirements_dir,
+            args.requests,
+            args.allow,
+            args.mode,
+        )
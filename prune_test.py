@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import prune
+import shutil
+import werkzeug
+import markupsafe
+import zipfile
+
+
+def test_matches_allowlist():
+    allowlist = ["jinja2.ext", "botocore/data/s3/*", "babel/locale-data/"]
+
+    assert prune.matches_allowlist("jinja2/ext.py", allowlist)
+    assert prune.matches_allowlist("jinja2/ext/__init__.py", allowlist)
+    assert prune.matches_allowlist("jinja2/ext.cpython-311-x86_64-linux-gnu.so", allowlist)
+    assert prune.matches_allowlist("botocore/data/s3/2006-03-01/service-2.json", allowlist)
+    assert prune.matches_allowlist("babel/locale-data/da.dat", allowlist)
+    assert not prune.matches_allowlist("jinja2/extensions.py", allowlist)
+    assert not prune.matches_allowlist("botocore/data/ec2/service-2.json", allowlist)
+
+
+def test_get_kept_files():
+    files = {
+        "pkg/__init__.py": 10,
+        "pkg/sub/__init__.py": 10,
+        "pkg/sub/used.py": 10,
+        "pkg/sub/unused.py": 10,
+        "pkg/_speedups.cpython-311-x86_64-linux-gnu.so": 10,
+        "pkg/allowed.py": 10,
+        "unused/__init__.py": 10,
+        "unused/_native.so": 10,
+    }
+
+    kept = prune.get_kept_files(files, {"pkg/sub/used.py"}, ["pkg.allowed"])
+
+    assert kept == {
+        "pkg/__init__.py",
+        "pkg/sub/__init__.py",
+        "pkg/sub/used.py",
+        "pkg/_speedups.cpython-311-x86_64-linux-gnu.so",
+        "pkg/allowed.py",
+    }
+
+
+def test_format_report():
+    files = {"pkg/a.py": 1024, "pkg/b.py": 1024, "big/c.py": 4096, "keep.py": 10}
+
+    report = prune.format_report(files, ["pkg/a.py", "big/c.py"], "delete")
+
+    assert report.splitlines() == [
+        "Pruned 2 of 4 files, 5.0 KB of 6.0 KB (deleted)",
+        "      4.0 KB  big",
+        "      1.0 KB  pkg",
+    ]
+
+
+def make_package(tmp_path):
+    package_root = tmp_path / "package"
+    requirements_dir = tmp_path / "requirements"
+    package_root.mkdir()
+    requirements_dir.mkdir()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    for name in ("wsgi_handler.py", "serverless_wsgi.py"):
+        shutil.copy(os.path.join(root, name), str(package_root))
+    (package_root / ".serverless-wsgi").write_text(json.dumps({"app": "api.app"}))
+    (package_root / "api.py").write_text(
+        "import used\n"
+        "def app(environ, start_response):\n"
+        "    start_response('200 OK', [('Content-Type', 'text/plain')])\n"
+        "    return [used.greeting().encode()]\n"
+    )
+
+    for module in (werkzeug, markupsafe):
+        shutil.copytree(
+            os.path.dirname(module.__file__),
+            str(requirements_dir / module.__name__),
+            ignore=shutil.ignore_patterns("__pycache__"),
+        )
+
+    used = requirements_dir / "used"
+    used.mkdir()
+    (used / "__init__.py").write_text(
+        "import os\n"
+        "def greeting():\n"
+        "    with open(os.path.join(os.path.dirname(__file__), 'greeting.txt')) as f:\n"
+        "        return f.read()\n"
+    )
+    (used / "greeting.txt").write_text("Hello")
+    (used / "unused.py").write_text("")
+
+    unused = requirements_dir / "unused"
+    unused.mkdir()
+    (unused / "__init__.py").write_text("")
+
+    return package_root, requirements_dir
+
+
+def test_prune(tmp_path, capsys):
+    package_root, requirements_dir = make_package(tmp_path)
+
+    prune.prune(str(package_root), str(requirements_dir), allowlist=["werkzeug.debug"])
+
+    assert (requirements_dir / "used" / "__init__.py").exists()
+    assert (requirements_dir / "used" / "greeting.txt").exists()
+    assert (requirements_dir / "werkzeug" / "exceptions.py").exists()
+    assert (requirements_dir / "werkzeug" / "debug" / "__init__.py").exists()
+    assert not (requirements_dir / "used" / "unused.py").exists()
+    assert not (requirements_dir / "unused").exists()
+
+    with zipfile.ZipFile(str(requirements_dir / prune.ARCHIVE_NAME)) as zf:
+        names = zf.namelist()
+    assert "used/unused.py" in names
+    assert "unused/__init__.py" in names
+    assert "werkzeug/exceptions.py" not in names
+
+    assert "moved to {}".format(prune.ARCHIVE_NAME) in capsys.readouterr().out
+
+
+def test_prune_delete(tmp_path):
+    package_root, requirements_dir = make_package(tmp_path)
+
+    prune.prune(
+        str(package_root),
+        str(requirements_dir),
+        requests=[{"method": "GET", "path": "/missing"}],
+        mode="delete",
+    )
+
+    assert (requirements_dir / "used" / "greeting.txt").exists()
+    assert not (requirements_dir / "unused").exists()
+    assert not (requirements_dir / prune.ARCHIVE_NAME).exists()
+
+
+def test_prune_failed_request(tmp_path, monkeypatch, capsys):
+    package_root, requirements_dir = make_package(tmp_path)
+    monkeypatch.setattr(
+        prune, "run_trace", lambda *args: {"files": [], "statuses": [500]}
+    )
+
+    # Requests default to the root path
+    prune.prune(str(package_root), str(requirements_dir), requests=[{"method": "POST"}])
+
+    assert "Request POST / failed with 500" in capsys.readouterr().out
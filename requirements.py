@@ -8,6 +8,8 @@ Inspired by: https://github.com/awslabs/chalice
 
 Author: Logan Raarup <logan@logan.dk>
 """
+import hashlib
+import json
 import os
 import platform
 import shlex
@@ -21,26 +23,367 @@ except ImportError:  # pragma: no cover
     sys.exit("Unable to load virtualenv, please install")
 
 
-def package(req_files, target_dir, pip_args=""):
-    venv_dir = os.path.join(target_dir, ".venv")
-    tmp_dir = os.path.join(target_dir, ".tmp")
+# Bump when the layout of installed requirements changes, to invalidate caches
+CACHE_VERSION = "1"
+
+# Number of installations kept in the requirements cache
+CACHE_SIZE = 5
+
+
+# Versions of glibc on the Lambda runtimes, which determine the compatible
+# manylinux wheels, by the first Python version of each Amazon Linux release
+LAMBDA_GLIBC = [((3, 12), "2.34"), ((3, 8), "2.26"), ((3, 0), "2.17")]
+
+# Architectures of Lambda functions, and the machine names used in wheel tags
+LAMBDA_MACHINES = {"x86_64": "x86_64", "arm64": "aarch64"}
+
+# Versions of glibc for which uv accepts a `--python-platform`
+UV_MANYLINUX = [17, 28, 31, 32, 33, 34, 35, 36, 37, 38, 39, 40]
+
+
+def get_cache_dir(name="requirements"):
+    """Directory of a cache shared between services"""
+    base = os.environ.get("SERVERLESS_WSGI_CACHE_DIR")
+    if not base:
+        base = os.path.join(
+            os.environ.get("XDG_CACHE_HOME")
+            or os.path.join(os.path.expanduser("~"), ".cache"),
+            "serverless-wsgi",
+        )
+    return os.path.join(base, name)
+
+
+def get_target(python_version, architecture="x86_64", glibc=None):
+    """
+    Describe the Lambda platform to install wheels for. The version of glibc
+    defaults to that of the Amazon Linux release of the Python runtime.
+    """
+    if architecture not in LAMBDA_MACHINES:
+        sys.exit("Unsupported architecture: {}".format(architecture))
+
+    if glibc is None:
+        version = tuple(int(v) for v in python_version.split("."))
+        glibc = next(g for v, g in LAMBDA_GLIBC if version >= v)
+
+    return {
+        "python_version": python_version,
+        "architecture": architecture,
+        "glibc": glibc,
+    }
+
+
+def get_platform_tags(target):
+    """Platform tags of the wheels compatible with the target, most specific first"""
+    machine = LAMBDA_MACHINES[target["architecture"]]
+    major, minor = (int(v) for v in target["glibc"].split("."))
+
+    tags = [
+        "manylinux_{}_{}_{}".format(major, m, machine) for m in range(minor, 16, -1)
+    ]
+    tags.append("manylinux2014_{}".format(machine))
+    if machine == "x86_64":
+        tags += ["manylinux2010_x86_64", "manylinux1_x86_64"]
+    return tags
 
+
+def get_pip_target_args(target):
+    args = [
+        "--only-binary=:all:",
+        "--implementation",
+        "cp",
+        "--python-version",
+        target["python_version"],
+    ]
+    for tag in get_platform_tags(target):
+        args += ["--platform", tag]
+    return args
+
+
+def get_uv_target_args(target):
+    minor = int(target["glibc"].split(".")[1])
+    return [
+        "--only-binary",
+        ":all:",
+        "--python-version",
+        target["python_version"],
+        "--python-platform",
+        "{}-manylinux_2_{}".format(
+            LAMBDA_MACHINES[target["architecture"]],
+            max(v for v in UV_MANYLINUX if v <= minor),
+        ),
+    ]
+
+
+def format_target(target):
+    return "Python {} on {} (glibc {})".format(
+        target["python_version"], target["architecture"], target["glibc"]
+    )
+
+
+def hash_requirements_file(digest, req_file, seen):
+    """Hash a requirements file, including files referenced with `-r` or `-c`"""
+    req_file = os.path.abspath(req_file)
+    if req_file in seen:
+        return
+    seen.add(req_file)
+
+    with open(req_file, "rb") as f:
+        content = f.read()
+    digest.update(content + b"\0")
+
+    for line in content.decode("utf-8", "replace").splitlines():
+        parts = line.split()
+        # Local paths are resolved relative to the requirements file
+        if parts and (
+            parts[0] in ("-e", "--editable")
+            or parts[0].startswith((".", "/"))
+            or "file:" in line
+        ):
+            digest.update(os.path.dirname(req_file).encode("utf-8") + b"\0")
+        if len(parts) >= 2 and parts[0] in (
+            "-r",
+            "--requirement",
+            "-c",
+            "--constraint",
+        ):
+            included = os.path.join(os.path.dirname(req_file), parts[1])
+            if os.path.isfile(included):
+                hash_requirements_file(digest, included, seen)
+
+
+def get_cache_key(req_files, pip_args="", installer="pip", target=None):
+    """
+    Key of an installation, from the requirements files, installer and its
+    arguments, and the Python version and platform that packages are installed for.
+    """
+    if target is None:
+        platform_values = (
+            platform.python_implementation(),
+            "{}.{}".format(*sys.version_info[:2]),
+            sys.platform,
+            platform.machine(),
+        )
+    else:
+        platform_values = ("lambda", format_target(target))
+
+    digest = hashlib.sha256()
+    for value in (CACHE_VERSION, installer, pip_args) + platform_values:
+        digest.update(value.encode("utf-8") + b"\0")
+
+    seen = set()
     for req_file in req_files:
-        if not os.path.isfile(req_file):
-            sys.exit("No requirements file found in: {}".format(req_file))
+        hash_requirements_file(digest, req_file, seen)
 
-    if os.path.exists(target_dir):
-        if not os.path.isdir(target_dir):
-            sys.exit("Existing non-directory found at: {}".format(target_dir))
-        shutil.rmtree(target_dir)
-    os.mkdir(target_dir)
+    return digest.hexdigest()
 
-    if os.path.exists(venv_dir):
-        shutil.rmtree(venv_dir)
 
-    if os.path.exists(tmp_dir):
-        shutil.rmtree(tmp_dir)
+# Manifest of the sizes, mtimes and hashes of synced files, kept in the target
+MANIFEST_NAME = ".requirements-manifest.json"
+
+# Entries at the root of a synced directory that are not part of its contents
+RESERVED_NAMES = (".venv", MANIFEST_NAME)
+
+BLACKLIST = [
+    "pip",
+    "pip-*",
+    "wheel",
+    "wheel-*",
+    "setuptools",
+    "setuptools-*",
+    "*.dist-info",
+    "easy_install.*",
+    "*.pyc",
+    "__pycache__",
+    "_virtualenv.*",
+    "distutils-precedence.pth",
+    "six.py",
+    "zipp.py",
+]
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_tree(root, ignore=None):
+    """Relative paths of the files under `root`, skipping ignored names"""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        relative = os.path.relpath(dirpath, root)
+        if relative == os.curdir:
+            relative = ""
+            dirnames[:] = [d for d in dirnames if d not in RESERVED_NAMES]
+            filenames = [f for f in filenames if f not in RESERVED_NAMES]
+        if ignore is not None:
+            ignored = ignore(dirpath, dirnames + filenames)
+            dirnames[:] = [d for d in dirnames if d not in ignored]
+            filenames = [f for f in filenames if f not in ignored]
+        files.extend(os.path.join(relative, f) for f in filenames)
+    return files
+
+
+def load_manifest(target_dir):
+    try:
+        with open(os.path.join(target_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def place_file(source, target, mode):
+    """Atomically replace `target` by moving, hardlinking or copying `source`"""
+    if os.path.isdir(target) and not os.path.islink(target):
+        shutil.rmtree(target)
+    parent = os.path.dirname(target)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+
+    if mode == "move" and not os.path.islink(source):
+        os.replace(source, target)
+        return
+
+    tmp_target = target + ".sync"
+    if os.path.lexists(tmp_target):
+        os.remove(tmp_target)
+    try:
+        os.link(source, tmp_target)
+    except OSError:
+        # Linking fails across file systems and on some Windows file systems
+        shutil.copy2(source, tmp_target)
+    os.replace(tmp_target, target)
+
+
+def sync_tree(source_dir, target_dir, ignore=None, mode="link"):
+    """
+    Make `target_dir` hold the same files as `source_dir`. Files whose contents are
+    unchanged are left untouched, keeping their mtimes, and the hashes of synced
+    files are recorded in a manifest, so the target is not hashed again on the
+    next sync. New and changed files are moved from the source with the `move`
+    mode, or hardlinked otherwise, falling back to a copy.
+    """
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+
+    manifest = load_manifest(target_dir)
+    synced = {}
+    stats = {"unchanged": 0, "updated": 0, "removed": 0}
+
+    for relative in list_tree(source_dir, ignore):
+        key = relative.replace(os.sep, "/")
+        source = os.path.join(source_dir, relative)
+        target = os.path.join(target_dir, relative)
+        source_stat = os.stat(source)
+        digest = None
+
+        if os.path.isfile(target) and not os.path.islink(target):
+            target_stat = os.stat(target)
+            recorded = manifest.get(key)
+            if recorded and recorded[:2] == [
+                target_stat.st_size,
+                target_stat.st_mtime_ns,
+            ]:
+                target_digest = recorded[2]
+            else:
+                target_digest = None
+
+            if os.path.samestat(source_stat, target_stat):
+                digest = target_digest or hash_file(target)
+            elif source_stat.st_size == target_stat.st_size:
+                digest = hash_file(source)
+                if digest != (target_digest or hash_file(target)):
+                    digest = None
+
+        if digest is not None:
+            stats["unchanged"] += 1
+        else:
+            digest = hash_file(source)
+            place_file(source, target, mode)
+            stats["updated"] += 1
+
+        target_stat = os.stat(target)
+        synced[key] = [target_stat.st_size, target_stat.st_mtime_ns, digest]
+
+    for relative in list_tree(target_dir):
+        if relative.replace(os.sep, "/") not in synced:
+            os.remove(os.path.join(target_dir, relative))
+            stats["removed"] += 1
+
+    for dirpath, dirnames, filenames in os.walk(target_dir, topdown=False):
+        relative = os.path.relpath(dirpath, target_dir)
+        if (
+            relative != os.curdir
+            and relative.split(os.sep, 1)[0] not in RESERVED_NAMES
+            and not os.listdir(dirpath)
+        ):
+            os.rmdir(dirpath)
 
+    with open(os.path.join(target_dir, MANIFEST_NAME), "w") as f:
+        json.dump(synced, f)
+
+    return stats
+
+
+def store_in_cache(target_dir, cache_dir, key):
+    """Link an installation into the cache, evicting the least recently used ones"""
+    entry = os.path.join(cache_dir, key)
+    tmp_entry = "{}.{}.tmp".format(entry, os.getpid())
+    if os.path.exists(tmp_entry):
+        shutil.rmtree(tmp_entry)
+
+    sync_tree(target_dir, tmp_entry)
+    if os.path.exists(entry):
+        shutil.rmtree(entry)
+    os.rename(tmp_entry, entry)
+
+    entries = [
+        os.path.join(cache_dir, name)
+        for name in os.listdir(cache_dir)
+        if not name.endswith(".tmp")
+    ]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for stale in entries[CACHE_SIZE:]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def restore_from_cache(target_dir, cache_dir, key):
+    """Sync a cached installation into place, returning the sync statistics"""
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return None
+
+    stats = sync_tree(entry, target_dir)
+
+    # Mark the entry as recently used
+    os.utime(entry)
+    return stats
+
+
+def format_sync_stats(stats):
+    return "{updated} updated, {unchanged} unchanged, {removed} removed".format(
+        **stats
+    )
+
+
+def find_uv():
+    """Locate the uv executable, either installed as a Python package or on PATH"""
+    try:
+        import uv
+
+        return uv.find_uv_bin()
+    except (ImportError, FileNotFoundError):
+        return shutil.which("uv")
+
+
+def install_with_pip(req_files, venv_dir, pip_args, target=None):
+    """
+    Install requirements into a new virtualenv, returning its site-packages. When
+    targeting another platform, wheels are downloaded to the wheelhouse, and
+    installed from there into a directory with the pip of the virtualenv.
+    """
     if hasattr(virtualenv, "main"):
         original = sys.argv
         sys.argv = ["", venv_dir, "--quiet", "-p", sys.executable]
@@ -70,6 +413,9 @@ def package(req_files, target_dir, pip_args=""):
     if not os.path.isfile(pip_exe):
         sys.exit("Pip not found in: {}".format(pip_exe))
 
+    if target is not None:
+        return install_wheels_with_pip(pip_exe, req_files, venv_dir, pip_args, target)
+
     for req_file in req_files:
         p = subprocess.Popen(
             [pip_exe, "install", "-r", req_file] + shlex.split(pip_args),
@@ -79,55 +425,177 @@ def package(req_files, target_dir, pip_args=""):
         if p.returncode != 0:
             sys.exit("Failed to install requirements from: {}".format(req_file))
 
+    return deps_dir
+
+
+def install_wheels_with_pip(pip_exe, req_files, venv_dir, pip_args, target):
+    """Install wheels for the target platform through the persistent wheelhouse"""
+    wheelhouse = get_cache_dir("wheelhouse")
+    deps_dir = os.path.join(venv_dir, "target")
+    target_args = get_pip_target_args(target)
+
+    for req_file in req_files:
+        # Binary-only resolution fails before anything is installed when a
+        # package has no wheel for the target
+        for args in (
+            ["download", "--dest", wheelhouse],
+            ["install", "--no-index", "--target", deps_dir],
+        ):
+            p = subprocess.Popen(
+                [pip_exe]
+                + args
+                + ["--find-links", wheelhouse, "-r", req_file]
+                + target_args
+                + shlex.split(pip_args),
+                stdout=subprocess.PIPE,
+            )
+            p.communicate()
+            if p.returncode != 0:
+                sys.exit(
+                    "Failed to install requirements from: {}, make sure that wheels "
+                    "are available for {}".format(req_file, format_target(target))
+                )
+
+    # Console scripts are installed next to the packages
+    shutil.rmtree(os.path.join(deps_dir, "bin"), ignore_errors=True)
+    return deps_dir
+
+
+def install_with_uv(uv_exe, req_files, target_dir, pip_args, target=None):
+    """
+    Install requirements directly into a directory with uv, resolving all
+    requirements files together, without creating a virtualenv. Wheels for
+    other platforms are kept in the cache of uv, shared between projects.
+    """
+    args = [uv_exe, "pip", "install", "--target", target_dir]
+    if target is None:
+        args += ["--python", sys.executable]
+    else:
+        args += get_uv_target_args(target)
+    for req_file in req_files:
+        args += ["-r", req_file]
+
+    p = subprocess.Popen(args + shlex.split(pip_args), stdout=subprocess.PIPE)
+    p.communicate()
+    if p.returncode != 0:
+        message = "Failed to install requirements from: {}".format(
+            ", ".join(req_files)
+        )
+        if target is not None:
+            message += ", make sure that wheels are available for {}".format(
+                format_target(target)
+            )
+        sys.exit(message)
+
+    # Console scripts are installed next to the packages
+    shutil.rmtree(os.path.join(target_dir, "bin"), ignore_errors=True)
+    return target_dir
+
+
+def package(
+    req_files, target_dir, pip_args="", cache_dir=None, installer="pip", target=None
+):
+    venv_dir = os.path.join(target_dir, ".venv")
+
+    for req_file in req_files:
+        if not os.path.isfile(req_file):
+            sys.exit("No requirements file found in: {}".format(req_file))
+
+    if os.path.exists(target_dir):
+        if not os.path.isdir(target_dir):
+            sys.exit("Existing non-directory found at: {}".format(target_dir))
+    else:
+        os.mkdir(target_dir)
+
+    uv_exe = None
+    if installer == "uv":
+        uv_exe = find_uv()
+        if uv_exe is None:
+            print("Unable to find uv, falling back to pip")
+            installer = "pip"
+
+    if cache_dir:
+        key = get_cache_key(req_files, pip_args, installer, target)
+        stats = restore_from_cache(target_dir, cache_dir, key)
+        if stats is not None:
+            print(
+                "Using cached requirements: {} ({})".format(
+                    key[:12], format_sync_stats(stats)
+                )
+            )
+            return
+
+    if os.path.exists(venv_dir):
+        shutil.rmtree(venv_dir)
+
+    if target is not None:
+        print("Installing wheels for {}".format(format_target(target)))
+
+    if uv_exe:
+        deps_dir = install_with_uv(uv_exe, req_files, venv_dir, pip_args, target)
+    else:
+        deps_dir = install_with_pip(req_files, venv_dir, pip_args, target)
+
     if not os.path.isdir(deps_dir):
         sys.exit("Installed packages not found in: {}".format(deps_dir))
 
-    blacklist = [
-        "pip",
-        "pip-*",
-        "wheel",
-        "wheel-*",
-        "setuptools",
-        "setuptools-*",
-        "*.dist-info",
-        "easy_install.*",
-        "*.pyc",
-        "__pycache__",
-        "_virtualenv.*",
-        "distutils-precedence.pth",
-        "six.py",
-        "zipp.py"
-    ]
-
-    shutil.copytree(
-        deps_dir, tmp_dir, symlinks=False, ignore=shutil.ignore_patterns(*blacklist)
+    # Installed files are moved into place, leaving unchanged files untouched
+    stats = sync_tree(
+        deps_dir, target_dir, shutil.ignore_patterns(*BLACKLIST), "move"
     )
-    for f in os.listdir(tmp_dir):
-        target = os.path.join(target_dir, f)
-        if os.path.isdir(target):
-            shutil.rmtree(target)
-        elif os.path.exists(target):
-            os.remove(target)
-        shutil.move(os.path.join(tmp_dir, f), target_dir)
     shutil.rmtree(venv_dir)
-    shutil.rmtree(tmp_dir)
+    print("Installed requirements: {}".format(format_sync_stats(stats)))
+
+    if cache_dir:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        store_in_cache(target_dir, cache_dir, key)
 
 
 if __name__ == "__main__":  # pragma: no cover
-    args = sys.argv
-    pip_args = ""
+    args = sys.argv[1:]
+    cache_dir = get_cache_dir()
+    options = {
+        "--pip-args": "",
+        "--installer": "pip",
+        "--target-python": None,
+        "--target-arch": "x86_64",
+        "--target-glibc": None,
+    }
 
-    if len(args) > 3 and args[1] == "--pip-args":
-        pip_args = args[2]
-        args = args[3:]
-    else:
-        args = args[1:]
+    while args and (args[0] == "--no-cache" or (args[0] in options and len(args) > 2)):
+        if args[0] == "--no-cache":
+            cache_dir = None
+            args = args[1:]
+        else:
+            options[args[0]] = args[1]
+            args = args[2:]
 
     if len(args) < 2:
         sys.exit(
-            "Usage: {} --pip-args '--no-deps' REQ_FILE... TARGET_DIR".format(
+            "Usage: {} --pip-args '--no-deps' [--no-cache] "
+            "[--installer uv|pip] [--target-python 3.12 [--target-arch arm64] "
+            "[--target-glibc 2.34]] REQ_FILE... TARGET_DIR".format(
                 os.path.basename(sys.argv[0])
             )
         )
 
-    package(args[:-1], args[-1], pip_args)
+    if options["--installer"] not in ("pip", "uv"):
+        sys.exit("Unknown installer: {}".format(options["--installer"]))
+
+    target = None
+    if options["--target-python"]:
+        target = get_target(
+            options["--target-python"],
+            options["--target-arch"],
+            options["--target-glibc"],
+        )
+
+    package(
+        args[:-1],
+        args[-1],
+        options["--pip-args"],
+        cache_dir,
+        options["--installer"],
+        target,
+    )
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import json
 import os
 import platform
 import pytest
@@ -63,8 +64,15 @@ def mock_system(monkeypatch):
     )
     monkeypatch.setattr(os.path, "exists", partial(mock_any, "os.path.exists", True))
     monkeypatch.setattr(shutil, "rmtree", partial(mock_any, "shutil.rmtree", None))
-    monkeypatch.setattr(shutil, "copytree", partial(mock_any, "shutil.copytree", None))
-    monkeypatch.setattr(shutil, "move", partial(mock_any, "shutil.move", None))
+    monkeypatch.setattr(
+        requirements,
+        "sync_tree",
+        partial(
+            mock_any,
+            "requirements.sync_tree",
+            {"updated": 3, "unchanged": 0, "removed": 0},
+        ),
+    )
     monkeypatch.setattr(
         platform, "system", partial(mock_any, "platform.system", "Linux")
     )
@@ -88,14 +96,10 @@ def test_package(mock_system, mock_virtualenv):
     # Checks that output dir exists
     assert mock_system.pop(0) == ("os.path.exists", ("/tmp",))
     assert mock_system.pop(0) == ("os.path.isdir", ("/tmp",))
-    assert mock_system.pop(0) == ("shutil.rmtree", ("/tmp",))
-    assert mock_system.pop(0) == ("os.mkdir", ("/tmp",))
 
-    # Checks and removes existing venv/tmp dirs
+    # Checks and removes existing venv
     assert mock_system.pop(0) == ("os.path.exists", ("/tmp/.venv",))
     assert mock_system.pop(0) == ("shutil.rmtree", ("/tmp/.venv",))
-    assert mock_system.pop(0) == ("os.path.exists", ("/tmp/.tmp",))
-    assert mock_system.pop(0) == ("shutil.rmtree", ("/tmp/.tmp",))
 
     # Looks up system type
     assert mock_system.pop(0) == ("platform.system", ())
@@ -119,44 +123,31 @@ def test_package(mock_system, mock_virtualenv):
         (["/tmp/.venv/bin/pip", "install", "-r", "/path2/requirements.txt"],),
     )
 
-    # Copies installed packages to temporary directory
+    # Moves installed packages into place
     assert mock_system.pop(0) == (
         "os.path.isdir",
         ("/tmp/.venv/lib/dir1/site-packages",),
     )
-    assert mock_system.pop(0) == (
-        "shutil.copytree",
-        ("/tmp/.venv/lib/dir1/site-packages", "/tmp/.tmp"),
-    )
-
-    # Lists installed packages
-    assert mock_system.pop(0) == ("os.listdir", ("/tmp/.tmp",))
+    func, args = mock_system.pop(0)
+    assert func == "requirements.sync_tree"
+    assert args[:2] == ("/tmp/.venv/lib/dir1/site-packages", "/tmp")
+    assert args[3] == "move"
+    assert args[2]("/tmp", ["pip", "flask", "flask-3.0.0.dist-info"]) == {
+        "pip",
+        "flask-3.0.0.dist-info",
+    }
 
-    # Clears existing installation of package 1
-    assert mock_system.pop(0) == ("os.path.isdir", ("/tmp/dir1",))
-    assert mock_system.pop(0) == ("shutil.rmtree", ("/tmp/dir1",))
+    # Performs final cleanup
+    assert mock_system.pop(0) == ("shutil.rmtree", ("/tmp/.venv",))
+    assert mock_system == []
 
-    # Moves package 1 into place
-    assert mock_system.pop(0) == ("shutil.move", ("/tmp/.tmp/dir1", "/tmp"))
 
-    # Clears existing installation of package 2
-    assert mock_system.pop(0) == ("os.path.isdir", ("/tmp/dir2",))
-    assert mock_system.pop(0) == ("shutil.rmtree", ("/tmp/dir2",))
+def test_package_missing_target(mock_system, mock_virtualenv, monkeypatch):
+    monkeypatch.setattr(os.path, "exists", lambda f: False)
 
-    # Moves package 2 into place
-    assert mock_system.pop(0) == ("shutil.move", ("/tmp/.tmp/dir2", "/tmp"))
+    requirements.package(["/path1/requirements.txt"], "/tmp")
 
-    # Clears existing installation of package 3
-    assert mock_system.pop(0) == ("os.path.isdir", ("/tmp/file1",))
-    assert mock_system.pop(0) == ("os.path.exists", ("/tmp/file1",))
-    assert mock_system.pop(0) == ("os.remove", ("/tmp/file1",))
-
-    # Moves package 3 into place
-    assert mock_system.pop(0) == ("shutil.move", ("/tmp/.tmp/file1", "/tmp"))
-
-    # Performs final cleanup
-    assert mock_system.pop(0) == ("shutil.rmtree", ("/tmp/.venv",))
-    assert mock_system.pop(0) == ("shutil.rmtree", ("/tmp/.tmp",))
+    assert ("os.mkdir", ("/tmp",)) in mock_system
 
 
 def test_package_missing_requirements_file(mock_system, mock_virtualenv, monkeypatch):
@@ -223,8 +214,10 @@ def test_package_with_pip_args(mock_system, mock_virtualenv):
         "--no-deps --imaginary-arg 'imaginary \"value\"'",
     )
 
+    pip_calls = [c for c in mock_system if c[0] == "subprocess.Popen"]
+
     # Invokes pip for package installation
-    assert mock_system[15] == (
+    assert pip_calls[0] == (
         "subprocess.Popen",
         (
             [
@@ -238,3 +231,287 @@ def test_package_with_pip_args(mock_system, mock_virtualenv):
             ],
         ),
     )
+
+
+def test_package_with_uv(mock_system, mock_virtualenv, monkeypatch):
+    monkeypatch.setattr(requirements, "find_uv", lambda: "/usr/bin/uv")
+
+    requirements.package(
+        ["/path1/requirements.txt", "/path2/requirements.txt"],
+        "/tmp",
+        "--no-deps",
+        installer="uv",
+    )
+
+    assert mock_virtualenv == []
+
+    # Resolves all requirements files in a single uv invocation
+    pip_calls = [c for c in mock_system if c[0] == "subprocess.Popen"]
+    assert pip_calls == [
+        (
+            "subprocess.Popen",
+            (
+                [
+                    "/usr/bin/uv",
+                    "pip",
+                    "install",
+                    "--target",
+                    "/tmp/.venv",
+                    "--python",
+                    sys.executable,
+                    "-r",
+                    "/path1/requirements.txt",
+                    "-r",
+                    "/path2/requirements.txt",
+                    "--no-deps",
+                ],
+            ),
+        )
+    ]
+
+    sync_calls = [c for c in mock_system if c[0] == "requirements.sync_tree"]
+    assert sync_calls[0][1][:2] == ("/tmp/.venv", "/tmp")
+
+
+def test_package_without_uv(mock_system, mock_virtualenv, monkeypatch, capsys):
+    monkeypatch.setattr(requirements, "find_uv", lambda: None)
+
+    requirements.package(["/path1/requirements.txt"], "/tmp", installer="uv")
+
+    assert len(mock_virtualenv) == 1
+    assert "falling back to pip" in capsys.readouterr().out
+
+
+def test_uv_error(mock_system, mock_virtualenv, monkeypatch):
+    monkeypatch.setattr(requirements, "find_uv", lambda: "/usr/bin/uv")
+    monkeypatch.setattr(subprocess, "Popen", lambda *args, **kwargs: PopenStub(1))
+
+    with pytest.raises(SystemExit):
+        requirements.package(["/path1/requirements.txt"], "/tmp", installer="uv")
+
+
+def test_get_target():
+    assert requirements.get_target("3.12") == {
+        "python_version": "3.12",
+        "architecture": "x86_64",
+        "glibc": "2.34",
+    }
+    assert requirements.get_target("3.11", "arm64")["glibc"] == "2.26"
+    assert requirements.get_target("3.7")["glibc"] == "2.17"
+
+    with pytest.raises(SystemExit):
+        requirements.get_target("3.12", "mips")
+
+
+def test_get_platform_tags():
+    assert requirements.get_platform_tags(requirements.get_target("3.9", "arm64")) == [
+        "manylinux_2_26_aarch64",
+        "manylinux_2_25_aarch64",
+        "manylinux_2_24_aarch64",
+        "manylinux_2_23_aarch64",
+        "manylinux_2_22_aarch64",
+        "manylinux_2_21_aarch64",
+        "manylinux_2_20_aarch64",
+        "manylinux_2_19_aarch64",
+        "manylinux_2_18_aarch64",
+        "manylinux_2_17_aarch64",
+        "manylinux2014_aarch64",
+    ]
+    assert requirements.get_platform_tags(requirements.get_target("3.7"))[-4:] == [
+        "manylinux_2_17_x86_64",
+        "manylinux2014_x86_64",
+        "manylinux2010_x86_64",
+        "manylinux1_x86_64",
+    ]
+
+
+def test_get_uv_target_args():
+    assert requirements.get_uv_target_args(requirements.get_target("3.11")) == [
+        "--only-binary",
+        ":all:",
+        "--python-version",
+        "3.11",
+        "--python-platform",
+        "x86_64-manylinux_2_17",
+    ]
+    assert requirements.get_uv_target_args(
+        requirements.get_target("3.13", "arm64")
+    )[-1] == "aarch64-manylinux_2_34"
+
+
+def test_package_for_target(mock_system, mock_virtualenv, monkeypatch):
+    monkeypatch.setenv("SERVERLESS_WSGI_CACHE_DIR", "/cache")
+    target = requirements.get_target("3.12", "arm64")
+
+    requirements.package(["/path1/requirements.txt"], "/tmp", target=target)
+
+    target_args = ["--only-binary=:all:", "--implementation", "cp"]
+    target_args += ["--python-version", "3.12"]
+    for tag in requirements.get_platform_tags(target):
+        target_args += ["--platform", tag]
+
+    # Downloads wheels to the wheelhouse and installs them from there
+    pip_calls = [c for c in mock_system if c[0] == "subprocess.Popen"]
+    assert pip_calls == [
+        (
+            "subprocess.Popen",
+            (
+                ["/tmp/.venv/bin/pip", "download", "--dest", "/cache/wheelhouse"]
+                + ["--find-links", "/cache/wheelhouse"]
+                + ["-r", "/path1/requirements.txt"]
+                + target_args,
+            ),
+        ),
+        (
+            "subprocess.Popen",
+            (
+                ["/tmp/.venv/bin/pip", "install", "--no-index"]
+                + ["--target", "/tmp/.venv/target"]
+                + ["--find-links", "/cache/wheelhouse"]
+                + ["-r", "/path1/requirements.txt"]
+                + target_args,
+            ),
+        ),
+    ]
+
+    sync_calls = [c for c in mock_system if c[0] == "requirements.sync_tree"]
+    assert sync_calls[0][1][:2] == ("/tmp/.venv/target", "/tmp")
+
+
+def test_package_for_target_without_wheels(mock_system, mock_virtualenv, monkeypatch):
+    monkeypatch.setattr(subprocess, "Popen", lambda *args, **kwargs: PopenStub(1))
+
+    with pytest.raises(SystemExit) as exc_info:
+        requirements.package(
+            ["/path1/requirements.txt"], "/tmp", target=requirements.get_target("3.12")
+        )
+
+    assert "wheels are available for Python 3.12 on x86_64" in str(exc_info.value)
+
+
+def test_cache_key(tmp_path):
+    base = tmp_path / "base.txt"
+    base.write_text("werkzeug==3.0.0\n")
+    req = tmp_path / "requirements.txt"
+    req.write_text("-r base.txt\nflask==3.0.0\n")
+
+    key = requirements.get_cache_key([str(req)])
+    assert key == requirements.get_cache_key([str(req)])
+    assert key != requirements.get_cache_key([str(req)], "--no-deps")
+    assert key != requirements.get_cache_key(
+        [str(req)], target=requirements.get_target("3.12")
+    )
+
+    base.write_text("werkzeug==3.0.1\n")
+    assert key != requirements.get_cache_key([str(req)])
+
+
+def test_package_from_cache(tmp_path, mock_virtualenv, capsys):
+    req = tmp_path / "requirements.txt"
+    req.write_text("flask\n")
+    cache_dir = tmp_path / "cache"
+    target = tmp_path / "target"
+    target.mkdir()
+    (target / "stale.py").write_text("")
+
+    entry = cache_dir / requirements.get_cache_key([str(req)])
+    (entry / "flask").mkdir(parents=True)
+    (entry / "flask" / "__init__.py").write_text("")
+
+    requirements.package([str(req)], str(target), cache_dir=str(cache_dir))
+
+    assert mock_virtualenv == []
+    assert os.path.samefile(
+        str(target / "flask" / "__init__.py"), str(entry / "flask" / "__init__.py")
+    )
+    assert not (target / "stale.py").exists()
+    assert "Using cached requirements" in capsys.readouterr().out
+
+
+def test_store_in_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(requirements, "CACHE_SIZE", 2)
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    target = tmp_path / "target"
+    target.mkdir()
+    (target / "module.py").write_text("")
+
+    for i, key in enumerate(["a", "b", "c"]):
+        requirements.store_in_cache(str(target), str(cache_dir), key)
+        os.utime(str(cache_dir / key), (i, i))
+
+    assert sorted(os.listdir(str(cache_dir))) == ["b", "c"]
+    assert (cache_dir / "c" / "module.py").exists()
+
+
+def make_tree(root, files):
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def test_sync_tree(tmp_path):
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    make_tree(
+        source,
+        {"pkg/__init__.py": "", "pkg/a.py": "a = 1", "pkg/b.py": "b = 2", "pip/x": ""},
+    )
+    make_tree(
+        target,
+        {
+            "pkg/__init__.py": "",
+            "pkg/a.py": "a = 0",
+            "old/__init__.py": "",
+            ".venv/keep": "",
+        },
+    )
+    os.utime(str(target / "pkg" / "__init__.py"), (1, 1))
+
+    stats = requirements.sync_tree(
+        str(source), str(target), shutil.ignore_patterns("pip"), "move"
+    )
+
+    assert stats == {"updated": 2, "unchanged": 1, "removed": 1}
+    assert (target / "pkg" / "a.py").read_text() == "a = 1"
+    assert (target / "pkg" / "b.py").read_text() == "b = 2"
+    assert os.stat(str(target / "pkg" / "__init__.py")).st_mtime == 1
+    assert not (target / "old").exists()
+    assert not (target / "pip").exists()
+    assert (target / ".venv" / "keep").exists()
+    assert not (source / "pkg" / "a.py").exists()
+
+    manifest = json.loads((target / requirements.MANIFEST_NAME).read_text())
+    assert sorted(manifest) == ["pkg/__init__.py", "pkg/a.py", "pkg/b.py"]
+
+
+def test_sync_tree_uses_manifest(tmp_path, monkeypatch):
+    target = tmp_path / "target"
+    make_tree(tmp_path / "first", {"pkg/a.py": "a = 1"})
+    make_tree(tmp_path / "second", {"pkg/a.py": "a = 1"})
+    requirements.sync_tree(str(tmp_path / "first"), str(target), mode="move")
+
+    hashed = []
+    hash_file = requirements.hash_file
+    monkeypatch.setattr(
+        requirements, "hash_file", lambda path: hashed.append(path) or hash_file(path)
+    )
+    stats = requirements.sync_tree(str(tmp_path / "second"), str(target), mode="move")
+
+    # The hash of the target file is read from the manifest
+    assert stats == {"updated": 0, "unchanged": 1, "removed": 0}
+    assert hashed == [os.path.join(str(tmp_path / "second"), "pkg", "a.py")]
+
+
+def test_cache_key_local_paths(tmp_path):
+    make_tree(tmp_path, {"web/requirements.txt": "-e ./lib\n"})
+    make_tree(tmp_path, {"admin/requirements.txt": "-e ./lib\n"})
+    make_tree(tmp_path, {"jobs/requirements.txt": "flask\n", "api/requirements.txt": "flask\n"})
+
+    assert requirements.get_cache_key(
+        [str(tmp_path / "web" / "requirements.txt")]
+    ) != requirements.get_cache_key([str(tmp_path / "admin" / "requirements.txt")])
+    assert requirements.get_cache_key(
+        [str(tmp_path / "jobs" / "requirements.txt")]
+    ) == requirements.get_cache_key([str(tmp_path / "api" / "requirements.txt")])
@@ -8,15 +8,30 @@ Inspired by: https://github.com/miserlou/zappa
 Author: Logan Raarup <logan@logan.dk>
 """
 import base64
+import binascii
+import functools
+import gc
+import http.client
 import io
+import itertools
 import json
 import os
+import random
+import shutil
 import sys
+import tempfile
+import time
+import traceback
+import zlib
 from urllib.parse import urlencode, unquote, unquote_plus
 
-from werkzeug.datastructures import Headers, iter_multi_items
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+from werkzeug.datastructures import iter_multi_items
 from werkzeug.http import HTTP_STATUS_CODES
-from werkzeug.wrappers import Response
 
 # List of MIME types that should not be base64 encoded. MIME types within `text/*`
 # are included by default.
@@ -29,6 +44,185 @@ TEXT_MIME_TYPES = [
 ]
 
 
+# Content-Type of responses from applications that don't set one
+DEFAULT_CONTENT_TYPE = "text/plain; charset=utf-8"
+
+# Compression levels used for response bodies, balancing size against latency
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def compress_gzip(body):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def compress_brotli(body):
+    return brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+# Supported response encodings, in order of preference. Brotli requires the
+# optional `brotli` package.
+COMPRESSORS = {"gzip": compress_gzip}
+if brotli is not None:
+    COMPRESSORS = {"br": compress_brotli, "gzip": compress_gzip}
+
+# Bodies smaller than this are sent uncompressed by default
+COMPRESSION_MIN_SIZE = 1024
+
+# Request bodies larger than this are spooled to a temporary file in `/tmp` when
+# lazy request body handling is enabled
+SPOOL_THRESHOLD = 1024 * 1024
+
+# Size of the chunks in which request bodies are decoded and spooled. Must be a
+# multiple of 3, so that chunks map to whole base64 quanta.
+BODY_CHUNK_SIZE = 3 * 16 * 1024
+
+# CloudWatch namespace of the invocation metrics, unless configured otherwise
+METRICS_NAMESPACE = "serverless-wsgi"
+
+# Values of boolean environment variables, such as `STRIP_STAGE_PATH`, that
+# enable the option
+TRUTHY_VALUES = ("yes", "y", "true", "t", "1")
+
+
+class Settings:
+    """
+    Read-only configuration, resolved once per container from the environment and
+    the `.serverless-wsgi` configuration, so that requests don't need to parse
+    environment variables or scan lists.
+    """
+
+    __slots__ = (
+        "strip_stage_path",
+        "base_path",
+        "text_mime_types",
+        "text_mime_prefixes",
+        "compression",
+        "compression_min_size",
+        "compression_rest_api",
+        "spool_threshold",
+        "strip_event_body",
+        "metrics_namespace",
+        "function_name",
+        "init_stats",
+    )
+
+    def __init__(
+        self,
+        strip_stage_path=False,
+        base_path=None,
+        text_mime_types=None,
+        compression=(),
+        compression_min_size=COMPRESSION_MIN_SIZE,
+        compression_rest_api=False,
+        spool_threshold=None,
+        strip_event_body=False,
+        metrics_namespace=None,
+        function_name="",
+        init_stats=None,
+    ):
+        if text_mime_types is None:
+            text_mime_types = TEXT_MIME_TYPES
+
+        # MIME types are matched exactly, except for wildcards such as `text/*`,
+        # which are matched by prefix
+        mime_types = set()
+        mime_prefixes = ["text/"]
+        for mime_type in text_mime_types:
+            mime_type = mime_type.lower()
+            if mime_type.endswith("*"):
+                mime_prefixes.append(mime_type[:-1])
+            else:
+                mime_types.add(mime_type)
+
+        self._set("strip_stage_path", bool(strip_stage_path))
+        self._set("base_path", "/" + base_path if base_path else "")
+        self._set("text_mime_types", frozenset(mime_types))
+        self._set("text_mime_prefixes", tuple(mime_prefixes))
+        self._set(
+            "compression", tuple(e for e in compression if e in COMPRESSORS)
+        )
+        self._set("compression_min_size", compression_min_size)
+        self._set("compression_rest_api", bool(compression_rest_api))
+        self._set("spool_threshold", spool_threshold)
+        self._set("strip_event_body", bool(strip_event_body))
+        self._set("metrics_namespace", metrics_namespace)
+        self._set("function_name", function_name)
+        self._set("init_stats", init_stats)
+
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Settings are read-only")
+
+    @classmethod
+    def load(cls, config=None, environ=None, init_stats=None):
+        """
+        Resolve settings from `.serverless-wsgi` configuration and environment.
+        `init_stats` are exposed to the application as `serverless.init_stats`.
+        """
+        config = config or {}
+        environ = os.environ if environ is None else environ
+
+        text_mime_types = list(TEXT_MIME_TYPES)
+        if isinstance(config.get("text_mime_types"), list):
+            text_mime_types.extend(config["text_mime_types"])
+
+        # Compression is enabled with `true` or a dict of options
+        compression = config.get("compression")
+        if compression is True:
+            compression = {}
+        elif not isinstance(compression, dict):
+            compression = {"encodings": []}
+
+        # Lazy request body handling is enabled with `true` or a dict of options
+        request_body = config.get("request_body")
+        if request_body is True:
+            request_body = {}
+        elif not isinstance(request_body, dict):
+            request_body = {"spool_threshold": None}
+
+        # Invocation metrics are enabled with `true` or a dict of options
+        metrics = config.get("metrics")
+        if metrics is True:
+            metrics = {}
+        elif not isinstance(metrics, dict):
+            metrics = {"namespace": None}
+
+        return cls(
+            strip_stage_path=environ.get("STRIP_STAGE_PATH", "").lower().strip()
+            in TRUTHY_VALUES,
+            base_path=environ.get("API_GATEWAY_BASE_PATH"),
+            text_mime_types=text_mime_types,
+            compression=compression.get("encodings", list(COMPRESSORS)),
+            compression_min_size=compression.get("min_size", COMPRESSION_MIN_SIZE),
+            compression_rest_api=compression.get("rest_api", False),
+            spool_threshold=request_body.get("spool_threshold", SPOOL_THRESHOLD),
+            strip_event_body=request_body.get("strip_event", False),
+            metrics_namespace=metrics.get("namespace", METRICS_NAMESPACE),
+            function_name=environ.get("AWS_LAMBDA_FUNCTION_NAME", ""),
+            init_stats=init_stats,
+        )
+
+    def is_text_mime_type(self, mimetype):
+        return mimetype in self.text_mime_types or mimetype.startswith(
+            self.text_mime_prefixes
+        )
+
+
+default_settings = None
+
+
+def get_default_settings():
+    """Settings used when none are passed, resolved on first use"""
+    global default_settings
+    if default_settings is None:
+        default_settings = Settings.load()
+    return default_settings
+
+
 def all_casings(input_string):
     """
     Permute all casings of a given string.
@@ -48,39 +242,174 @@ def all_casings(input_string):
                 yield first.upper() + sub_casing
 
 
+@functools.lru_cache(maxsize=128)
+def get_header_casings(name, count):
+    """Cached, bounded list of `count` casings of a header name"""
+    return tuple(itertools.islice(all_casings(name), count))
+
+
 def split_headers(headers):
     """
     If there are multiple occurrences of headers, create case-mutated variations
     in order to pass them through APIGW. This is a hack that's currently
     needed. See: https://github.com/logandk/serverless-wsgi/issues/11
     Source: https://github.com/Miserlou/Zappa/blob/master/zappa/middleware.py
+
+    This is only used as a last resort, for event formats that support neither
+    `multiValueHeaders` nor `cookies` in responses.
     """
     new_headers = {}
 
-    for key in headers.keys():
-        values = headers.get_all(key)
+    for key, values in group_headers(headers).items():
         if len(values) > 1:
-            for value, casing in zip(values, all_casings(key)):
+            casings = get_header_casings(key, len(values))
+            for value, casing in zip(values, casings):
                 new_headers[casing] = value
-        elif len(values) == 1:
+            if len(values) > len(casings):
+                # Short header names run out of casings, so the remaining values
+                # are combined into the last one rather than dropped
+                new_headers[casings[-1]] = ", ".join(values[len(casings) - 1:])
+        else:
             new_headers[key] = values[0]
 
     return new_headers
 
 
+def join_headers(headers):
+    """
+    Combine repeated headers into comma-separated values, as supported by payload
+    format 2.0 and response streaming, with `Set-Cookie` headers in a separate list.
+    """
+    new_headers = {}
+    cookies = []
+
+    for key, values in group_headers(headers).items():
+        if key.lower() == "set-cookie":
+            cookies.extend(values)
+        else:
+            new_headers[key] = ", ".join(values)
+
+    return new_headers, cookies
+
+
 def group_headers(headers):
+    """Group a list of header tuples by case-insensitive header name"""
     new_headers = {}
+    names = {}
 
-    for key in headers.keys():
-        new_headers[key] = headers.get_all(key)
+    for key, value in headers:
+        key = names.setdefault(key.lower(), key)
+        if key in new_headers:
+            new_headers[key].append(value)
+        else:
+            new_headers[key] = [value]
 
     return new_headers
 
 
+def get_header(headers, name, default=None):
+    """Look up the first value of a header in a list of header tuples"""
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return default
+
+
+class CapturedResponse:
+    """Status, headers and body captured from a WSGI application"""
+
+    __slots__ = ("status", "status_code", "headers", "body")
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.status_code = int(status.split(" ", 1)[0])
+        self.headers = headers
+        self.body = body
+
+    @property
+    def mimetype(self):
+        content_type = get_header(self.headers, "Content-Type", "")
+        return content_type.split(";", 1)[0].strip().lower()
+
+
+def call_app(app, environ):
+    """
+    Invoke the WSGI application with a minimal `start_response`, collecting the
+    headers as a plain list and joining the body chunks once.
+    """
+    response = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        # The body is buffered until the application returns, so headers can
+        # always be replaced, even when called with `exc_info`
+        response["status"] = status
+        response["headers"] = headers
+        return chunks.append
+
+    app_iter = app(environ, start_response)
+    try:
+        for data in app_iter:
+            if data:
+                chunks.append(data)
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+
+    # Like werkzeug responses, default to plain text when no Content-Type is set
+    headers = list(response["headers"])
+    if get_header(headers, "Content-Type") is None:
+        headers.append(("Content-Type", DEFAULT_CONTENT_TYPE))
+
+    return CapturedResponse(response["status"], headers, b"".join(chunks))
+
+
 def is_alb_event(event):
     return event.get("requestContext", {}).get("elb")
 
 
+def is_lambda_integration_event(event):
+    return (
+        event.get("version") is None
+        and event.get("isBase64Encoded") is None
+        and event.get("requestPath") is not None
+        and not is_alb_event(event)
+    )
+
+
+def is_payload_v2_event(event):
+    return event.get("version") == "2.0"
+
+
+def is_payload_v1_event(event):
+    """
+    Signature of API Gateway v1 events. Events not matching any other format
+    are treated as v1 events as well, see `EventDispatcher`.
+    """
+    return (
+        event.get("isBase64Encoded") is not None
+        and event.get("version") != "2.0"
+        and not is_alb_event(event)
+    )
+
+
+def is_rest_api_event(event):
+    """
+    Signature of API Gateway REST API events, which are v1 events without the
+    version of HTTP API payloads, and not from ALB
+    """
+    return (
+        event.get("version") not in ("1.0", "2.0")
+        and not is_alb_event(event)
+        and not is_lambda_integration_event(event)
+    )
+
+
+def is_alb_target_event(event):
+    return event.get("version") != "2.0" and bool(is_alb_event(event))
+
+
 def encode_query_string(event):
     params = event.get("multiValueQueryStringParameters")
     if not params:
@@ -97,16 +426,8 @@ def encode_query_string(event):
     return urlencode(params, doseq=True)
 
 
-def get_script_name(headers, request_context):
-    strip_stage_path = os.environ.get("STRIP_STAGE_PATH", "").lower().strip() in [
-        "yes",
-        "y",
-        "true",
-        "t",
-        "1",
-    ]
-
-    if "amazonaws.com" in headers.get("Host", "") and not strip_stage_path:
+def get_script_name(host, request_context, settings):
+    if "amazonaws.com" in host and not settings.strip_stage_path:
         script_name = "/{}".format(request_context.get("stage", ""))
     else:
         script_name = ""
@@ -121,43 +442,294 @@ def get_body_bytes(event, body):
     return body
 
 
-def setup_environ_items(environ, headers):
+class Base64Input(io.RawIOBase):
+    """
+    Stream that decodes a base64 encoded request body as it is read, instead of
+    decoding the whole body up front.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+        self.pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.pending:
+            if self.data is None:
+                return 0
+
+            # Decode whole quanta of four characters into at least `len(buffer)`
+            # bytes, bounded by the chunk size
+            size = min(max(len(buffer), 1), BODY_CHUNK_SIZE)
+            end = self.offset + (size + 2) // 3 * 4
+            self.pending = memoryview(base64.b64decode(self.data[self.offset:end]))
+            self.offset = end
+
+            # Release the encoded body once it has been decoded
+            if self.offset >= len(self.data):
+                self.data = None
+
+        count = min(len(buffer), len(self.pending))
+        buffer[:count] = self.pending[:count]
+        self.pending = self.pending[count:]
+        return count
+
+
+def normalize_base64(data):
+    """
+    Remove line breaks and other whitespace from a base64 encoded body, and add
+    missing padding, so that it can be decoded in whole quanta and its decoded
+    length is known from its length. Canonical bodies are returned as is, which
+    is checked with a single search for a line break, as wrapped base64 always
+    contains one.
+    """
+    if "\n" in data:
+        data = "".join(data.split())
+    elif len(data) % 4 == 0:
+        return data
+    return data + "=" * (-len(data) % 4)
+
+
+def get_base64_decoded_length(data):
+    padding = data.endswith("=") + data.endswith("==")
+    return len(data) // 4 * 3 - padding
+
+
+def get_body_input(event, body, settings):
+    """
+    Return the content length and `wsgi.input` stream of the request body.
+
+    With lazy request body handling, base64 encoded bodies are decoded as they are
+    read, and bodies larger than the spool threshold are decoded in chunks to a
+    temporary file, so that the decoded body is never held in memory.
+    """
+    if settings.spool_threshold is None or not event.get("isBase64Encoded", False):
+        body = get_body_bytes(event, body)
+        stream = io.BytesIO(body)
+        length = len(body)
+    else:
+        body = normalize_base64(body)
+        length = get_base64_decoded_length(body)
+        stream = io.BufferedReader(Base64Input(body), BODY_CHUNK_SIZE)
+        if length > settings.spool_threshold:
+            spool = tempfile.TemporaryFile()
+            shutil.copyfileobj(stream, spool, BODY_CHUNK_SIZE)
+            spool.seek(0)
+            stream = spool
+
+    # Drop the body from the event, so that the encoded body can be released as
+    # soon as it has been consumed
+    if settings.strip_event_body:
+        event.pop("body", None)
+
+    return length, stream
+
+
+# Memoized mapping of header names to environ keys, e.g. `Content-Type` to
+# `HTTP_CONTENT_TYPE`. The size is bounded, since header names are client input.
+CGI_HEADER_NAMES = {}
+CGI_HEADER_NAMES_MAX_SIZE = 1024
+
+
+def get_cgi_header_name(name):
+    key = CGI_HEADER_NAMES.get(name)
+    if key is None:
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if len(CGI_HEADER_NAMES) < CGI_HEADER_NAMES_MAX_SIZE:
+            CGI_HEADER_NAMES[name] = key
+    return key
+
+
+# Headers that CGI variables such as `SERVER_NAME` and `CONTENT_TYPE` are derived
+# from, which use the first value of multi-value headers
+SINGLETON_HEADER_KEYS = frozenset(
+    ("HTTP_HOST", "HTTP_CONTENT_TYPE", "HTTP_X_FORWARDED_PORT", "HTTP_X_FORWARDED_PROTO")
+)
+
+
+def get_header_environ(headers, first_values=None):
+    """
+    Map event headers to `HTTP_*` environ keys in a single pass. For multi-value
+    headers, the last value is used, while the first value of headers in
+    `SINGLETON_HEADER_KEYS` is stored in `first_values`, if given.
+    """
+    environ = {}
+    cgi_header_names = CGI_HEADER_NAMES
+
+    for name, value in headers.items():
+        key = cgi_header_names.get(name) or get_cgi_header_name(name)
+        if isinstance(value, list):
+            if not value:
+                continue
+            if (
+                first_values is not None
+                and len(value) > 1
+                and key in SINGLETON_HEADER_KEYS
+            ):
+                first_values[key] = value[0]
+            value = value[-1]
+        environ[key] = value
+
+    return environ
+
+
+def get_singleton(header_environ, first_values, key, default):
+    """Value of an environ key derived from a header, using its first value"""
+    if key in first_values:
+        return first_values[key]
+    return header_environ.get(key, default)
+
+
+def setup_environ_items(environ, header_environ):
+    """
+    Transcode UTF-8 environ values to latin-1 as required by PEP 3333 (which is
+    only necessary for non-ASCII values) and add the request headers.
+    """
     for key, value in environ.items():
-        if isinstance(value, str):
+        if isinstance(value, str) and not value.isascii():
             environ[key] = value.encode("utf-8").decode("latin1", "replace")
 
-    for key, value in headers.items():
-        key = "HTTP_" + key.upper().replace("-", "_")
-        if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
-            environ[key] = value
+    header_environ.pop("HTTP_CONTENT_TYPE", None)
+    header_environ.pop("HTTP_CONTENT_LENGTH", None)
+    environ.update(header_environ)
     return environ
 
 
-def generate_response(response, event):
+@functools.lru_cache(maxsize=64)
+def negotiate_encoding(accept_encoding, encodings):
+    """
+    Pick the encoding with the highest quality value in `Accept-Encoding` among
+    `encodings`, preferring the order of `encodings` on ties.
+    """
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_response(response, environ, settings):
+    """
+    Compress the response body when the client accepts one of the configured
+    encodings. Small bodies, binary MIME types and bodies that are already
+    encoded are left as is.
+    """
+    if (
+        not settings.compression
+        or len(response.body) < settings.compression_min_size
+        or not settings.is_text_mime_type(response.mimetype or "text/plain")
+        or get_header(response.headers, "Content-Encoding")
+        or "no-transform" in get_header(response.headers, "Cache-Control", "")
+    ):
+        return response
+
+    encoding = negotiate_encoding(
+        environ.get("HTTP_ACCEPT_ENCODING", ""), settings.compression
+    )
+    if encoding is None:
+        return response
+
+    body = COMPRESSORS[encoding](response.body)
+
+    # Repeated `Vary` headers are combined into one, to add `Accept-Encoding`
+    vary = []
+    headers = []
+    for key, value in response.headers:
+        if key.lower() == "vary":
+            vary.extend(item.strip() for item in value.split(",") if item.strip())
+        elif key.lower() != "content-length":
+            headers.append((key, value))
+    if "*" not in vary and "accept-encoding" not in (item.lower() for item in vary):
+        vary.append("Accept-Encoding")
+
+    headers.append(("Content-Encoding", encoding))
+    headers.append(("Content-Length", str(len(body))))
+    headers.append(("Vary", ", ".join(vary)))
+
+    return CapturedResponse(response.status, headers, body)
+
+
+def encode_base64(body):
+    """
+    Base64 encode the body in chunks into a buffer of the exact encoded size, as
+    encoding in one piece temporarily allocates twice the size of the input.
+    """
+    view = memoryview(body)
+    encoded = bytearray((len(view) + 2) // 3 * 4)
+    target = memoryview(encoded)
+    offset = 0
+    for start in range(0, len(view), BODY_CHUNK_SIZE):
+        chunk = binascii.b2a_base64(view[start:start + BODY_CHUNK_SIZE], newline=False)
+        target[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    target.release()
+    return encoded
+
+
+def generate_response(response, event, settings):
     returndict = {"statusCode": response.status_code}
 
-    if "multiValueHeaders" in event and event["multiValueHeaders"]:
+    if is_payload_v2_event(event):
+        returndict["headers"], cookies = join_headers(response.headers)
+        if cookies:
+            returndict["cookies"] = cookies
+    elif "multiValueHeaders" in event and event["multiValueHeaders"]:
         returndict["multiValueHeaders"] = group_headers(response.headers)
-    else:
+    elif is_alb_event(event) or is_lambda_integration_event(event):
         returndict["headers"] = split_headers(response.headers)
+    else:
+        # API Gateway merges `headers` and `multiValueHeaders` in responses
+        headers = group_headers(response.headers)
+        returndict["headers"] = {
+            key: values[0] for key, values in headers.items() if len(values) == 1
+        }
+        multi_value_headers = {
+            key: values for key, values in headers.items() if len(values) > 1
+        }
+        if multi_value_headers:
+            returndict["multiValueHeaders"] = multi_value_headers
 
     if is_alb_event(event):
         # If the request comes from ALB we need to add a status description
         returndict["statusDescription"] = "%d %s" % (
             response.status_code,
-            HTTP_STATUS_CODES[response.status_code],
+            HTTP_STATUS_CODES.get(
+                response.status_code, response.status.partition(" ")[2]
+            ),
         )
 
-    if response.data:
+    if response.body:
+        # The body is taken from the response, so that the raw body is only
+        # referenced here and can be released as soon as it has been encoded
+        body, response.body = response.body, None
         mimetype = response.mimetype or "text/plain"
-        if (
-                mimetype.startswith("text/") or mimetype in TEXT_MIME_TYPES
-        ) and not response.headers.get("Content-Encoding", ""):
-            returndict["body"] = response.get_data(as_text=True)
+        if settings.is_text_mime_type(mimetype) and not get_header(
+            response.headers, "Content-Encoding"
+        ):
+            returndict["body"] = body.decode("utf-8")
             returndict["isBase64Encoded"] = False
         else:
-            returndict["body"] = base64.b64encode(
-                response.data).decode("utf-8")
+            # Release the raw body before the encoded body is copied into the
+            # final string
+            encoded = encode_base64(body)
+            del body
+            returndict["body"] = encoded.decode("ascii")
             returndict["isBase64Encoded"] = True
 
     return returndict
@@ -173,144 +745,384 @@ def strip_express_gateway_query_params(path):
     return path
 
 
-def handle_request(app, event, context):
+def handle_request(app, event, context, settings=None):
     if event.get("source") in ["aws.events", "serverless-plugin-warmup"]:
         print("Lambda warming event received, skipping handler")
         return {}
 
-    if (
-            event.get("version") is None
-            and event.get("isBase64Encoded") is None
-            and event.get("requestPath") is not None
-            and not is_alb_event(event)
-    ):
-        return handle_lambda_integration(app, event, context)
+    settings = settings or get_default_settings()
+    translator = dispatcher.get_translator(event)
+    if settings.metrics_namespace is None:
+        return translator.handle(app, event, context, settings)
+
+    return handle_request_with_metrics(translator, app, event, context, settings)
+
+
+# Whether the next invocation is the first one in this container
+cold_start = True
+
+
+class GCMonitor:
+    """
+    Garbage collector callback accumulating the number and duration of
+    collections, reported in the invocation metrics while it is installed.
+    """
+
+    def __init__(self):
+        self.collections = 0
+        self.pause_ms = 0.0
+        self.started = None
+
+    def __call__(self, phase, info):
+        if phase == "start":
+            self.started = time.perf_counter()
+        elif self.started is not None:
+            self.pause_ms += (time.perf_counter() - self.started) * 1000
+            self.collections += 1
+            self.started = None
+
+    @property
+    def installed(self):
+        return self in gc.callbacks
+
+    def install(self):
+        if not self.installed:
+            gc.callbacks.append(self)
+
+    def pop(self):
+        """Return and reset the collections since the previous call"""
+        stats = {"GCCollections": self.collections, "GCTime": self.pause_ms}
+        self.collections = 0
+        self.pause_ms = 0.0
+        return stats
+
+
+gc_monitor = GCMonitor()
+
+
+def handle_request_with_metrics(translator, app, event, context, settings):
+    """
+    Handle the request like `EventTranslator.handle`, timing the translation of
+    the event, the application and the encoding of the response, and print the
+    timings as a CloudWatch Embedded Metric Format record.
+    """
+    global cold_start
+    metrics = {"ColdStart": int(cold_start)}
+    properties = {"EventType": translator.name}
+    cold_start = False
+
+    start = time.perf_counter()
+    try:
+        environ = translator.get_environ(event, context, settings)
+        translated = time.perf_counter()
+        metrics["TranslateTime"] = (translated - start) * 1000
+
+        response = call_app(app, environ)
+        responded = time.perf_counter()
+        metrics["AppTime"] = (responded - translated) * 1000
+        metrics["ResponseSize"] = len(response.body)
+        properties["StatusCode"] = response.status_code
+
+        returndict = translator.respond(response, environ, event, settings)
+        metrics["EncodeTime"] = (time.perf_counter() - responded) * 1000
+        return returndict
+    finally:
+        metrics["TotalTime"] = (time.perf_counter() - start) * 1000
+        # Collections run between invocations are included in the next record
+        if gc_monitor.installed:
+            metrics.update(gc_monitor.pop())
+        print(format_metrics(metrics, properties, settings))
+
+
+# Units of the invocation metrics
+METRIC_UNITS = {
+    "ColdStart": "Count",
+    "TranslateTime": "Milliseconds",
+    "AppTime": "Milliseconds",
+    "EncodeTime": "Milliseconds",
+    "TotalTime": "Milliseconds",
+    "ResponseSize": "Bytes",
+    "GCCollections": "Count",
+    "GCTime": "Milliseconds",
+}
+
+
+def format_metrics(metrics, properties, settings):
+    """Format metrics as a single line CloudWatch Embedded Metric Format record"""
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": settings.metrics_namespace,
+                    "Dimensions": [["FunctionName"]],
+                    "Metrics": [
+                        {"Name": name, "Unit": METRIC_UNITS[name]} for name in metrics
+                    ],
+                }
+            ],
+        },
+        "FunctionName": settings.function_name,
+    }
+    record.update(properties)
+    for name, value in metrics.items():
+        record[name] = round(value, 3) if isinstance(value, float) else value
+    return json.dumps(record, separators=(",", ":"))
+
+
+def get_synthetic_event(request):
+    """
+    Build a payload format 2.0 event for a request given as a dict of `method`,
+    `path` (optionally with a query string), `headers` and `body`, for invoking
+    the application outside of Lambda, e.g. when priming or tracing it.
+    """
+    path, _, query_string = request.get("path", "/").partition("?")
+    headers = {"host": "localhost"}
+    headers.update(
+        (key.lower(), value) for key, value in (request.get("headers") or {}).items()
+    )
+    return {
+        "version": "2.0",
+        "rawPath": path,
+        "rawQueryString": query_string,
+        "headers": headers,
+        "requestContext": {
+            "http": {
+                "method": request.get("method", "GET").upper(),
+                "sourceIp": "127.0.0.1",
+            }
+        },
+        "body": request.get("body") or "",
+        "isBase64Encoded": False,
+    }
+
+
+# Functions run before a SnapStart snapshot is taken and after the execution
+# environment is restored from it, registered with `before_checkpoint` and
+# `after_restore`
+checkpoint_hooks = {"before_checkpoint": [], "after_restore": []}
+
+
+def before_checkpoint(func):
+    """
+    Register `func` to run before a SnapStart snapshot of the initialized
+    application is taken, e.g. to close connections. Usable as a decorator.
+    """
+    checkpoint_hooks["before_checkpoint"].append(func)
+    return func
+
+
+def after_restore(func):
+    """
+    Register `func` to run when an execution environment is restored from a
+    SnapStart snapshot, e.g. to reopen connections or reset state that must be
+    unique per environment. Usable as a decorator.
+    """
+    checkpoint_hooks["after_restore"].append(func)
+    return func
+
+
+def run_checkpoint_hooks(phase):
+    """
+    Run the hooks of a phase in order of registration. A failing hook is logged
+    without preventing the others from running, or the snapshot or restore from
+    completing.
+    """
+    start = time.perf_counter()
+    for func in checkpoint_hooks[phase]:
+        try:
+            func()
+        except Exception:
+            print(
+                "Error in {} hook {}".format(
+                    phase, getattr(func, "__name__", repr(func))
+                )
+            )
+            traceback.print_exc()
+    print(
+        "Ran {} {} hooks in {:.1f} ms".format(
+            len(checkpoint_hooks[phase]),
+            phase,
+            (time.perf_counter() - start) * 1000,
+        )
+    )
+
+
+@after_restore
+def reseed_random():
+    """Restored environments would otherwise share the state of `random`"""
+    random.seed()
+
 
-    if event.get("version") == "2.0":
-        return handle_payload_v2(app, event, context)
+@after_restore
+def reset_cold_start():
+    """The first invocation after a restore is reported as a cold start"""
+    global cold_start
+    cold_start = True
 
-    return handle_payload_v1(app, event, context)
+
+@before_checkpoint
+@after_restore
+def close_django_connections():
+    """
+    Close database connections of Django, if loaded, so none are captured in the
+    snapshot and each restored environment opens its own on first use.
+    """
+    if "django.db" in sys.modules:
+        sys.modules["django.db"].connections.close_all()
+
+
+def get_environ(event, context, settings=None):
+    """Build the WSGI environ for any of the supported event formats"""
+    return dispatcher.get_translator(event).get_environ(
+        event, context, settings or get_default_settings()
+    )
+
+
+def handle_payload_v1(app, event, context, settings):
+    environ = get_environ_v1(event, context, settings)
+
+    return respond_payload(call_app(app, environ), environ, event, settings)
 
 
-def handle_payload_v1(app, event, context):
+def respond_payload(response, environ, event, settings):
+    """Compress and encode the response for API Gateway, ALB and Function URLs"""
+    # REST APIs only decode base64 encoded bodies of binary media types, so
+    # their responses are only compressed if configured for all media types
+    if settings.compression_rest_api or not is_rest_api_event(event):
+        response = compress_response(response, environ, settings)
+    return generate_response(response, event, settings)
+
+
+def get_environ_v1(event, context, settings):
+    first_values = {}
     if "multiValueHeaders" in event and event["multiValueHeaders"]:
-        headers = Headers(event["multiValueHeaders"])
+        headers = get_header_environ(event["multiValueHeaders"], first_values)
     else:
-        headers = Headers(event["headers"])
+        headers = get_header_environ(event.get("headers") or {})
 
-    script_name = get_script_name(headers, event.get("requestContext", {}))
+    request_context = event.get("requestContext", {})
+    host = get_singleton(headers, first_values, "HTTP_HOST", "")
+    script_name = get_script_name(host, request_context, settings)
 
     # If a user is using a custom domain on API Gateway, they may have a base
     # path in their URL. This allows us to strip it out via an optional
     # environment variable.
     path_info = strip_express_gateway_query_params(event["path"])
-    base_path = os.environ.get("API_GATEWAY_BASE_PATH")
-    if base_path:
-        script_name = "/" + base_path
+    if settings.base_path:
+        script_name = settings.base_path
 
         if path_info.startswith(script_name):
             path_info = path_info[len(script_name):]
 
     body = event.get("body") or ""
-    body = get_body_bytes(event, body)
+    content_length, body = get_body_input(event, body, settings)
 
     environ = {
-        "CONTENT_LENGTH": str(len(body)),
-        "CONTENT_TYPE": headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(content_length),
+        "CONTENT_TYPE": get_singleton(headers, first_values, "HTTP_CONTENT_TYPE", ""),
         "PATH_INFO": unquote(path_info),
         "QUERY_STRING": encode_query_string(event),
-        "REMOTE_ADDR": event.get("requestContext", {})
-        .get("identity", {})
-        .get("sourceIp", ""),
-        "REMOTE_USER": (event.get("requestContext", {})
-                        .get("authorizer") or {})
-        .get("principalId", ""),
+        "REMOTE_ADDR": request_context.get("identity", {}).get("sourceIp", ""),
+        "REMOTE_USER": (request_context.get("authorizer") or {}).get(
+            "principalId", ""
+        ),
         "REQUEST_METHOD": event.get("httpMethod", {}),
         "SCRIPT_NAME": script_name,
-        "SERVER_NAME": headers.get("Host", "lambda"),
-        "SERVER_PORT": headers.get("X-Forwarded-Port", "443"),
+        "SERVER_NAME": get_singleton(headers, first_values, "HTTP_HOST", "lambda"),
+        "SERVER_PORT": get_singleton(headers, first_values, "HTTP_X_FORWARDED_PORT", "443"),
         "SERVER_PROTOCOL": "HTTP/1.1",
         "wsgi.errors": sys.stderr,
-        "wsgi.input": io.BytesIO(body),
+        "wsgi.input": body,
         "wsgi.multiprocess": False,
         "wsgi.multithread": False,
         "wsgi.run_once": False,
-        "wsgi.url_scheme": headers.get("X-Forwarded-Proto", "https"),
+        "wsgi.url_scheme": get_singleton(headers, first_values, "HTTP_X_FORWARDED_PROTO", "https"),
         "wsgi.version": (1, 0),
-        "serverless.authorizer": event.get("requestContext", {}).get("authorizer"),
+        "serverless.authorizer": request_context.get("authorizer"),
         "serverless.event": event,
         "serverless.context": context,
     }
+    if settings.init_stats is not None:
+        environ["serverless.init_stats"] = settings.init_stats
 
-    environ = setup_environ_items(environ, headers)
+    return setup_environ_items(environ, headers)
 
-    response = Response.from_app(app, environ)
-    returndict = generate_response(response, event)
 
-    return returndict
+def handle_payload_v2(app, event, context, settings):
+    environ = get_environ_v2(event, context, settings)
+
+    return respond_payload(call_app(app, environ), environ, event, settings)
 
 
-def handle_payload_v2(app, event, context):
-    headers = Headers(event["headers"])
+def get_environ_v2(event, context, settings):
+    headers = get_header_environ(event.get("headers") or {})
 
-    script_name = get_script_name(headers, event.get("requestContext", {}))
+    request_context = event.get("requestContext", {})
+    http_context = request_context.get("http", {})
+    script_name = get_script_name(headers.get("HTTP_HOST", ""), request_context, settings)
 
     path_info = strip_express_gateway_query_params(event["rawPath"])
-    base_path = os.environ.get("API_GATEWAY_BASE_PATH")
-    if base_path:
-        script_name = "/" + base_path
+    if settings.base_path:
+        script_name = settings.base_path
 
         if path_info.startswith(script_name):
             path_info = path_info[len(script_name):]
 
-    body = event.get("body", "")
-    body = get_body_bytes(event, body)
+    body = event.get("body") or ""
+    content_length, body = get_body_input(event, body, settings)
 
-    headers["Cookie"] = "; ".join(event.get("cookies", []))
+    headers["HTTP_COOKIE"] = "; ".join(event.get("cookies", []))
 
     environ = {
-        "CONTENT_LENGTH": str(len(body or "")),
-        "CONTENT_TYPE": headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(content_length),
+        "CONTENT_TYPE": headers.get("HTTP_CONTENT_TYPE", ""),
         "PATH_INFO": unquote(path_info),
         "QUERY_STRING": event.get("rawQueryString", ""),
-        "REMOTE_ADDR": event.get("requestContext", {})
-        .get("http", {})
-        .get("sourceIp", ""),
-        "REMOTE_USER": event.get("requestContext", {})
-        .get("authorizer", {})
-        .get("principalId", ""),
-        "REQUEST_METHOD": event.get("requestContext", {})
-        .get("http", {})
-        .get("method", ""),
+        "REMOTE_ADDR": http_context.get("sourceIp", ""),
+        "REMOTE_USER": request_context.get("authorizer", {}).get("principalId", ""),
+        "REQUEST_METHOD": http_context.get("method", ""),
         "SCRIPT_NAME": script_name,
-        "SERVER_NAME": headers.get("Host", "lambda"),
-        "SERVER_PORT": headers.get("X-Forwarded-Port", "443"),
+        "SERVER_NAME": headers.get("HTTP_HOST", "lambda"),
+        "SERVER_PORT": headers.get("HTTP_X_FORWARDED_PORT", "443"),
         "SERVER_PROTOCOL": "HTTP/1.1",
         "wsgi.errors": sys.stderr,
-        "wsgi.input": io.BytesIO(body),
+        "wsgi.input": body,
         "wsgi.multiprocess": False,
         "wsgi.multithread": False,
         "wsgi.run_once": False,
-        "wsgi.url_scheme": headers.get("X-Forwarded-Proto", "https"),
+        "wsgi.url_scheme": headers.get("HTTP_X_FORWARDED_PROTO", "https"),
         "wsgi.version": (1, 0),
-        "serverless.authorizer": event.get("requestContext", {}).get("authorizer"),
+        "serverless.authorizer": request_context.get("authorizer"),
         "serverless.event": event,
         "serverless.context": context,
     }
+    if settings.init_stats is not None:
+        environ["serverless.init_stats"] = settings.init_stats
+
+    return setup_environ_items(environ, headers)
+
 
-    environ = setup_environ_items(environ, headers)
+def handle_lambda_integration(app, event, context, settings):
+    environ = get_environ_lambda_integration(event, context, settings)
 
-    response = Response.from_app(app, environ)
+    return respond_lambda_integration(call_app(app, environ), environ, event, settings)
 
-    returndict = generate_response(response, event)
+
+def respond_lambda_integration(response, environ, event, settings):
+    """Encode the response, raising errors for API Gateway to map status codes"""
+    returndict = generate_response(response, event, settings)
+
+    if response.status_code >= 300:
+        raise RuntimeError(json.dumps(returndict))
 
     return returndict
 
 
-def handle_lambda_integration(app, event, context):
-    headers = Headers(event["headers"])
+def get_environ_lambda_integration(event, context, settings):
+    headers = get_header_environ(event.get("headers") or {})
 
-    script_name = get_script_name(headers, event)
+    script_name = get_script_name(headers.get("HTTP_HOST", ""), event, settings)
 
     path_info = strip_express_gateway_query_params(event["requestPath"])
 
@@ -320,39 +1132,312 @@ def handle_lambda_integration(app, event, context):
 
     body = event.get("body", {})
     body = json.dumps(body) if body else ""
-    body = get_body_bytes(event, body)
+    content_length, body = get_body_input(event, body, settings)
 
     environ = {
-        "CONTENT_LENGTH": str(len(body or "")),
-        "CONTENT_TYPE": headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(content_length),
+        "CONTENT_TYPE": headers.get("HTTP_CONTENT_TYPE", ""),
         "PATH_INFO": unquote(path_info),
         "QUERY_STRING": urlencode(event.get("query", {}), doseq=True),
         "REMOTE_ADDR": event.get("identity", {}).get("sourceIp", ""),
         "REMOTE_USER": event.get("principalId", ""),
         "REQUEST_METHOD": event.get("method", ""),
         "SCRIPT_NAME": script_name,
-        "SERVER_NAME": headers.get("Host", "lambda"),
-        "SERVER_PORT": headers.get("X-Forwarded-Port", "443"),
+        "SERVER_NAME": headers.get("HTTP_HOST", "lambda"),
+        "SERVER_PORT": headers.get("HTTP_X_FORWARDED_PORT", "443"),
         "SERVER_PROTOCOL": "HTTP/1.1",
         "wsgi.errors": sys.stderr,
-        "wsgi.input": io.BytesIO(body),
+        "wsgi.input": body,
         "wsgi.multiprocess": False,
         "wsgi.multithread": False,
         "wsgi.run_once": False,
-        "wsgi.url_scheme": headers.get("X-Forwarded-Proto", "https"),
+        "wsgi.url_scheme": headers.get("HTTP_X_FORWARDED_PROTO", "https"),
         "wsgi.version": (1, 0),
         "serverless.authorizer": event.get("enhancedAuthContext"),
         "serverless.event": event,
         "serverless.context": context,
     }
+    if settings.init_stats is not None:
+        environ["serverless.init_stats"] = settings.init_stats
 
-    environ = setup_environ_items(environ, headers)
+    return setup_environ_items(environ, headers)
 
-    response = Response.from_app(app, environ)
 
-    returndict = generate_response(response, event)
+class EventTranslator:
+    """Translates one event format to a WSGI environ and back"""
 
-    if response.status_code >= 300:
-        raise RuntimeError(json.dumps(returndict))
+    __slots__ = ("name", "matches", "get_environ", "handle", "respond")
 
-    return returndict
+    def __init__(self, name, matches, get_environ, handle, respond):
+        self.name = name
+        self.matches = matches
+        self.get_environ = get_environ
+        self.handle = handle
+        self.respond = respond
+
+
+class EventDispatcher:
+    """
+    Classifies events by format. A function is almost always wired to a single
+    trigger type, so the translator of the previous event is cached and later
+    events only need to pass its signature check. On mismatch, the full detection
+    runs again, trying each translator in order and falling back to `default`.
+    """
+
+    def __init__(self, translators, default):
+        self.translators = translators
+        self.default = default
+        self.cached = None
+
+    def get_translator(self, event):
+        cached = self.cached
+        if cached is not None and cached.matches(event):
+            return cached
+
+        for translator in self.translators:
+            if translator.matches(event):
+                break
+        else:
+            translator = self.default
+
+        self.cached = translator
+        return translator
+
+
+PAYLOAD_V1 = EventTranslator(
+    "v1", is_payload_v1_event, get_environ_v1, handle_payload_v1, respond_payload
+)
+
+dispatcher = EventDispatcher(
+    (
+        EventTranslator(
+            "lambda-integration",
+            is_lambda_integration_event,
+            get_environ_lambda_integration,
+            handle_lambda_integration,
+            respond_lambda_integration,
+        ),
+        EventTranslator(
+            "v2", is_payload_v2_event, get_environ_v2, handle_payload_v2, respond_payload
+        ),
+        EventTranslator(
+            "alb", is_alb_target_event, get_environ_v1, handle_payload_v1, respond_payload
+        ),
+        PAYLOAD_V1,
+    ),
+    PAYLOAD_V1,
+)
+
+# Content type and prelude delimiter of the Lambda HTTP integration response
+# streaming protocol, used by Function URLs and API Gateway response streaming.
+STREAMING_CONTENT_TYPE = "application/vnd.awslambda.http-integration-response"
+STREAMING_PRELUDE_DELIMITER = b"\x00" * 8
+
+
+class ResponseStream:
+    """
+    Local stand-in for the Lambda Runtime API response stream. Chunks are
+    written to `fileobj` (an in-memory buffer by default), which makes it possible
+    to run streaming responses offline, e.g. in tests.
+    """
+
+    def __init__(self, fileobj=None):
+        self.fileobj = fileobj if fileobj is not None else io.BytesIO()
+        self.content_type = None
+        self.started = False
+        self.closed = False
+
+    def set_content_type(self, content_type):
+        self.content_type = content_type
+
+    def write(self, data):
+        self.started = True
+        self.fileobj.write(data)
+
+    def close(self):
+        self.closed = True
+
+    def getvalue(self):
+        return self.fileobj.getvalue()
+
+
+class RuntimeAPIResponseStream(ResponseStream):
+    """
+    Response stream that forwards chunks to the Lambda Runtime API using
+    chunked transfer encoding, as the response is produced.
+    See: https://docs.aws.amazon.com/lambda/latest/dg/runtimes-custom.html#runtimes-custom-response-streaming
+    """
+
+    def __init__(self, request_id, runtime_api=None):
+        super().__init__()
+        self.request_id = request_id
+        self.connection = http.client.HTTPConnection(
+            runtime_api or os.environ["AWS_LAMBDA_RUNTIME_API"]
+        )
+
+    def start(self):
+        self.started = True
+        self.connection.putrequest(
+            "POST",
+            "/2018-06-01/runtime/invocation/{}/response".format(self.request_id),
+        )
+        self.connection.putheader("Lambda-Runtime-Function-Response-Mode", "streaming")
+        self.connection.putheader("Transfer-Encoding", "chunked")
+        self.connection.putheader(
+            "Content-Type", self.content_type or "application/octet-stream"
+        )
+        self.connection.endheaders()
+
+    def write(self, data):
+        if not self.started:
+            self.start()
+        if data:
+            self.connection.send(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def close(self):
+        if self.closed:
+            return
+        if not self.started:
+            self.start()
+        self.connection.send(b"0\r\n\r\n")
+        self.connection.getresponse().read()
+        self.connection.close()
+        self.closed = True
+
+
+def generate_streaming_prelude(status, headers):
+    """
+    Encode the status and headers as the JSON prelude expected by the
+    response streaming protocol.
+    """
+    prelude_headers, cookies = join_headers(headers)
+    prelude = {"statusCode": int(status.split(" ", 1)[0]), "headers": prelude_headers}
+    if cookies:
+        prelude["cookies"] = cookies
+
+    return json.dumps(prelude).encode("utf-8") + STREAMING_PRELUDE_DELIMITER
+
+
+def handle_request_streaming(app, event, context, response_stream, settings=None):
+    """
+    Invoke the WSGI application and forward each chunk of the response body to
+    `response_stream` as soon as it is produced, instead of buffering it.
+    """
+    if event.get("source") in ["aws.events", "serverless-plugin-warmup"]:
+        print("Lambda warming event received, skipping handler")
+        response_stream.close()
+        return
+
+    environ = get_environ(event, context, settings)
+    response = {}
+
+    def write(data):
+        if "status" not in response:
+            raise AssertionError("write() before start_response()")
+        if not response_stream.started:
+            response_stream.set_content_type(STREAMING_CONTENT_TYPE)
+            response_stream.write(
+                generate_streaming_prelude(response["status"], response["headers"])
+            )
+        if data:
+            response_stream.write(data)
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info is not None:
+            try:
+                if response_stream.started:
+                    raise exc_info[1].with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+        response["status"] = status
+        response["headers"] = headers
+        return write
+
+    app_iter = app(environ, start_response)
+    try:
+        for data in app_iter:
+            write(data)
+        write(b"")
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+
+    response_stream.close()
+
+
+class RuntimeContext:
+    """Invocation context passed to the handler by `serve_runtime_api`"""
+
+    def __init__(self, headers):
+        self.aws_request_id = headers.get("Lambda-Runtime-Aws-Request-Id")
+        self.invoked_function_arn = headers.get("Lambda-Runtime-Invoked-Function-Arn")
+        self.deadline_ms = int(headers.get("Lambda-Runtime-Deadline-Ms") or 0)
+        self.function_name = os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+        self.function_version = os.environ.get("AWS_LAMBDA_FUNCTION_VERSION")
+        self.memory_limit_in_mb = os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+        self.log_group_name = os.environ.get("AWS_LAMBDA_LOG_GROUP_NAME")
+        self.log_stream_name = os.environ.get("AWS_LAMBDA_LOG_STREAM_NAME")
+
+    def get_remaining_time_in_millis(self):
+        return max(self.deadline_ms - int(time.time() * 1000), 0)
+
+
+def serve_runtime_api(
+    handler, runtime_api=None, max_invocations=None, after_invocation=None
+):
+    """
+    Minimal Lambda Runtime API loop that passes a `RuntimeAPIResponseStream` to
+    `handler(event, context, response_stream)`. Handlers that don't write to
+    the stream have their return value sent as a regular buffered response.
+    `after_invocation` is called once the response is sent, before waiting for
+    the next invocation.
+    """
+    runtime_api = runtime_api or os.environ["AWS_LAMBDA_RUNTIME_API"]
+    invocations = 0
+
+    while max_invocations is None or invocations < max_invocations:
+        invocations += 1
+
+        connection = http.client.HTTPConnection(runtime_api)
+        connection.request("GET", "/2018-06-01/runtime/invocation/next")
+        invocation = connection.getresponse()
+        event = json.loads(invocation.read())
+        context = RuntimeContext(invocation.headers)
+
+        trace_id = invocation.getheader("Lambda-Runtime-Trace-Id")
+        if trace_id:
+            os.environ["_X_AMZN_TRACE_ID"] = trace_id
+
+        path = "/2018-06-01/runtime/invocation/{}/".format(context.aws_request_id)
+        response_stream = RuntimeAPIResponseStream(context.aws_request_id, runtime_api)
+
+        try:
+            result = handler(event, context, response_stream)
+        except Exception as err:
+            traceback.print_exc()
+            if response_stream.started:
+                response_stream.close()
+            else:
+                connection.request(
+                    "POST",
+                    path + "error",
+                    json.dumps(
+                        {
+                            "errorMessage": str(err),
+                            "errorType": type(err).__name__,
+                            "stackTrace": traceback.format_exc().splitlines(),
+                        }
+                    ),
+                    {"Lambda-Runtime-Function-Error-Type": "Unhandled"},
+                )
+                connection.getresponse().read()
+        else:
+            if response_stream.started:
+                response_stream.close()
+            else:
+                connection.request("POST", path + "response", json.dumps(result))
+                connection.getresponse().read()
+
+        connection.close()
+        if after_invocation is not None:
+            after_invocation()
@@ -6,7 +6,7 @@ with open("README.md", "r") as fh:
 setuptools.setup(
     name="serverless-wsgi",
     version="3.1.0",
-    python_requires=">3.6",
+    python_requires=">=3.7",
     author="Logan Raarup",
     author_email="logan@logan.dk",
     description="Amazon AWS API Gateway WSGI wrapper",
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module slims installed requirements by removing files that are not needed
+at runtime, such as test suites, documentation and type stubs, and optionally
+stripping debug symbols from native extensions.
+
+Author: Logan Raarup <logan@logan.dk>
+"""
+import argparse
+import fnmatch
+import os
+import shutil
+import subprocess
+
+from prune import NATIVE_PATTERNS, format_size, list_files, remove_empty_dirs
+
+# Patterns containing a slash match paths relative to the requirements
+# directory, other patterns ending with a slash match directories at any depth,
+# and the rest match file names
+DEFAULT_PATTERNS = [
+    "tests/",
+    "test/",
+    "docs/",
+    "doc/",
+    "examples/",
+    "*.pyi",
+    "py.typed",
+    "*.pyx",
+    "*.pxd",
+    "*.c",
+    "*.cpp",
+    "*.h",
+    "*.md",
+    "*.rst",
+]
+
+
+def matches_pattern(path, pattern):
+    if "/" in pattern.rstrip("/"):
+        return fnmatch.fnmatch(path, pattern) or path.startswith(
+            pattern.rstrip("/") + "/"
+        )
+    elif pattern.endswith("/"):
+        return any(
+            fnmatch.fnmatch(part, pattern[:-1]) for part in path.split("/")[:-1]
+        )
+    else:
+        return fnmatch.fnmatch(path.rsplit("/", 1)[-1], pattern)
+
+
+def get_removed_files(files, patterns, keep=()):
+    """Select the files to remove, relative to the requirements directory"""
+    return sorted(
+        path
+        for path in files
+        if any(matches_pattern(path, pattern) for pattern in patterns)
+        and not any(matches_pattern(path, pattern) for pattern in keep)
+    )
+
+
+def strip_file(path, strip_exe):
+    """
+    Strip debug symbols into a new file that replaces the original, as installed
+    files may be hardlinked from the requirements cache. Returns whether the file
+    could be stripped, which fails for architectures `strip` doesn't support.
+    """
+    tmp_path = path + ".strip"
+    p = subprocess.Popen(
+        [strip_exe, "--strip-debug", "-o", tmp_path, path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    p.communicate()
+    if p.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+    return True
+
+
+def format_report(before, after, top=10):
+    """Summarize sizes before and after slimming, by top-level package"""
+    lines = [
+        "Slimmed requirements from {} to {}".format(
+            format_size(sum(before.values())), format_size(sum(after.values()))
+        )
+    ]
+
+    packages = {}
+    for files, index in ((before, 0), (after, 1)):
+        for path, size in files.items():
+            package = path.split("/", 1)[0]
+            packages.setdefault(package, [0, 0])[index] += size
+
+    changed = [(p, sizes) for p, sizes in packages.items() if sizes[0] != sizes[1]]
+    changed.sort(key=lambda item: item[1][1] - item[1][0])
+    for package, (size_before, size_after) in changed[:top]:
+        lines.append(
+            "{:>12} -> {:>10}  {}".format(
+                format_size(size_before), format_size(size_after), package
+            )
+        )
+
+    return "\n".join(lines)
+
+
+def slim(requirements_dir, patterns=None, keep=(), strip=None):
+    """
+    Remove files matching `patterns` from the requirements directory, unless they
+    match `keep`, and strip native extensions with the `strip` executable if set.
+    """
+    if patterns is None:
+        patterns = DEFAULT_PATTERNS
+
+    before = list_files(requirements_dir)
+
+    for path in get_removed_files(before, patterns, keep):
+        os.remove(os.path.join(requirements_dir, path))
+    remove_empty_dirs(requirements_dir)
+
+    if strip:
+        if shutil.which(strip) is None:
+            print("Warning: Unable to find {}, not stripping".format(strip))
+        else:
+            failed = [
+                path
+                for path in list_files(requirements_dir)
+                if any(fnmatch.fnmatch(path, pattern) for pattern in NATIVE_PATTERNS)
+                and not strip_file(os.path.join(requirements_dir, path), strip)
+            ]
+            if failed:
+                print(
+                    "Warning: Unable to strip {} native extensions, such as {}".format(
+                        len(failed), failed[0]
+                    )
+                )
+
+    print(format_report(before, list_files(requirements_dir)))
+
+
+def parse_args():  # pragma: no cover
+    parser = argparse.ArgumentParser(description="serverless-wsgi requirements slimmer")
+    parser.add_argument("requirements_dir", help="Directory of installed requirements")
+    parser.add_argument(
+        "--pattern",
+        action="append",
+        default=[],
+        help="Pattern of files to remove, in addition to the defaults",
+    )
+    parser.add_argument(
+        "--no-defaults", action="store_true", help="Don't use the default patterns"
+    )
+    parser.add_argument(
+        "--keep",
+        action="append",
+        default=[],
+        help="Pattern of files to keep, even if matching a pattern to remove",
+    )
+    parser.add_argument(
+        "--strip", help="Executable used to strip debug symbols of native extensions"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    args = parse_args()
+    slim(
+        args.requirements_dir,
+        args.pattern + ([] if args.no_defaults else DEFAULT_PATTERNS),
+        args.keep,
+        args.strip,
+    )
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import slim
+import stat
+import subprocess
+
+
+def test_matches_pattern():
+    assert slim.matches_pattern("pkg/tests/test_a.py", "tests/")
+    assert slim.matches_pattern("pkg/sub/tests/data/a.json", "tests/")
+    assert not slim.matches_pattern("pkg/tests.py", "tests/")
+    assert slim.matches_pattern("pkg/__init__.pyi", "*.pyi")
+    assert slim.matches_pattern("botocore/data/s3/examples-1.json", "botocore/data/*/examples-1.json")
+    assert slim.matches_pattern("babel/locale-data/da.dat", "babel/locale-data/")
+    assert not slim.matches_pattern("pkg/readme.txt", "*.md")
+
+
+def test_get_removed_files():
+    files = {
+        "pkg/__init__.py": 10,
+        "pkg/__init__.pyi": 10,
+        "pkg/tests/test_pkg.py": 10,
+        "pkg/testing/__init__.py": 10,
+        "other/tests/conftest.py": 10,
+        "other/README.md": 10,
+    }
+
+    removed = slim.get_removed_files(files, slim.DEFAULT_PATTERNS, ["other/tests/"])
+
+    assert removed == ["other/README.md", "pkg/__init__.pyi", "pkg/tests/test_pkg.py"]
+
+
+def test_format_report():
+    before = {"pkg/a.py": 1024, "pkg/tests/b.py": 1024, "big/c.so": 4096, "keep.py": 10}
+    after = {"pkg/a.py": 1024, "big/c.so": 1024, "keep.py": 10}
+
+    assert slim.format_report(before, after).splitlines() == [
+        "Slimmed requirements from 6.0 KB to 2.0 KB",
+        "      4.0 KB ->     1.0 KB  big",
+        "      2.0 KB ->     1.0 KB  pkg",
+    ]
+
+
+def test_slim(tmp_path, capsys):
+    for path in ("pkg/__init__.py", "pkg/tests/test_pkg.py", "pkg/docs/index.rst"):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("content")
+
+    slim.slim(str(tmp_path), slim.DEFAULT_PATTERNS + ["*.cfg"], strip="missing-strip")
+
+    assert (tmp_path / "pkg" / "__init__.py").exists()
+    assert not (tmp_path / "pkg" / "tests").exists()
+    assert not (tmp_path / "pkg" / "docs").exists()
+
+    out = capsys.readouterr().out
+    assert "Unable to find missing-strip" in out
+    assert "Slimmed requirements from 21.0 B to 7.0 B" in out
+
+
+def test_strip_file(tmp_path, monkeypatch):
+    library = tmp_path / "_speedups.so"
+    library.write_bytes(b"unstripped")
+    library.chmod(0o755)
+    linked = tmp_path / "cached.so"
+    os.link(str(library), str(linked))
+
+    class StripStub:
+        def __init__(self, args, **kwargs):
+            self.args = args
+            self.returncode = 0
+
+        def communicate(self):
+            with open(self.args[3], "wb") as f:
+                f.write(b"stripped")
+
+    monkeypatch.setattr(subprocess, "Popen", StripStub)
+
+    assert slim.strip_file(str(library), "strip")
+    assert library.read_bytes() == b"stripped"
+    assert stat.S_IMODE(os.stat(str(library)).st_mode) == 0o755
+
+    # Hardlinks, such as those in the requirements cache, are left untouched
+    assert linked.read_bytes() == b"unstripped"
+
+
+def test_strip_file_unsupported(tmp_path):
+    if shutil.which("strip") is None:  # pragma: no cover
+        return
+
+    library = tmp_path / "_speedups.so"
+    library.write_bytes(b"not an elf file")
+
+    assert not slim.strip_file(str(library), "strip")
+    assert library.read_bytes() == b"not an elf file"
+    assert os.listdir(str(tmp_path)) == ["_speedups.so"]
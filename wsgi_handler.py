@@ -6,23 +6,153 @@ the request when the handler is called by AWS Lambda.
 
 Author: Logan Raarup <logan@logan.dk>
 """
+import gc
 import importlib
+import importlib.util
 import io
 import json
 import logging
 import os
 import sys
+import tempfile
+import time
 import traceback
-from werkzeug.exceptions import InternalServerError
+import zipimport
+
+# Uncompressed archive of requirements, created when the `zipRequirements` option
+# is enabled, and the entry of it listing packages that are extracted on import
+REQUIREMENTS_ARCHIVE = ".requirements.zip"
+REQUIREMENTS_INDEX = ".serverless-wsgi-extract.json"
+
+# Archive of requirements that were not used while tracing the application during
+# packaging. Modules that are missing from the package are imported from it.
+PRUNED_ARCHIVE = ".pruned-requirements.zip"
+
+# Factor by which the first threshold of the garbage collector is raised during
+# invocations, when collections are run between them instead
+GC_SAFETY_FACTOR = 10
+
+
+class PrunedArchiveFinder:
+    """
+    Meta path finder of last resort, importing modules from the archive of pruned
+    requirements. Modules that are loaded from it should be added to the allowlist
+    of the `prune` option, as importing from the archive is slower.
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.importers = {}
+
+    def find_spec(self, fullname, path=None, target=None):
+        # Each package directory needs an importer for its submodules
+        prefix = fullname.rpartition(".")[0].replace(".", "/")
+        importer = self.importers.get(prefix)
+        if importer is None:
+            try:
+                importer = zipimport.zipimporter(os.path.join(self.archive, prefix))
+            except zipimport.ZipImportError:
+                return None
+            self.importers[prefix] = importer
+
+        if hasattr(importer, "find_spec"):
+            spec = importer.find_spec(fullname)
+        else:  # pragma: no cover
+            loader = importer.find_module(fullname)
+            spec = loader and importlib.util.spec_from_loader(fullname, loader)
+
+        if spec is not None:
+            logging.warning("Importing pruned module: {}".format(fullname))
+        return spec
+
+
+class RequirementsArchiveFinder:
+    """
+    Meta path finder extracting packages with native extensions or data files
+    from the requirements archive when they are first imported, which can't be
+    imported by `zipimport`. The extraction directory is added to `sys.path` ahead
+    of the archive, so the regular path finder then imports the package from it.
+    """
+
+    def __init__(self, archive, index):
+        self.archive = archive
+        self.packages = set(index["extract"])
+        self.libs = index["libs"]
+        stat = os.stat(archive)
+        self.target = os.path.join(
+            tempfile.gettempdir(),
+            "serverless-wsgi",
+            "{}-{}".format(stat.st_size, int(stat.st_mtime)),
+        )
+
+    def find_spec(self, fullname, path=None, target=None):
+        name = fullname.partition(".")[0]
+        if name in self.packages:
+            self.packages.discard(name)
+            self.extract(name)
+        return None
+
+    def extract(self, name):
+        # Extracted packages are kept when the execution environment is reused
+        start = time.perf_counter()
+        marker = os.path.join(self.target, ".{}.extracted".format(name))
+        if not os.path.exists(marker):
+            import zipfile
+
+            # Shared libraries vendored by `auditwheel` may be loaded by any package
+            prefixes = (name + "/", name + ".") + tuple(lib + "/" for lib in self.libs)
+            with zipfile.ZipFile(self.archive) as zf:
+                members = [m for m in zf.namelist() if m.startswith(prefixes)]
+                zf.extractall(self.target, members)
+            open(marker, "w").close()
+
+        if self.target not in sys.path:
+            index = sys.path.index(self.archive) if self.archive in sys.path else 0
+            sys.path.insert(index, self.target)
+            importlib.invalidate_caches()
+
+        logging.info(
+            "Extracted {} from {} in {:.1f} ms".format(
+                name, REQUIREMENTS_ARCHIVE, (time.perf_counter() - start) * 1000
+            )
+        )
+
+
+def mount_requirements_archive(archive):
+    """
+    Add the requirements archive to `sys.path`, right after the directory of the
+    handler, so application modules take precedence over requirements.
+    """
+    root = os.path.dirname(archive)
+    sys.path.insert(sys.path.index(root) + 1 if root in sys.path else 0, archive)
+
+    index = json.loads(zipimport.zipimporter(archive).get_data(REQUIREMENTS_INDEX))
+    if index["extract"]:
+        sys.meta_path.insert(0, RequirementsArchiveFinder(archive, index))
+
+
+requirements_archive = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), REQUIREMENTS_ARCHIVE
+)
+if os.path.isfile(requirements_archive):
+    mount_requirements_archive(requirements_archive)
+
+pruned_archive = os.path.join(os.path.abspath(os.path.dirname(__file__)), PRUNED_ARCHIVE)
+if os.path.isfile(pruned_archive):
+    sys.meta_path.append(PrunedArchiveFinder(pruned_archive))
+
+from werkzeug.exceptions import InternalServerError  # noqa: E402
 
 # Call decompression helper from `serverless-python-requirements` if
-# available. See: https://github.com/UnitedIncome/serverless-python-requirements#dealing-with-lambdas-size-limitations
-try:
-    import unzip_requirements  # noqa
-except ImportError:
-    pass
+# available, unless requirements are packaged in an archive of this plugin. See:
+# https://github.com/UnitedIncome/serverless-python-requirements#dealing-with-lambdas-size-limitations
+if not os.path.isfile(requirements_archive):
+    try:
+        import unzip_requirements  # noqa
+    except ImportError:
+        pass
 
-import serverless_wsgi
+import serverless_wsgi  # noqa: E402
 
 
 def load_config():
@@ -32,6 +162,107 @@ def load_config():
         return json.loads(f.read())
 
 
+class ImportProfiler:
+    """
+    Meta path finder that records the time spent executing each module imported
+    while it is installed. Module loaders are wrapped only for the duration of
+    `exec_module`, so imported modules keep their original loader.
+    """
+
+    def __init__(self):
+        self.modules = {}
+        self.stack = []
+
+    def __enter__(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+    def __exit__(self, *args):
+        sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = TimedLoader(spec.loader, self)
+        return spec
+
+    def record(self, name, loader, module):
+        # Stack entries hold the module name and the time spent in nested imports
+        parent = self.stack[-1] if self.stack else None
+        stats = {"parent": parent and parent[0], "self_ms": 0.0, "cumulative_ms": 0.0}
+        self.modules[name] = stats
+        frame = [name, 0.0]
+        self.stack.append(frame)
+
+        start = time.perf_counter()
+        try:
+            loader.exec_module(module)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stack.pop()
+            if parent is not None:
+                parent[1] += elapsed
+            stats["cumulative_ms"] = round(elapsed, 3)
+            stats["self_ms"] = round(elapsed - frame[1], 3)
+
+    def format_summary(self, top):
+        lines = ["Slowest imports during cold start (cumulative / self):"]
+        slowest = sorted(
+            self.modules.items(), key=lambda item: item[1]["cumulative_ms"], reverse=True
+        )
+        for name, stats in slowest[:top]:
+            lines.append(
+                "{:>10.1f} ms {:>10.1f} ms  {}".format(
+                    stats["cumulative_ms"], stats["self_ms"], name
+                )
+            )
+        return "\n".join(lines)
+
+
+class TimedLoader:
+    """Loader wrapper that times `exec_module` through an `ImportProfiler`"""
+
+    def __init__(self, loader, profiler):
+        self.loader = loader
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # Restore the original loader, so that it is seen by the module itself
+        module.__loader__ = self.loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.loader
+        self.profiler.record(module.__name__, self.loader, module)
+
+
+def profile_import_app(config):
+    """Import the application while recording the time spent on each import"""
+    options = config.get("import_profile")
+    if not isinstance(options, dict):
+        options = {}
+
+    start = time.perf_counter()
+    with ImportProfiler() as profiler:
+        app = import_app(config)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    print(profiler.format_summary(options.get("top", 10)))
+    return app, {"import_app_ms": round(elapsed, 3), "modules": profiler.modules}
+
+
 def import_app(config):
     """Load the application WSGI handler"""
     wsgi_fqn = config["app"].rsplit(".", 1)
@@ -44,19 +275,115 @@ def import_app(config):
     try:
         wsgi_module = importlib.import_module(wsgi_fqn_parts[-1])
 
-        return getattr(wsgi_module, wsgi_fqn[1])
+        app = getattr(wsgi_module, wsgi_fqn[1])
     except Exception as err:
         logging.exception("Unable to import app: '{}' - {}".format(config["app"], err))
         return InternalServerError("Unable to import app: {}".format(config["app"]))
 
+    if config.get("warm_init"):
+        warm_up_app(app)
+    return app
+
+
+def warm_up_flask(app):
+    # Compile the URL rules, which is otherwise done on the first request
+    app.url_map.bind("localhost")
+    app.url_map.update()
+
+    env = app.jinja_env
+    try:
+        templates = env.list_templates()
+    except TypeError:
+        # The template loader doesn't support listing templates
+        templates = []
+    for name in templates:
+        try:
+            env.get_template(name)
+        except Exception as err:
+            logging.warning("Unable to compile template {}: {}".format(name, err))
+
+
+def warm_up_django(app):
+    from django.apps import apps
+    from django.template import engines
+    from django.urls import get_resolver
+
+    # Populate the model caches of the app registry
+    apps.check_apps_ready()
+    apps.get_models()
+
+    # Import the URLconf and build the reverse lookup of the URL resolver
+    get_resolver().reverse_dict
+
+    # Instantiate the template loaders, which cache the templates they load
+    for engine in engines.all():
+        if hasattr(engine, "engine"):
+            engine.engine.template_loaders
+
+
+def warm_up_app(app):
+    """
+    Build state that Flask and Django otherwise build lazily on the first request,
+    so it is done during initialization. Failures are logged, as the framework
+    will try again when handling a request.
+    """
+    flask = sys.modules.get("flask")
+    django_wsgi = sys.modules.get("django.core.handlers.wsgi")
+    if flask is not None and isinstance(app, flask.Flask):
+        framework, warm_up = "Flask", warm_up_flask
+    elif django_wsgi is not None and isinstance(app, django_wsgi.WSGIHandler):
+        framework, warm_up = "Django", warm_up_django
+    else:
+        return
+
+    start = time.perf_counter()
+    try:
+        warm_up(app)
+    except Exception:
+        logging.exception("Unable to warm up {} app".format(framework))
+        return
+    print(
+        "Warmed up {} app in {:.1f} ms".format(
+            framework, (time.perf_counter() - start) * 1000
+        )
+    )
+
+
+def prime_app(app, requests, config):
+    """
+    Run synthetic requests through the application while initializing, so state
+    that frameworks build lazily on the first request, such as URL maps, template
+    caches and connection pools, is ready before the first invocation. Failures
+    are logged without failing initialization. Returns the total time spent.
+    """
+    # Priming requests are not reported as invocations
+    priming_settings = serverless_wsgi.Settings.load(dict(config, metrics=False))
+
+    total = 0.0
+    for request in requests:
+        event = serverless_wsgi.get_synthetic_event(request)
+        name = "{} {}".format(
+            event["requestContext"]["http"]["method"], request.get("path", "/")
+        )
+        start = time.perf_counter()
+        try:
+            response = serverless_wsgi.handle_request(app, event, {}, priming_settings)
+        except Exception:
+            logging.exception("Priming request {} failed".format(name))
+            continue
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            total += elapsed
+
+        status = response.get("statusCode")
+        if isinstance(status, int) and status >= 500:
+            logging.warning("Priming request {} returned {}".format(name, status))
+        print("Primed {} with status {} in {:.1f} ms".format(name, status, elapsed))
 
-def append_text_mime_types(config):
-    """Append additional text (non-base64) mime types from configuration file"""
-    if "text_mime_types" in config and isinstance(config["text_mime_types"], list):
-        serverless_wsgi.TEXT_MIME_TYPES.extend(config["text_mime_types"])
+    return round(total, 3)
 
 
-def handler(event, context):
+def handler(event, context, response_stream=None):
     """Lambda event handler, invokes the WSGI wrapper and handles command invocation"""
     if "_serverless-wsgi" in event:
         import shlex
@@ -104,15 +431,125 @@ def handler(event, context):
             sys.stderr = native_stderr
 
         return [0, output_buffer.getvalue()]
+    elif response_stream is not None and config.get("response_streaming"):
+        return serverless_wsgi.handle_request_streaming(
+            wsgi_app, event, context, response_stream, settings
+        )
     else:
-        return serverless_wsgi.handle_request(wsgi_app, event, context)
+        return serverless_wsgi.handle_request(wsgi_app, event, context, settings)
+
+
+def configure_gc(config, custom_runtime=False):
+    """
+    Tune the garbage collector once the application is initialized. Returns the
+    thresholds of the collections to run between invocations, if enabled, which
+    is only possible when run as a custom runtime.
+    """
+    options = config.get("gc")
+    if options is True:
+        options = {}
+    elif not isinstance(options, dict):
+        return None
+
+    if options.get("thresholds"):
+        gc.set_threshold(*options["thresholds"])
+
+    # Objects created while initializing mostly live as long as the container,
+    # so they are moved to a permanent generation that collections don't scan
+    if options.get("freeze", True):
+        gc.collect()
+        gc.freeze()
+
+    if config.get("metrics"):
+        serverless_wsgi.gc_monitor.install()
+
+    if not options.get("collect_between_invocations"):
+        return None
+
+    if not custom_runtime:
+        logging.warning(
+            "Collecting garbage between invocations requires running as a custom "
+            "runtime, so that it happens after the response is sent, and is ignored"
+        )
+        return None
+
+    threshold = gc.get_threshold()
+    if threshold[0] == 0:
+        return None
+
+    # Automatic collections stay enabled with a higher threshold, so that cyclic
+    # garbage of invocations that allocate far more than usual is still collected
+    gc.set_threshold(threshold[0] * GC_SAFETY_FACTOR, *threshold[1:])
+    return threshold
+
+
+def collect_garbage(threshold):
+    """
+    Run the collection that the automatic collector would have run with the
+    given thresholds during the invocation: the oldest generation over its
+    threshold, if any
+    """
+    count = gc.get_count()
+    for generation in (2, 1, 0):
+        if count[generation] > threshold[generation]:
+            gc.collect(generation)
+            return
+
+
+def register_runtime_hooks():
+    """
+    Run the checkpoint hooks of `serverless_wsgi` around SnapStart snapshots,
+    through the runtime hooks provided by the Lambda Python runtime
+    """
+    try:
+        from snapshot_restore_py import register_after_restore, register_before_snapshot
+    except ImportError:
+        return
+
+    def before_snapshot():
+        serverless_wsgi.run_checkpoint_hooks("before_checkpoint")
+
+    def after_restore():
+        serverless_wsgi.run_checkpoint_hooks("after_restore")
+
+    register_before_snapshot(before_snapshot)
+    register_after_restore(after_restore)
 
 
 def _create_app():
     return wsgi_app
 
 
+def check_bytecode(config):
+    """Warn when bytecode was compiled for a different Python version"""
+    magic = config.get("bytecode_magic")
+    if magic and magic != importlib.util.MAGIC_NUMBER.hex():
+        logging.warning(
+            "Precompiled bytecode does not match the Python runtime and is ignored, "
+            "make sure that pythonBin matches the runtime"
+        )
+
+
 # Read configuration and import the WSGI application
 config = load_config()
-wsgi_app = import_app(config)
-append_text_mime_types(config)
+check_bytecode(config)
+if config.get("import_profile"):
+    wsgi_app, init_stats = profile_import_app(config)
+else:
+    wsgi_app, init_stats = import_app(config), None
+if config.get("priming_requests") and not isinstance(wsgi_app, InternalServerError):
+    priming_ms = prime_app(wsgi_app, config["priming_requests"], config)
+    if init_stats is not None:
+        init_stats["priming_ms"] = priming_ms
+settings = serverless_wsgi.Settings.load(config, init_stats=init_stats)
+gc_threshold = configure_gc(config, custom_runtime=__name__ == "__main__")
+register_runtime_hooks()
+
+if __name__ == "__main__":  # pragma: no cover
+    # Run as a custom runtime, enabling response streaming
+    serverless_wsgi.serve_runtime_api(
+        handler,
+        after_invocation=(lambda: collect_garbage(gc_threshold))
+        if gc_threshold
+        else None,
+    )
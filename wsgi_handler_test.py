@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import base64
 import builtins
+import gzip
 import importlib
+import importlib.util
+import io
+import http.server
 import json
 import os
+import py_compile
 import pytest
+import random
 import sys
+import tempfile
+import threading
+import weakref
 from urllib.parse import urlencode
 from werkzeug.wrappers import Request, Response
 
@@ -132,6 +142,133 @@ def mock_text_mime_wsgi_app_file(monkeypatch):
     monkeypatch.setattr(builtins, "open", manager.open)
 
 
+@pytest.fixture
+def mock_streaming_wsgi_app_file(monkeypatch):
+    monkeypatch.setattr(os.path, "abspath", lambda x: "/tmp")
+
+    manager = MockFileManager()
+    with manager.open("/tmp/.serverless-wsgi", "w") as f:
+        f.write(json.dumps({"app": "app.app", "response_streaming": True}))
+    monkeypatch.setattr(builtins, "open", manager.open)
+
+
+@pytest.fixture
+def mock_compression_wsgi_app_file(monkeypatch):
+    monkeypatch.setattr(os.path, "abspath", lambda x: "/tmp")
+
+    manager = MockFileManager()
+    with manager.open("/tmp/.serverless-wsgi", "w") as f:
+        f.write(
+            json.dumps(
+                {
+                    "app": "app.app",
+                    "compression": {
+                        "encodings": ["gzip"],
+                        "min_size": 10,
+                        "rest_api": True,
+                    },
+                }
+            )
+        )
+    monkeypatch.setattr(builtins, "open", manager.open)
+
+
+@pytest.fixture
+def mock_request_body_wsgi_app_file(monkeypatch):
+    monkeypatch.setattr(os.path, "abspath", lambda x: "/tmp")
+
+    manager = MockFileManager()
+    with manager.open("/tmp/.serverless-wsgi", "w") as f:
+        f.write(
+            json.dumps(
+                {
+                    "app": "app.app",
+                    "request_body": {"spool_threshold": 256, "strip_event": True},
+                }
+            )
+        )
+    monkeypatch.setattr(builtins, "open", manager.open)
+
+
+@pytest.fixture
+def mock_metrics_wsgi_app_file(monkeypatch):
+    monkeypatch.setattr(os.path, "abspath", lambda x: "/tmp")
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "api")
+
+    manager = MockFileManager()
+    with manager.open("/tmp/.serverless-wsgi", "w") as f:
+        f.write(json.dumps({"app": "app.app", "metrics": {"namespace": "test"}}))
+    monkeypatch.setattr(builtins, "open", manager.open)
+
+
+@pytest.fixture
+def mock_import_profile_wsgi_app_file(monkeypatch):
+    monkeypatch.setattr(os.path, "abspath", lambda x: "/tmp")
+
+    manager = MockFileManager()
+    with manager.open("/tmp/.serverless-wsgi", "w") as f:
+        f.write(json.dumps({"app": "app.app", "import_profile": {"top": 3}}))
+    monkeypatch.setattr(builtins, "open", manager.open)
+
+
+@pytest.fixture
+def mock_gc_wsgi_app_file(monkeypatch):
+    monkeypatch.setattr(os.path, "abspath", lambda x: "/tmp")
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "api")
+
+    manager = MockFileManager()
+    with manager.open("/tmp/.serverless-wsgi", "w") as f:
+        f.write(
+            json.dumps(
+                {
+                    "app": "app.app",
+                    "metrics": True,
+                    "gc": {
+                        "thresholds": [5000, 20, 20],
+                        "collect_between_invocations": True,
+                    },
+                }
+            )
+        )
+    monkeypatch.setattr(builtins, "open", manager.open)
+
+
+@pytest.fixture
+def restore_gc():
+    import gc
+    import serverless_wsgi
+
+    threshold = gc.get_threshold()
+    yield
+    gc.set_threshold(*threshold)
+    gc.unfreeze()
+    gc.enable()
+    if serverless_wsgi.gc_monitor.installed:
+        gc.callbacks.remove(serverless_wsgi.gc_monitor)
+    serverless_wsgi.gc_monitor.pop()
+
+
+@pytest.fixture
+def mock_priming_wsgi_app_file(monkeypatch):
+    monkeypatch.setattr(os.path, "abspath", lambda x: "/tmp")
+
+    manager = MockFileManager()
+    with manager.open("/tmp/.serverless-wsgi", "w") as f:
+        f.write(
+            json.dumps(
+                {
+                    "app": "app.app",
+                    "metrics": True,
+                    "priming_requests": [
+                        {"path": "/health?full=1", "headers": {"X-Priming": "1"}},
+                        {"method": "post", "path": "/items"},
+                    ],
+                }
+            )
+        )
+    monkeypatch.setattr(builtins, "open", manager.open)
+
+
 @pytest.fixture
 def event_v1():
     return {
@@ -243,11 +380,15 @@ def test_handler(mock_wsgi_app_file, mock_app, event_v1, capsys, wsgi_handler):
     assert response == {
         "body": "Hello World ☃!",
         "headers": {
-            "set-cookie": "CUSTOMER=WILE_E_COYOTE; Path=/",
             "Content-Length": "16",
             "Content-Type": "text/plain; charset=utf-8",
-            "sEt-cookie": "LOT_NUMBER=42; Path=/",
-            "Set-cookie": "PART_NUMBER=ROCKET_LAUNCHER_0002; Path=/",
+        },
+        "multiValueHeaders": {
+            "Set-Cookie": [
+                "CUSTOMER=WILE_E_COYOTE; Path=/",
+                "PART_NUMBER=ROCKET_LAUNCHER_0002; Path=/",
+                "LOT_NUMBER=42; Path=/",
+            ],
         },
         "statusCode": 200,
         "isBase64Encoded": False,
@@ -353,6 +494,29 @@ def test_handler_multivalue(
     }
 
 
+def test_handler_multivalue_singleton_headers(
+    mock_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    event_v1["multiValueHeaders"] = {
+        "Host": ["first.example.com", "second.example.com"],
+        "Content-Type": ["application/json", "text/plain"],
+        "X-Forwarded-Port": ["8443", "443"],
+        "X-Forwarded-Proto": ["http", "https"],
+        "X-Custom": ["one", "two"],
+    }
+    wsgi_handler.handler(event_v1, {})
+    environ = wsgi_handler.wsgi_app.last_environ
+
+    # Variables derived from headers use the first value, as with werkzeug
+    # `Headers.get`, while `HTTP_*` variables use the last one
+    assert environ["SERVER_NAME"] == "first.example.com"
+    assert environ["CONTENT_TYPE"] == "application/json"
+    assert environ["SERVER_PORT"] == "8443"
+    assert environ["wsgi.url_scheme"] == "http"
+    assert environ["HTTP_HOST"] == "second.example.com"
+    assert environ["HTTP_X_CUSTOM"] == "two"
+
+
 def test_handler_china(mock_wsgi_app_file, mock_app, event_v1, capsys, wsgi_handler):
     event_v1["headers"]["Host"] = "x.amazonaws.com.cn"
     wsgi_handler.handler(event_v1, {"memory_limit_in_mb": "128"})
@@ -457,16 +621,22 @@ def test_handler_custom_domain(mock_wsgi_app_file, mock_app, event_v1, wsgi_hand
     }
 
 
+@pytest.fixture
+def api_gateway_base_path(monkeypatch):
+    monkeypatch.setenv("API_GATEWAY_BASE_PATH", "prod")
+
+
+@pytest.fixture
+def strip_stage_path(monkeypatch):
+    monkeypatch.setenv("STRIP_STAGE_PATH", "True")
+
+
 def test_handler_api_gateway_base_path(
-    mock_wsgi_app_file, mock_app, event_v1, wsgi_handler
+    mock_wsgi_app_file, mock_app, event_v1, api_gateway_base_path, wsgi_handler
 ):
     event_v1["headers"]["Host"] = "custom.domain.com"
     event_v1["path"] = "/prod/some/path"
-    try:
-        os.environ["API_GATEWAY_BASE_PATH"] = "prod"
-        wsgi_handler.handler(event_v1, {})
-    finally:
-        del os.environ["API_GATEWAY_BASE_PATH"]
+    wsgi_handler.handler(event_v1, {})
 
     assert wsgi_handler.wsgi_app.last_environ == {
         "CONTENT_LENGTH": "0",
@@ -512,12 +682,10 @@ def test_handler_api_gateway_base_path(
     }
 
 
-def test_handler_strip_stage_path(mock_wsgi_app_file, mock_app, event_v1, wsgi_handler):
-    try:
-        os.environ["STRIP_STAGE_PATH"] = "True"
-        wsgi_handler.handler(event_v1, {})
-    finally:
-        del os.environ["STRIP_STAGE_PATH"]
+def test_handler_strip_stage_path(
+    mock_wsgi_app_file, mock_app, event_v1, strip_stage_path, wsgi_handler
+):
+    wsgi_handler.handler(event_v1, {})
 
     assert wsgi_handler.wsgi_app.last_environ["SCRIPT_NAME"] == ""
 
@@ -564,6 +732,61 @@ def test_handler_plain(mock_wsgi_app_file, mock_app, event_v1, wsgi_handler):
         }
 
 
+def test_handler_write_callable(mock_wsgi_app_file, mock_app, event_v1, wsgi_handler):
+    closed = []
+
+    class AppIter:
+        def __init__(self, write):
+            self.write = write
+
+        def __iter__(self):
+            yield b"World"
+            self.write(b"!")
+
+        def close(self):
+            closed.append(True)
+
+    def app(environ, start_response):
+        write = start_response("200 OK", [("content-type", "text/plain")])
+        write(b"Hello ")
+        return AppIter(write)
+
+    wsgi_handler.wsgi_app = app
+    response = wsgi_handler.handler(event_v1, {})
+
+    assert response == {
+        "body": "Hello World!",
+        "headers": {"content-type": "text/plain"},
+        "statusCode": 200,
+        "isBase64Encoded": False,
+    }
+    assert closed == [True]
+
+
+def test_handler_exc_info(mock_wsgi_app_file, mock_app, event_v1, wsgi_handler):
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        try:
+            raise ValueError()
+        except ValueError:
+            start_response(
+                "500 Internal Server Error",
+                [("Content-Type", "application/json")],
+                sys.exc_info(),
+            )
+        return [b'{"error": true}']
+
+    wsgi_handler.wsgi_app = app
+    response = wsgi_handler.handler(event_v1, {})
+
+    assert response == {
+        "body": '{"error": true}',
+        "headers": {"Content-Type": "application/json"},
+        "statusCode": 500,
+        "isBase64Encoded": False,
+    }
+
+
 def test_handler_base64_request(mock_wsgi_app_file, mock_app, event_v1, wsgi_handler):
     event_v1["body"] = "SGVsbG8gd29ybGQ="
     event_v1["headers"]["Content-Type"] = "text/plain"
@@ -580,6 +803,362 @@ def test_handler_base64_request(mock_wsgi_app_file, mock_app, event_v1, wsgi_han
     assert environ["wsgi.input"].getvalue().decode() == "Hello world"
 
 
+def test_handler_import_profile(
+    mock_import_profile_wsgi_app_file, mock_app, event_v1, capsys, wsgi_handler
+):
+    assert "Slowest imports during cold start" in capsys.readouterr().out
+
+    wsgi_handler.handler(event_v1, {})
+
+    init_stats = wsgi_handler.wsgi_app.last_environ["serverless.init_stats"]
+    assert init_stats["import_app_ms"] >= 0
+    assert init_stats["modules"] == {}
+
+
+def test_handler_priming(
+    mock_priming_wsgi_app_file, mock_app, capsys, wsgi_handler
+):
+    out = capsys.readouterr().out
+    assert "Primed GET /health?full=1 with status 200 in" in out
+    assert "Primed POST /items with status 200 in" in out
+    # Priming requests are not reported in the invocation metrics
+    assert "_aws" not in out
+
+    environ = mock_app.last_environ
+    assert environ["REQUEST_METHOD"] == "POST"
+    assert environ["PATH_INFO"] == "/items"
+
+
+def test_prime_app_failure(mock_wsgi_app_file, mock_app, caplog, wsgi_handler):
+    def failing_app(environ, start_response):
+        raise ValueError("not ready")
+
+    mock_app.status_code = 503
+    requests = [{"path": "/broken"}, {"path": "/unavailable"}]
+
+    assert wsgi_handler.prime_app(failing_app, requests[:1], {}) >= 0
+    assert wsgi_handler.prime_app(mock_app, requests[1:], {}) >= 0
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages == [
+        "Priming request GET /broken failed",
+        "Priming request GET /unavailable returned 503",
+    ]
+
+
+def test_import_profiler(
+    tmp_path, mock_wsgi_app_file, mock_app, monkeypatch, wsgi_handler
+):
+    package = tmp_path / "profiled_package"
+    package.mkdir()
+    (package / "__init__.py").write_text("from . import child\n")
+    (package / "child.py").write_text("import time\ntime.sleep(0.01)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    try:
+        with wsgi_handler.ImportProfiler() as profiler:
+            import profiled_package
+    finally:
+        sys.modules.pop("profiled_package", None)
+        sys.modules.pop("profiled_package.child", None)
+
+    assert profiler not in sys.meta_path
+    assert profiled_package.__loader__.__class__.__name__ == "SourceFileLoader"
+
+    parent = profiler.modules["profiled_package"]
+    child = profiler.modules["profiled_package.child"]
+    assert parent["parent"] is None
+    assert child["parent"] == "profiled_package"
+    assert child["cumulative_ms"] >= 10
+    assert parent["cumulative_ms"] >= child["cumulative_ms"]
+    assert parent["self_ms"] < child["self_ms"]
+    assert profiler.format_summary(1).splitlines()[1].endswith("  profiled_package")
+
+
+def test_pruned_archive_finder(
+    tmp_path, mock_wsgi_app_file, mock_app, monkeypatch, wsgi_handler
+):
+    import zipfile
+
+    package = tmp_path / "partly_pruned"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    archive = tmp_path / "pruned.zip"
+    with zipfile.ZipFile(str(archive), "w") as zf:
+        zf.writestr("partly_pruned/extra.py", "VALUE = 1\n")
+        zf.writestr("fully_pruned/__init__.py", "")
+        zf.writestr("fully_pruned/sub/__init__.py", "from . import leaf\n")
+        zf.writestr("fully_pruned/sub/leaf.py", "VALUE = 2\n")
+
+    finder = wsgi_handler.PrunedArchiveFinder(str(archive))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, "meta_path", sys.meta_path + [finder])
+
+    try:
+        import partly_pruned.extra
+        import fully_pruned.sub
+
+        assert partly_pruned.extra.VALUE == 1
+        assert fully_pruned.sub.leaf.VALUE == 2
+        assert finder.find_spec("partly_pruned.missing") is None
+    finally:
+        for name in list(sys.modules):
+            if name.startswith(("partly_pruned", "fully_pruned")):
+                del sys.modules[name]
+
+
+def build_requirements_archive(tmp_path):
+    import archive
+    import compileall
+
+    requirements = tmp_path / ".requirements"
+    (requirements / "zipped_pkg").mkdir(parents=True)
+    (requirements / "zipped_pkg" / "__init__.py").write_text("VALUE = 1\n")
+    (requirements / "data_pkg").mkdir()
+    (requirements / "data_pkg" / "__init__.py").write_text(
+        "import os\n"
+        "with open(os.path.join(os.path.dirname(__file__), 'data.txt')) as f:\n"
+        "    VALUE = f.read()\n"
+    )
+    (requirements / "data_pkg" / "data.txt").write_text("data")
+    compileall.compile_dir(
+        str(requirements),
+        quiet=1,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+    )
+    archive.build_archive(str(requirements))
+
+    requirements_archive = str(tmp_path / ".requirements.zip")
+    os.rename(str(requirements / ".requirements.zip"), requirements_archive)
+    return requirements_archive
+
+
+def test_requirements_archive(
+    tmp_path, mock_wsgi_app_file, mock_app, monkeypatch, wsgi_handler
+):
+    # The handler is loaded, restore the file system for building the archive
+    monkeypatch.undo()
+
+    requirements_archive = build_requirements_archive(tmp_path)
+    monkeypatch.setattr(sys, "path", [str(tmp_path)] + sys.path)
+    monkeypatch.setattr(sys, "meta_path", list(sys.meta_path))
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+
+    try:
+        wsgi_handler.mount_requirements_archive(requirements_archive)
+        assert sys.path[1] == requirements_archive
+
+        import zipped_pkg
+        import data_pkg
+
+        assert zipped_pkg.VALUE == 1
+        assert zipped_pkg.__file__.startswith(requirements_archive)
+        assert data_pkg.VALUE == "data"
+        assert data_pkg.__file__.startswith(str(tmp_path / "tmp" / "serverless-wsgi"))
+    finally:
+        for name in ("zipped_pkg", "data_pkg"):
+            sys.modules.pop(name, None)
+
+
+def test_requirements_archive_removed_from_path(
+    tmp_path, mock_wsgi_app_file, mock_app, monkeypatch, wsgi_handler
+):
+    import zipimport
+
+    monkeypatch.undo()
+
+    requirements_archive = build_requirements_archive(tmp_path)
+    index = json.loads(
+        zipimport.zipimporter(requirements_archive).get_data(
+            wsgi_handler.REQUIREMENTS_INDEX
+        )
+    )
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    finder = wsgi_handler.RequirementsArchiveFinder(requirements_archive, index)
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    monkeypatch.setattr(sys, "meta_path", [finder] + sys.meta_path)
+
+    try:
+        # The extracted packages are still found without the archive on the path
+        import data_pkg
+
+        assert data_pkg.VALUE == "data"
+        assert sys.path[0] == finder.target
+    finally:
+        sys.modules.pop("data_pkg", None)
+
+
+def test_checkpoint_hooks(
+    mock_wsgi_app_file, mock_app, event_v1, monkeypatch, capsys
+):
+    import serverless_wsgi
+    import types
+
+    runtime_hooks = {}
+    snapshot_restore_py = types.ModuleType("snapshot_restore_py")
+    snapshot_restore_py.register_before_snapshot = lambda func: runtime_hooks.update(
+        before=func
+    )
+    snapshot_restore_py.register_after_restore = lambda func: runtime_hooks.update(
+        after=func
+    )
+    monkeypatch.setitem(sys.modules, "snapshot_restore_py", snapshot_restore_py)
+    monkeypatch.setattr(
+        serverless_wsgi,
+        "checkpoint_hooks",
+        {
+            phase: list(hooks)
+            for phase, hooks in serverless_wsgi.checkpoint_hooks.items()
+        },
+    )
+    monkeypatch.delitem(sys.modules, "wsgi_handler", raising=False)
+    import wsgi_handler
+
+    calls = []
+
+    @serverless_wsgi.before_checkpoint
+    def failing_hook():
+        raise ValueError("unable to close")
+
+    @serverless_wsgi.before_checkpoint
+    def close_connections():
+        calls.append("before_checkpoint")
+
+    @serverless_wsgi.after_restore
+    def open_connections():
+        calls.append("after_restore")
+
+    serverless_wsgi.cold_start = False
+    random_state = random.getstate()
+
+    runtime_hooks["before"]()
+    runtime_hooks["after"]()
+
+    assert calls == ["before_checkpoint", "after_restore"]
+    assert serverless_wsgi.cold_start
+    assert random.getstate() != random_state
+
+    out, err = capsys.readouterr()
+    assert "Error in before_checkpoint hook failing_hook" in out
+    assert "ValueError: unable to close" in err
+    assert "Ran 3 before_checkpoint hooks in" in out
+    assert "Ran 4 after_restore hooks in" in out
+    assert wsgi_handler.handler(event_v1, {})["statusCode"] == 200
+
+
+def test_close_django_connections(monkeypatch):
+    import serverless_wsgi
+    import types
+
+    class Connections:
+        closed = False
+
+        def close_all(self):
+            self.closed = True
+
+    django_db = types.ModuleType("django.db")
+    django_db.connections = Connections()
+    monkeypatch.setitem(sys.modules, "django.db", django_db)
+
+    serverless_wsgi.close_django_connections()
+    assert django_db.connections.closed
+
+
+def test_import_app_warm_init(
+    mock_wsgi_app_file, mock_app, monkeypatch, wsgi_handler
+):
+    warmed = []
+    monkeypatch.setattr(wsgi_handler, "warm_up_app", warmed.append)
+
+    assert wsgi_handler.import_app({"app": "app.app"}) is mock_app
+    assert warmed == []
+    assert wsgi_handler.import_app({"app": "app.app", "warm_init": True}) is mock_app
+    assert warmed == [mock_app]
+
+
+def test_warm_up_flask(tmp_path, mock_wsgi_app_file, mock_app, capsys, wsgi_handler):
+    import flask
+
+    templates = tmp_path / "templates"
+    templates.mkdir()
+    (templates / "index.html").write_text("Hello {{ name }}")
+    (templates / "broken.html").write_text("{% if %}")
+
+    app = flask.Flask("warm_app", template_folder=str(templates))
+    app.add_url_rule("/items/<int:id>", "item", lambda id: str(id))
+    assert app.url_map._remap
+
+    wsgi_handler.warm_up_app(app)
+
+    assert not app.url_map._remap
+    assert list(app.jinja_env.cache) == [
+        (weakref.ref(app.jinja_env.loader), "index.html")
+    ]
+    assert "Warmed up Flask app in" in capsys.readouterr().out
+
+
+def test_warm_up_django(mock_wsgi_app_file, mock_app, monkeypatch, capsys, wsgi_handler):
+    import types
+
+    calls = []
+
+    class WSGIHandler:
+        pass
+
+    class Apps:
+        def check_apps_ready(self):
+            calls.append("check_apps_ready")
+
+        def get_models(self):
+            calls.append("get_models")
+
+    class Resolver:
+        @property
+        def reverse_dict(self):
+            calls.append("reverse_dict")
+
+    class Engine:
+        @property
+        def template_loaders(self):
+            calls.append("template_loaders")
+
+    class Backend:
+        engine = Engine()
+
+    modules = {
+        "django": {},
+        "django.apps": {"apps": Apps()},
+        "django.template": {
+            "engines": types.SimpleNamespace(all=lambda: [Backend(), object()])
+        },
+        "django.urls": {"get_resolver": Resolver},
+        "django.core.handlers.wsgi": {"WSGIHandler": WSGIHandler},
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        monkeypatch.setitem(sys.modules, name, module)
+
+    wsgi_handler.warm_up_app(WSGIHandler())
+
+    assert calls == ["check_apps_ready", "get_models", "reverse_dict", "template_loaders"]
+    assert "Warmed up Django app in" in capsys.readouterr().out
+
+    # Failures are logged, and the app is still used
+    Apps.check_apps_ready = lambda self: 1 / 0
+    wsgi_handler.warm_up_app(WSGIHandler())
+    assert "Warmed up" not in capsys.readouterr().out
+
+
+def test_check_bytecode(mock_wsgi_app_file, mock_app, caplog, wsgi_handler):
+    wsgi_handler.check_bytecode({"bytecode_magic": importlib.util.MAGIC_NUMBER.hex()})
+    wsgi_handler.check_bytecode({})
+    assert caplog.records == []
+
+    wsgi_handler.check_bytecode({"bytecode_magic": "420d0d0a"})
+    assert "does not match the Python runtime" in caplog.records[0].getMessage()
+
+
 def test_non_package_subdir_app(mock_subdir_wsgi_app_file, mock_app, wsgi_handler):
     assert wsgi_handler.wsgi_app.module == "app"
 
@@ -606,12 +1185,140 @@ def test_handler_binary_request_body(
     event_v1["isBase64Encoded"] = True
     event_v1["httpMethod"] = "POST"
 
-    wsgi_handler.handler(event_v1, {})
+    wsgi_handler.handler(event_v1, {})
+
+    environ = wsgi_handler.wsgi_app.last_environ
+
+    assert environ["CONTENT_LENGTH"] == "496"
+    assert Request(environ).form["submit"] == "Upload Image"
+
+
+def test_handler_lazy_request_body(
+    mock_request_body_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    event_v1["body"] = "SGVsbG8gd29ybGQ="
+    event_v1["isBase64Encoded"] = True
+    event_v1["httpMethod"] = "PUT"
+
+    wsgi_handler.handler(event_v1, {})
+
+    environ = wsgi_handler.wsgi_app.last_environ
+
+    assert environ["CONTENT_LENGTH"] == "11"
+    assert "body" not in environ["serverless.event"]
+    assert environ["wsgi.input"].read(5) == b"Hello"
+    assert environ["wsgi.input"].read() == b" world"
+
+
+def test_handler_lazy_request_body_unpadded(
+    mock_request_body_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    event_v1["isBase64Encoded"] = True
+    event_v1["httpMethod"] = "PUT"
+
+    body = bytes(range(256)) * 2
+    for encoded in (
+        "SGVsbG8gd29ybGQ",
+        base64.encodebytes(body).decode(),
+        base64.encodebytes(body).decode().replace("\n", "\r\n").rstrip("=\r\n"),
+    ):
+        event_v1["body"] = encoded
+        wsgi_handler.handler(event_v1, {})
+
+        environ = wsgi_handler.wsgi_app.last_environ
+        expected = base64.b64decode("".join(encoded.split()) + "==")
+        assert environ["CONTENT_LENGTH"] == str(len(expected))
+        assert environ["wsgi.input"].read() == expected
+
+
+def test_normalize_base64():
+    import serverless_wsgi
+
+    assert serverless_wsgi.normalize_base64("SGVsbG8=") == "SGVsbG8="
+    assert serverless_wsgi.normalize_base64("SGVsbG8") == "SGVsbG8="
+    assert serverless_wsgi.normalize_base64("SGVs\r\nbA") == "SGVsbA=="
+
+
+def test_handler_spooled_request_body(
+    mock_request_body_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    body = bytes(range(256)) * 4 + b"tail"
+    event_v1["body"] = base64.b64encode(body).decode()
+    event_v1["isBase64Encoded"] = True
+    event_v1["httpMethod"] = "POST"
+
+    wsgi_handler.handler(event_v1, {})
+
+    environ = wsgi_handler.wsgi_app.last_environ
+
+    assert environ["CONTENT_LENGTH"] == str(len(body))
+    assert "body" not in event_v1
+    assert not isinstance(environ["wsgi.input"], io.BufferedReader)
+    assert environ["wsgi.input"].read() == body
+
+
+def test_base64_input():
+    import serverless_wsgi
+
+    for size in (0, 1, 2, 3, 100, 1000):
+        body = os.urandom(size)
+        encoded = base64.b64encode(body).decode()
+        assert serverless_wsgi.get_base64_decoded_length(encoded) == size
+
+        stream = serverless_wsgi.Base64Input(encoded)
+        chunks = []
+        buffer = bytearray(7)
+        count = stream.readinto(buffer)
+        while count:
+            chunks.append(bytes(buffer[:count]))
+            count = stream.readinto(buffer)
+        assert b"".join(chunks) == body
+        assert stream.data is None
+
+
+def test_encode_base64():
+    import serverless_wsgi
+
+    chunk_size = serverless_wsgi.BODY_CHUNK_SIZE
+    for size in (1, 2, 3, chunk_size - 1, chunk_size, chunk_size + 1, chunk_size * 2 + 2):
+        body = os.urandom(size)
+        assert serverless_wsgi.encode_base64(body) == base64.b64encode(body)
+
 
-    environ = wsgi_handler.wsgi_app.last_environ
+def test_handler_default_content_type(
+    mock_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    def app(environ, start_response):
+        start_response("200 OK", [("X-Custom", "1")])
+        return [b"Hello"]
 
-    assert environ["CONTENT_LENGTH"] == "496"
-    assert Request(environ).form["submit"] == "Upload Image"
+    wsgi_handler.wsgi_app = app
+    response = wsgi_handler.handler(event_v1, {})
+
+    assert response == {
+        "body": "Hello",
+        "headers": {"X-Custom": "1", "Content-Type": "text/plain; charset=utf-8"},
+        "statusCode": 200,
+        "isBase64Encoded": False,
+    }
+
+
+def test_handler_binary_response_releases_body(
+    mock_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    import serverless_wsgi
+
+    body = os.urandom(1024)
+    response = serverless_wsgi.CapturedResponse(
+        "200 OK", [("Content-Type", "image/png")], body
+    )
+    returndict = serverless_wsgi.generate_response(
+        response, event_v1, wsgi_handler.settings
+    )
+
+    assert response.body is None
+    assert returndict["isBase64Encoded"]
+    assert base64.b64decode(returndict["body"]) == body
 
 
 def test_handler_request_body_undecodable_with_latin1(
@@ -653,6 +1360,80 @@ def test_handler_custom_text_mime_types(
     }
 
 
+def test_get_synthetic_event():
+    import serverless_wsgi
+
+    event = serverless_wsgi.get_synthetic_event(
+        {
+            "method": "post",
+            "path": "/items?page=2",
+            "headers": {"Content-Type": "application/json"},
+            "body": "{}",
+        }
+    )
+    environ = serverless_wsgi.get_environ(event, {})
+
+    assert environ["REQUEST_METHOD"] == "POST"
+    assert environ["PATH_INFO"] == "/items"
+    assert environ["QUERY_STRING"] == "page=2"
+    assert environ["CONTENT_TYPE"] == "application/json"
+    assert environ["SERVER_NAME"] == "localhost"
+    assert environ["wsgi.input"].read() == b"{}"
+
+
+def test_settings():
+    import serverless_wsgi
+
+    settings = serverless_wsgi.Settings.load(
+        {"text_mime_types": ["application/custom+json", "application/x-*"]},
+        {"STRIP_STAGE_PATH": " Yes ", "API_GATEWAY_BASE_PATH": "api/service"},
+    )
+
+    assert settings.strip_stage_path
+    assert settings.base_path == "/api/service"
+    assert settings.is_text_mime_type("text/csv")
+    assert settings.is_text_mime_type("application/json")
+    assert settings.is_text_mime_type("application/custom+json")
+    assert settings.is_text_mime_type("application/x-yaml")
+    assert not settings.is_text_mime_type("application/octet-stream")
+
+    with pytest.raises(AttributeError):
+        settings.base_path = ""
+
+
+def test_settings_defaults():
+    import serverless_wsgi
+
+    settings = serverless_wsgi.Settings.load(environ={})
+
+    assert not settings.strip_stage_path
+    assert settings.base_path == ""
+    assert not settings.is_text_mime_type("application/custom+json")
+    assert settings.spool_threshold is None
+    assert not settings.strip_event_body
+
+
+def test_settings_request_body():
+    import serverless_wsgi
+
+    settings = serverless_wsgi.Settings.load({"request_body": True}, {})
+
+    assert settings.spool_threshold == serverless_wsgi.SPOOL_THRESHOLD
+    assert not settings.strip_event_body
+
+
+def test_settings_metrics():
+    import serverless_wsgi
+
+    assert serverless_wsgi.Settings.load({}, {}).metrics_namespace is None
+
+    settings = serverless_wsgi.Settings.load(
+        {"metrics": True}, {"AWS_LAMBDA_FUNCTION_NAME": "api"}
+    )
+    assert settings.metrics_namespace == serverless_wsgi.METRICS_NAMESPACE
+    assert settings.function_name == "api"
+
+
 def test_handler_alb(mock_wsgi_app_file, mock_app, wsgi_handler, elb_event):
     response = wsgi_handler.handler(elb_event, {})
 
@@ -671,6 +1452,31 @@ def test_handler_alb(mock_wsgi_app_file, mock_app, wsgi_handler, elb_event):
     }
 
 
+def test_handler_alb_custom_status(mock_wsgi_app_file, mock_app, wsgi_handler, elb_event):
+    def app(environ, start_response):
+        start_response("299 Custom Status", [("Content-Type", "text/plain")])
+        return [b"Hello"]
+
+    wsgi_handler.wsgi_app = app
+    response = wsgi_handler.handler(elb_event, {})
+
+    assert response["statusCode"] == 299
+    assert response["statusDescription"] == "299 Custom Status"
+
+
+def test_split_headers_short_name():
+    import serverless_wsgi
+
+    headers = [("X-A", "1"), ("X-A", "2"), ("X-A", "3"), ("X-A", "4"), ("X-A", "5")]
+
+    assert serverless_wsgi.split_headers(headers) == {
+        "x-a": "1",
+        "X-a": "2",
+        "x-A": "3",
+        "X-A": "4, 5",
+    }
+
+
 def test_alb_query_params(mock_wsgi_app_file, mock_app, wsgi_handler, elb_event):
     elb_event["queryStringParameters"] = {"test": "test%20test"}
     response = wsgi_handler.handler(elb_event, {})
@@ -893,12 +1699,14 @@ def test_handler_v2(mock_wsgi_app_file, mock_app, event_v2, capsys, wsgi_handler
     assert response == {
         "body": "Hello World ☃!",
         "headers": {
-            "set-cookie": "CUSTOMER=WILE_E_COYOTE; Path=/",
             "Content-Length": "16",
             "Content-Type": "text/plain; charset=utf-8",
-            "sEt-cookie": "LOT_NUMBER=42; Path=/",
-            "Set-cookie": "PART_NUMBER=ROCKET_LAUNCHER_0002; Path=/",
         },
+        "cookies": [
+            "CUSTOMER=WILE_E_COYOTE; Path=/",
+            "PART_NUMBER=ROCKET_LAUNCHER_0002; Path=/",
+            "LOT_NUMBER=42; Path=/",
+        ],
         "statusCode": 200,
         "isBase64Encoded": False,
     }
@@ -951,6 +1759,66 @@ def test_handler_v2(mock_wsgi_app_file, mock_app, event_v2, capsys, wsgi_handler
     assert err == "application debug #1\n"
 
 
+def test_handler_v2_repeated_headers(
+    mock_wsgi_app_file, mock_app, event_v2, wsgi_handler
+):
+    def app(environ, start_response):
+        start_response(
+            "200 OK",
+            [("Content-Type", "text/plain"), ("X-Tag", "a"), ("x-tag", "b")],
+        )
+        return [b"Hello"]
+
+    wsgi_handler.wsgi_app = app
+    response = wsgi_handler.handler(event_v2, {})
+
+    assert response == {
+        "body": "Hello",
+        "headers": {"Content-Type": "text/plain", "X-Tag": "a, b"},
+        "statusCode": 200,
+        "isBase64Encoded": False,
+    }
+
+
+def test_get_header_environ(monkeypatch):
+    import serverless_wsgi
+
+    monkeypatch.setattr(serverless_wsgi, "CGI_HEADER_NAMES", {})
+    monkeypatch.setattr(serverless_wsgi, "CGI_HEADER_NAMES_MAX_SIZE", 2)
+
+    environ = serverless_wsgi.get_header_environ(
+        {
+            "Content-Type": "text/plain",
+            "X-Forwarded-For": ["1.1.1.1", "2.2.2.2"],
+            "X-Empty": [],
+            "x-custom-header": "value",
+        }
+    )
+
+    assert environ == {
+        "HTTP_CONTENT_TYPE": "text/plain",
+        "HTTP_X_FORWARDED_FOR": "2.2.2.2",
+        "HTTP_X_CUSTOM_HEADER": "value",
+    }
+    assert serverless_wsgi.CGI_HEADER_NAMES == {
+        "Content-Type": "HTTP_CONTENT_TYPE",
+        "X-Forwarded-For": "HTTP_X_FORWARDED_FOR",
+    }
+
+
+def test_handler_non_ascii_environ_v2(
+    mock_wsgi_app_file, mock_app, event_v2, wsgi_handler
+):
+    event_v2["rawPath"] = "/caf\u00e9"
+    event_v2["rawQueryString"] = "q=%C3%A6"
+    wsgi_handler.handler(event_v2, {})
+
+    environ = wsgi_handler.wsgi_app.last_environ
+    assert environ["PATH_INFO"] == "/caf\u00c3\u00a9"
+    assert environ["PATH_INFO"].encode("latin1").decode("utf-8") == "/caf\u00e9"
+    assert environ["QUERY_STRING"] == "q=%C3%A6"
+
+
 def test_handler_with_encoded_characters_in_path_v2(
     mock_wsgi_app_file, mock_app, event_v2, capsys, wsgi_handler
 ):
@@ -1087,3 +1955,539 @@ def test_handler_lambda_error(
     with pytest.raises(Exception, match='"statusCode": 400'):
         wsgi_handler.handler(event_lambda_integration, {
                              "memory_limit_in_mb": "128"})
+
+
+def test_handler_metrics(
+    mock_metrics_wsgi_app_file, mock_app, event_v2, capsys, monkeypatch, wsgi_handler
+):
+    import serverless_wsgi
+
+    monkeypatch.setattr(serverless_wsgi, "cold_start", True)
+    wsgi_handler.handler(event_v2, {})
+    wsgi_handler.handler(event_v2, {})
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(records) == 2
+
+    record = records[0]
+    assert record["_aws"]["CloudWatchMetrics"] == [
+        {
+            "Namespace": "test",
+            "Dimensions": [["FunctionName"]],
+            "Metrics": [
+                {"Name": "ColdStart", "Unit": "Count"},
+                {"Name": "TranslateTime", "Unit": "Milliseconds"},
+                {"Name": "AppTime", "Unit": "Milliseconds"},
+                {"Name": "ResponseSize", "Unit": "Bytes"},
+                {"Name": "EncodeTime", "Unit": "Milliseconds"},
+                {"Name": "TotalTime", "Unit": "Milliseconds"},
+            ],
+        }
+    ]
+    assert record["FunctionName"] == "api"
+    assert record["EventType"] == "v2"
+    assert record["StatusCode"] == 200
+    assert record["ColdStart"] == 1
+    assert record["ResponseSize"] == 16
+    assert record["TotalTime"] >= record["AppTime"]
+    assert records[1]["ColdStart"] == 0
+
+
+def test_handler_gc(
+    restore_gc, mock_gc_wsgi_app_file, mock_app, event_v2, capsys, caplog, wsgi_handler
+):
+    import gc
+
+    # Collecting between invocations is ignored outside of a custom runtime
+    assert gc.get_threshold() == (5000, 20, 20)
+    assert gc.get_freeze_count() > 0
+    assert gc.isenabled()
+    assert wsgi_handler.gc_threshold is None
+    messages = [record.getMessage() for record in caplog.get_records("setup")]
+    assert any("requires running as a custom runtime" in m for m in messages)
+
+    # Keep automatic collections out of the recorded metrics
+    gc.disable()
+    capsys.readouterr()
+
+    wsgi_handler.handler(event_v2, {})
+    gc.collect()
+    wsgi_handler.handler(event_v2, {})
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert {"Name": "GCTime", "Unit": "Milliseconds"} in (
+        records[0]["_aws"]["CloudWatchMetrics"][0]["Metrics"]
+    )
+    assert records[0]["GCCollections"] == 0
+    assert records[1]["GCCollections"] == 1
+    assert records[1]["GCTime"] > 0
+
+
+def test_configure_gc(restore_gc, mock_wsgi_app_file, mock_app, wsgi_handler):
+    import gc
+    import serverless_wsgi
+
+    assert not wsgi_handler.configure_gc({})
+    assert not wsgi_handler.configure_gc({"gc": True})
+    assert gc.get_freeze_count() > 0
+    assert gc.isenabled()
+    assert not serverless_wsgi.gc_monitor.installed
+
+    gc.unfreeze()
+    assert not wsgi_handler.configure_gc({"gc": {"freeze": False}})
+    assert gc.get_freeze_count() == 0
+
+    # Automatic collections stay enabled during invocations, less frequently
+    gc.set_threshold(700, 10, 10)
+    options = {"gc": {"freeze": False, "collect_between_invocations": True}}
+    assert wsgi_handler.configure_gc(options, custom_runtime=True) == (700, 10, 10)
+    assert gc.get_threshold() == (7000, 10, 10)
+    assert gc.isenabled()
+
+    gc.set_threshold(0)
+    assert wsgi_handler.configure_gc(options, custom_runtime=True) is None
+
+
+def test_collect_garbage(mock_wsgi_app_file, mock_app, monkeypatch, wsgi_handler):
+    import gc
+
+    collected = []
+    monkeypatch.setattr(gc, "collect", collected.append)
+
+    for count in ((100, 0, 0), (701, 3, 0), (701, 11, 0), (701, 11, 11)):
+        monkeypatch.setattr(gc, "get_count", lambda: count)
+        wsgi_handler.collect_garbage((700, 10, 10))
+    assert collected == [0, 1, 2]
+
+
+def test_handler_metrics_error(
+    mock_metrics_wsgi_app_file,
+    mock_app,
+    event_lambda_integration,
+    capsys,
+    wsgi_handler,
+):
+    mock_app.status_code = 400
+    with pytest.raises(Exception, match='"statusCode": 400'):
+        wsgi_handler.handler(event_lambda_integration, {})
+
+    record = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert record["EventType"] == "lambda-integration"
+    assert record["StatusCode"] == 400
+    assert "EncodeTime" not in record
+    assert "TotalTime" in record
+
+
+def test_handler_streaming(
+    mock_streaming_wsgi_app_file, mock_app, event_v2, wsgi_handler
+):
+    import serverless_wsgi
+
+    stream = serverless_wsgi.ResponseStream()
+    response = wsgi_handler.handler(event_v2, {}, stream)
+
+    assert response is None
+    assert stream.closed
+    assert stream.content_type == serverless_wsgi.STREAMING_CONTENT_TYPE
+
+    prelude, body = stream.getvalue().split(b"\x00" * 8)
+    assert json.loads(prelude) == {
+        "statusCode": 200,
+        "headers": {
+            "Content-Type": "text/plain; charset=utf-8",
+            "Content-Length": "16",
+        },
+        "cookies": [
+            "CUSTOMER=WILE_E_COYOTE; Path=/",
+            "PART_NUMBER=ROCKET_LAUNCHER_0002; Path=/",
+            "LOT_NUMBER=42; Path=/",
+        ],
+    }
+    assert body.decode("utf-8") == "Hello World ☃!"
+    assert wsgi_handler.wsgi_app.last_environ["PATH_INFO"] == "/some/path"
+
+
+def test_handler_streaming_chunks(
+    mock_streaming_wsgi_app_file, mock_app, event_v2, wsgi_handler
+):
+    import serverless_wsgi
+
+    stream = serverless_wsgi.ResponseStream()
+
+    def app(environ, start_response):
+        start_response(
+            "200 OK", [("Content-Type", "text/csv"), ("X-Part", "1"), ("x-part", "2")]
+        )
+        yield b"a,b\n"
+        # Previous chunk is forwarded before the next one is produced
+        assert stream.getvalue().endswith(b"\x00" * 8 + b"a,b\n")
+        yield b""
+        yield b"1,2\n"
+
+    wsgi_handler.wsgi_app = app
+    wsgi_handler.handler(event_v2, {}, stream)
+
+    prelude, body = stream.getvalue().split(b"\x00" * 8)
+    assert json.loads(prelude) == {
+        "statusCode": 200,
+        "headers": {"Content-Type": "text/csv", "X-Part": "1, 2"},
+    }
+    assert body == b"a,b\n1,2\n"
+
+
+def test_handler_streaming_empty_body(
+    mock_streaming_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    import serverless_wsgi
+
+    stream = serverless_wsgi.ResponseStream()
+
+    def app(environ, start_response):
+        start_response("204 No Content", [])
+        return []
+
+    wsgi_handler.wsgi_app = app
+    wsgi_handler.handler(event_v1, {}, stream)
+
+    assert stream.getvalue() == b'{"statusCode": 204, "headers": {}}' + b"\x00" * 8
+
+
+def test_handler_streaming_warmup(
+    mock_streaming_wsgi_app_file, mock_app, wsgi_handler, capsys
+):
+    import serverless_wsgi
+
+    stream = serverless_wsgi.ResponseStream()
+    wsgi_handler.handler({"source": "serverless-plugin-warmup"}, {}, stream)
+
+    assert stream.closed
+    assert stream.getvalue() == b""
+
+
+def test_handler_streaming_disabled(mock_wsgi_app_file, mock_app, event_v2, wsgi_handler):
+    import serverless_wsgi
+
+    stream = serverless_wsgi.ResponseStream()
+    response = wsgi_handler.handler(event_v2, {}, stream)
+
+    assert response["body"] == "Hello World ☃!"
+    assert not stream.started
+
+
+class MockRuntimeAPI(http.server.BaseHTTPRequestHandler):
+    events = []
+    requests = []
+
+    def do_GET(self):
+        body = json.dumps(self.events.pop(0)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Lambda-Runtime-Aws-Request-Id", "request-1")
+        self.send_header("Lambda-Runtime-Deadline-Ms", "0")
+        self.send_header("Lambda-Runtime-Trace-Id", "Root=1-trace")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if size == 0:
+                    break
+            body = b"".join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.requests.append((self.path, dict(self.headers), body))
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mock_runtime_api():
+    MockRuntimeAPI.events = []
+    MockRuntimeAPI.requests = []
+    server = http.server.HTTPServer(("127.0.0.1", 0), MockRuntimeAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_serve_runtime_api_streaming(
+    mock_streaming_wsgi_app_file, mock_app, event_v2, wsgi_handler, mock_runtime_api
+):
+    import serverless_wsgi
+
+    MockRuntimeAPI.events.append(event_v2)
+    serverless_wsgi.serve_runtime_api(
+        wsgi_handler.handler, mock_runtime_api, max_invocations=1
+    )
+
+    path, headers, body = MockRuntimeAPI.requests[0]
+    assert path == "/2018-06-01/runtime/invocation/request-1/response"
+    assert headers["Lambda-Runtime-Function-Response-Mode"] == "streaming"
+    assert headers["Content-Type"] == serverless_wsgi.STREAMING_CONTENT_TYPE
+    assert body.split(b"\x00" * 8)[1].decode("utf-8") == "Hello World ☃!"
+    assert os.environ.pop("_X_AMZN_TRACE_ID") == "Root=1-trace"
+
+
+def test_serve_runtime_api_buffered(
+    mock_wsgi_app_file, mock_app, event_v2, wsgi_handler, mock_runtime_api
+):
+    import serverless_wsgi
+
+    MockRuntimeAPI.events.append(event_v2)
+    invocations = []
+    serverless_wsgi.serve_runtime_api(
+        wsgi_handler.handler,
+        mock_runtime_api,
+        max_invocations=1,
+        after_invocation=lambda: invocations.append(len(MockRuntimeAPI.requests)),
+    )
+
+    path, headers, body = MockRuntimeAPI.requests[0]
+    assert path == "/2018-06-01/runtime/invocation/request-1/response"
+    assert json.loads(body)["body"] == "Hello World ☃!"
+    # Called once the response is sent
+    assert invocations == [1]
+    os.environ.pop("_X_AMZN_TRACE_ID")
+
+
+def test_serve_runtime_api_error(
+    mock_streaming_wsgi_app_file, mock_app, event_v2, wsgi_handler, mock_runtime_api, capsys
+):
+    import serverless_wsgi
+
+    def app(environ, start_response):
+        raise ValueError("Broken app")
+
+    wsgi_handler.wsgi_app = app
+    MockRuntimeAPI.events.append(event_v2)
+    serverless_wsgi.serve_runtime_api(
+        wsgi_handler.handler, mock_runtime_api, max_invocations=1
+    )
+
+    path, headers, body = MockRuntimeAPI.requests[0]
+    assert path == "/2018-06-01/runtime/invocation/request-1/error"
+    assert json.loads(body)["errorType"] == "ValueError"
+    assert json.loads(body)["errorMessage"] == "Broken app"
+    os.environ.pop("_X_AMZN_TRACE_ID")
+
+
+def test_event_dispatcher(
+    event_v1, event_v2, elb_event, event_lambda_integration, monkeypatch
+):
+    import serverless_wsgi
+
+    dispatcher = serverless_wsgi.dispatcher
+    monkeypatch.setattr(dispatcher, "cached", None)
+
+    assert dispatcher.get_translator(event_v1).name == "v1"
+    assert dispatcher.cached.name == "v1"
+    assert dispatcher.get_translator(event_v2).name == "v2"
+    assert dispatcher.get_translator(elb_event).name == "alb"
+    assert dispatcher.get_translator(event_lambda_integration).name == (
+        "lambda-integration"
+    )
+    assert dispatcher.get_translator({"path": "/"}).name == "v1"
+
+
+def test_event_dispatcher_cached(event_v2, monkeypatch):
+    import serverless_wsgi
+
+    dispatcher = serverless_wsgi.dispatcher
+    monkeypatch.setattr(dispatcher, "cached", None)
+    dispatcher.get_translator(event_v2)
+
+    # Only the signature of the cached translator is checked for later events
+    checked = []
+    for translator in dispatcher.translators:
+        monkeypatch.setattr(
+            translator,
+            "matches",
+            lambda event, matches=translator.matches, name=translator.name: (
+                checked.append(name) or matches(event)
+            ),
+        )
+
+    assert dispatcher.get_translator(event_v2).name == "v2"
+    assert checked == ["v2"]
+
+
+def test_handler_compression(
+    mock_compression_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    wsgi_handler.wsgi_app.cookie_count = 1
+    response = wsgi_handler.handler(event_v1, {})
+
+    body = base64.b64decode(response.pop("body"))
+    assert gzip.decompress(body).decode("utf-8") == "Hello World ☃!"
+    assert response == {
+        "headers": {
+            "Set-Cookie": "CUSTOMER=WILE_E_COYOTE; Path=/",
+            "Content-Type": "text/plain; charset=utf-8",
+            "Content-Encoding": "gzip",
+            "Content-Length": str(len(body)),
+            "Vary": "Accept-Encoding",
+        },
+        "statusCode": 200,
+        "isBase64Encoded": True,
+    }
+
+
+def test_handler_compression_v2(
+    mock_compression_wsgi_app_file, mock_app, event_v2, wsgi_handler
+):
+    event_v2["headers"]["Accept-Encoding"] = "br;q=1.0, gzip;q=0.8, *;q=0.1"
+    response = wsgi_handler.handler(event_v2, {})
+
+    assert response["isBase64Encoded"]
+    assert response["headers"]["Content-Encoding"] == "gzip"
+    assert gzip.decompress(base64.b64decode(response["body"])) == (
+        "Hello World ☃!".encode("utf-8")
+    )
+
+
+def test_handler_compression_rest_api(
+    mock_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    import serverless_wsgi
+
+    settings = serverless_wsgi.Settings.load(
+        {"compression": {"encodings": ["gzip"], "min_size": 10}}
+    )
+    event_v1["headers"]["Accept-Encoding"] = "gzip"
+
+    # REST APIs return base64 encoded bodies of text media types as is
+    response = serverless_wsgi.handle_request(mock_app, event_v1, {}, settings)
+    assert "Content-Encoding" not in response["headers"]
+    assert response["body"] == "Hello World ☃!"
+    assert not response["isBase64Encoded"]
+
+    # HTTP APIs decode the body for v1 payloads as well
+    event_v1["version"] = "1.0"
+    response = serverless_wsgi.handle_request(mock_app, event_v1, {}, settings)
+    assert response["headers"]["Content-Encoding"] == "gzip"
+    assert response["isBase64Encoded"]
+
+
+def test_handler_compression_vary(
+    mock_compression_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    def app(environ, start_response):
+        start_response(
+            "200 OK", [("Content-Type", "application/json"), ("Vary", "Cookie")]
+        )
+        return [b'{"message": "Hello World"}']
+
+    wsgi_handler.wsgi_app = app
+    response = wsgi_handler.handler(event_v1, {})
+
+    assert response["headers"]["Vary"] == "Cookie, Accept-Encoding"
+
+
+def test_handler_compression_multiple_vary(
+    mock_compression_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    vary = [("Vary", "Cookie"), ("Vary", "Origin, accept-encoding")]
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "application/json")] + vary)
+        return [b'{"message": "Hello World"}']
+
+    wsgi_handler.wsgi_app = app
+    response = wsgi_handler.handler(event_v1, {})
+    assert response["headers"]["Vary"] == "Cookie, Origin, accept-encoding"
+
+    vary[1] = ("Vary", "Origin")
+    response = wsgi_handler.handler(event_v1, {})
+    assert response["headers"]["Vary"] == "Cookie, Origin, Accept-Encoding"
+
+    vary[1] = ("Vary", "*")
+    response = wsgi_handler.handler(event_v1, {})
+    assert response["headers"]["Vary"] == "Cookie, *"
+
+
+def test_handler_compression_skipped(
+    mock_compression_wsgi_app_file, mock_app, event_v1, wsgi_handler
+):
+    headers = [("Content-Type", "text/plain")]
+
+    def app(environ, start_response):
+        start_response("200 OK", headers)
+        return [b"Hello World, uncompressed"]
+
+    wsgi_handler.wsgi_app = app
+
+    # Not accepted by client
+    event_v1["headers"]["Accept-Encoding"] = "identity, gzip;q=0"
+    response = wsgi_handler.handler(event_v1, {})
+    assert response["body"] == "Hello World, uncompressed"
+
+    # Already encoded
+    event_v1["headers"]["Accept-Encoding"] = "gzip"
+    headers.append(("Content-Encoding", "identity"))
+    response = wsgi_handler.handler(event_v1, {})
+    assert response["headers"]["Content-Encoding"] == "identity"
+    assert base64.b64decode(response["body"]) == b"Hello World, uncompressed"
+
+    # Binary MIME type
+    headers[:] = [("Content-Type", "image/jpeg")]
+    response = wsgi_handler.handler(event_v1, {})
+    assert "Content-Encoding" not in response["headers"]
+    assert base64.b64decode(response["body"]) == b"Hello World, uncompressed"
+
+    # Smaller than the default threshold
+    settings = wsgi_handler.serverless_wsgi.Settings.load({"compression": True})
+    response = wsgi_handler.serverless_wsgi.handle_request(
+        mock_app, event_v1, {}, settings
+    )
+    assert response["body"] == "Hello World ☃!"
+
+
+def test_negotiate_encoding(monkeypatch):
+    import serverless_wsgi
+
+    negotiate = serverless_wsgi.negotiate_encoding
+    assert negotiate("gzip, deflate, br", ("br", "gzip")) == "br"
+    assert negotiate("gzip, deflate", ("br", "gzip")) == "gzip"
+    assert negotiate("br;q=0.5, GZIP", ("br", "gzip")) == "gzip"
+    assert negotiate("*", ("br", "gzip")) == "br"
+    assert negotiate("*, br;q=0", ("br", "gzip")) == "gzip"
+    assert negotiate("gzip;q=invalid", ("gzip",)) is None
+    assert negotiate("", ("br", "gzip")) is None
+
+
+def test_settings_compression(monkeypatch):
+    import serverless_wsgi
+
+    monkeypatch.setattr(
+        serverless_wsgi,
+        "COMPRESSORS",
+        {"br": lambda body: b"br", "gzip": serverless_wsgi.compress_gzip},
+    )
+
+    settings = serverless_wsgi.Settings.load({"compression": True})
+    assert settings.compression == ("br", "gzip")
+    assert settings.compression_min_size == 1024
+
+    settings = serverless_wsgi.Settings.load(
+        {"compression": {"encodings": ["gzip", "deflate"], "min_size": 0}}
+    )
+    assert settings.compression == ("gzip",)
+    assert settings.compression_min_size == 0
+
+    assert serverless_wsgi.Settings.load({}).compression == ()
+    assert serverless_wsgi.Settings.load({"compression": False}).compression == ()
+    assert not serverless_wsgi.Settings.load({"compression": True}).compression_rest_api
+    assert serverless_wsgi.Settings.load(
+        {"compression": {"rest_api": True}}
+    ).compression_rest_api